@@ -15,15 +15,11 @@
 # ==============================================================================
 #  導入所需函式庫
 # ==============================================================================
-from flask import Flask, request, abort
-from linebot.v3 import WebhookHandler
+from flask import Flask, request, abort, jsonify
 from linebot.v3.exceptions import InvalidSignatureError
 # 主要 API 和請求/訊息類型從 messaging 導入
 from linebot.v3.messaging import (
     Configuration,
-    ApiClient,
-    MessagingApi,
-    MessagingApiBlob,  # 新增：用於處理 Rich Menu 圖片
     ReplyMessageRequest,
     TextMessage,
     ImageMessage,  # 新增：用於發送圖片
@@ -34,7 +30,6 @@ from linebot.v3.messaging import (
     FlexIcon,
     FlexButton,
     FlexSeparator,
-    FlexContainer,
     # Rich Menu 相關
     RichMenuRequest,  # 新增
     RichMenuSize,     # 新增
@@ -51,24 +46,37 @@ from linebot.v3.messaging import (
     # Quick Reply 相關
     QuickReply,      # 新增
     QuickReplyItem,   # 新增
-    PushMessageRequest
+    PushMessageRequest,
+    MulticastRequest
 )
 
 from linebot.v3.webhooks import (
     MessageEvent, FollowEvent, PostbackEvent, TextMessageContent,
 )
-from collections import Counter
-import re
 import os
 import time
-import json
+import threading
 from redis import Redis
 from datetime import datetime, timedelta, UTC, timezone
 from apscheduler.schedulers.background import BackgroundScheduler
 
 # 導入本地模組
 from config import get_config, Config, OrderConfig, LineBotConfig
-from database import app, db, DatabaseManager, GroupOrder, UserOrder
+from database import app, db, DatabaseManager, GroupOrder
+from webhook_queue import WebhookEventDispatcher, WebhookEventQueue, WebhookQueueFullError
+from write_behind import UserOrderWriteBehind
+from migrations import run_migrations
+from partitioning import run_partition_maintenance
+from expiry_engine import GroupExpiryEngine
+from leader_election import LeaderElection
+from notifier import MulticastNotifier, split_text
+from profile_cache import ProfileCache
+from line_client import PooledMessagingClient
+from asset_manifest import AssetManifest
+from message_cache import RenderedMessageCache
+import flex_messages
+import order_lines
+from order_parser import parse_order_message
 
 # ==============================================================================
 #  應用程式配置與初始化
@@ -80,57 +88,131 @@ env_config = get_config('development' if app.debug else 'production')
 # 初始化 Redis 客戶端
 redis_client = Redis.from_url(env_config.REDIS_URL, decode_responses=True)
 
+# 訂單 write-behind 佇列：未啟用時仍需在啟動時寫回先前留下的紀錄
+write_behind = UserOrderWriteBehind(
+    redis_client,
+    app.logger,
+    flush_interval=env_config.WRITE_BEHIND_FLUSH_INTERVAL_SECONDS,
+    batch_size=env_config.WRITE_BEHIND_BATCH_SIZE
+)
+
 # 初始化資料庫管理器
-db_manager = DatabaseManager(redis_client)
+db_manager = DatabaseManager(redis_client, write_behind=write_behind if env_config.WRITE_BEHIND_ENABLED else None)
 
 # LINE Bot SDK 配置
 configuration = Configuration(access_token=env_config.CHANNEL_ACCESS_TOKEN)
-line_handler = WebhookHandler(env_config.CHANNEL_SECRET)
+# 事件處理函式的對應表 (與 WebhookHandler 相同的介面，非同步模式下由佇列的 worker 逐一分派)
+line_handler = WebhookEventDispatcher(env_config.CHANNEL_SECRET)
+
+# 行程內共用的 LINE API 客戶端 (連線池與 keep-alive 連線跨事件重複使用)
+messaging_client = PooledMessagingClient(
+    configuration,
+    pool_size=env_config.LINE_API_POOL_SIZE,
+    timeout=env_config.LINE_API_TIMEOUT_SECONDS,
+    keep_alive=env_config.LINE_API_KEEP_ALIVE
+)
 
-# 使用者名稱快取
-user_names_cache = {}
+# 餐廳圖片資產清單 (啟動時掃描一次，之後由 reload_asset_manifest 定期檢查圖片是否更新)
+asset_manifest = AssetManifest(env_config.STATIC_FOLDER, env_config.MENU_DICT)
+
+# 靜態回覆訊息快取，餐廳設定或圖片清單版本改變時自動失效
+rendered_messages = RenderedMessageCache(
+    lambda: (asset_manifest.version, tuple(env_config.RESTAURANTS), tuple(env_config.MENU_DICT.items()))
+)
+
+# Webhook 非同步處理佇列 (未啟用時維持同步處理)
+webhook_queue = WebhookEventQueue(
+    line_handler,
+    app,
+    num_workers=env_config.WEBHOOK_WORKERS,
+    maxsize=env_config.WEBHOOK_QUEUE_MAXSIZE,
+    enqueue_timeout=env_config.WEBHOOK_ENQUEUE_TIMEOUT_SECONDS
+) if env_config.WEBHOOK_ASYNC_ENABLED else None
 
 # ==============================================================================
 #  輔助函式
 # ==============================================================================
 
+def fetch_display_name(user_id: str) -> str:
+    """呼叫 LINE API 取得使用者的顯示名稱。"""
+    return messaging_client.api.get_profile(user_id).display_name
+
+# 使用者名稱快取 (行程內 LRU + Redis 共用)
+profile_cache = ProfileCache(
+    redis_client,
+    fetch_display_name,
+    app.logger,
+    max_entries=env_config.PROFILE_CACHE_MAX_ENTRIES,
+    local_ttl=env_config.PROFILE_CACHE_LOCAL_TTL_SECONDS,
+    redis_ttl=env_config.PROFILE_CACHE_REDIS_TTL_SECONDS,
+    stale_ttl=env_config.PROFILE_CACHE_STALE_SECONDS,
+    stale_while_revalidate=env_config.PROFILE_CACHE_STALE_WHILE_REVALIDATE,
+    max_workers=env_config.PROFILE_FETCH_WORKERS
+)
+
 def get_user_name(user_id: str) -> str:
     """
     獲取 LINE 使用者的顯示名稱。
-    優先從記憶體快取讀取，若快取未命中則呼叫 LINE API 獲取。
+    依序查詢行程內快取、Redis 共用快取，皆未命中時才呼叫 LINE API 獲取。
     """
-    if user_id in user_names_cache:
-        return user_names_cache[user_id]
-    try:
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            profile = line_bot_api.get_profile(user_id)
-            user_name = profile.display_name
-            user_names_cache[user_id] = user_name
-            return user_name
-    except Exception as e:
-        app.logger.error(f"無法獲取用戶 {user_id} 的資料: {e}")
-        return f"用戶 {user_id[:5]}..."
+    return get_user_names([user_id])[user_id]
+
+def get_user_names(user_ids, timeout=None) -> dict:
+    """
+    批次獲取多位 LINE 使用者的顯示名稱。
+    快取未命中的使用者會同時向 LINE API 查詢，無法取得或超過 timeout 秒者以預設名稱代替。
+    """
+    names = profile_cache.get_many(user_ids, timeout=timeout)
+    return {user_id: names.get(user_id) or f"用戶 {user_id[:5]}..." for user_id in user_ids}
 
 @app.route("/callback", methods=["POST"])
 def callback():
     """
     接收 LINE Platform 送來的 Webhook 請求。
-    驗證簽名，並將請求交由 WebhookHandler 處理。
+    驗證簽名，並將請求交由 line_handler 處理；
+    啟用非同步模式時，事件排入佇列後立即回覆，佇列已滿時回覆 503 讓 LINE Platform 重送。
     """
     signature = request.headers["X-Line-Signature"]
     body = request.get_data(as_text=True)
     app.logger.info("Request body: " + body)
+    # 以 WSGI 伺服器啟動時不會執行 __main__，於第一個請求時啟動背景工作 (資料庫遷移於背景執行緒套用，不會阻塞請求)
+    start_background_services()
+    if not is_database_ready():
+        # 遷移完成前資料表可能缺少新欄位，回覆 503 讓 LINE Platform 稍後重送，不在請求中等待 DDL
+        app.logger.warning(f"資料庫遷移尚未完成 ({_migration_status['state']})，暫不處理 Webhook")
+        abort(503)
     try:
-        line_handler.handle(body, signature)
+        if webhook_queue is not None:
+            webhook_queue.enqueue(body, signature, request.url_root)
+        else:
+            line_handler.handle(body, signature)
     except InvalidSignatureError:
         app.logger.error("Invalid signature. Check your channel access token/secret.")
         abort(400)
+    except WebhookQueueFullError as e:
+        # 回覆 503 讓 LINE Platform 重送，而不是回覆 200 後遺失事件
+        app.logger.error(str(e))
+        abort(503)
     except Exception as e:
         app.logger.error(f"Error handling webhook: {e}")
         abort(500)
     return "OK"
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """回傳快取命中來源與 Webhook 佇列的運行指標"""
+    return jsonify({
+        'active_orders_snapshot': db_manager.get_snapshot_stats(),
+        'profile_cache': profile_cache.get_stats(),
+        'line_api_connections': messaging_client.get_connection_stats(),
+        'webhook_queue': webhook_queue.get_metrics() if webhook_queue is not None else None,
+        'write_behind': write_behind.get_metrics() if env_config.WRITE_BEHIND_ENABLED else None,
+        'expiry_engine': expiry_engine.get_metrics(),
+        'scheduler_leader': scheduler_election.get_metrics() if scheduler_election is not None else None,
+        'close_notifier': close_notifier.get_metrics(),
+        'schema_migration': dict(_migration_status)
+    })
+
 @line_handler.add(FollowEvent)
 def handle_follow(event):
     """
@@ -139,7 +221,7 @@ def handle_follow(event):
     """
     user_id = event.source.user_id
     welcome_message = "歡迎加入Twinkle團購機器人，您可以透過下方功能列進行相關操作或查看說明"
-    line_bot_api.reply_message(
+    messaging_client.api.reply_message(
         ReplyMessageRequest(
             reply_token=event.reply_token,
             messages=[TextMessage(text=welcome_message)]
@@ -153,55 +235,54 @@ def handle_message(event):
     處理收到的文字訊息。
     根據訊息內容，執行不同的訂餐機器人功能。
     """
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        user_id = event.source.user_id
-        text = event.message.text.strip()
+    line_bot_api = messaging_client.api
+    user_id = event.source.user_id
+    text = event.message.text.strip()
 
-        # 檢查使用者是否正在等待輸入備註
-        state_key = f'user_state:{user_id}'
-        user_state = redis_client.hgetall(state_key)
+    # 檢查使用者是否正在等待輸入備註
+    state_key = f'user_state:{user_id}'
+    user_state = redis_client.hgetall(state_key)
+    
+    if user_state and user_state.get('state') == 'waiting_note_input':
+        group_order_id = user_state.get('group_order_id')
+        item = user_state.get('item')
+        new_note = text
         
-        if user_state and user_state.get('state') == 'waiting_note_input':
-            group_order_id = user_state.get('group_order_id')
-            item = user_state.get('item')
-            new_note = text
-            
-            # 清除狀態
-            redis_client.delete(state_key)
-            
-            if new_note.lower() == '取消':
-                reply_text = "已取消修改備註。"
-                # 可以選擇重新顯示修改介面
-                handle_edit_order(event, line_bot_api, group_order_id, user_id)
-                # line_bot_api.reply_message(
-                #     ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply_text)])
-                # )
-            else:
-                # 調用更新備註的函數 (注意：我們需要修改 handle_update_note)
-                handle_update_note(event, line_bot_api, group_order_id, item, new_note)
-                # handle_update_note 會處理回覆和重新顯示介面，所以這裡不用再回覆
-            return # 處理完畢，結束此函數
-
-        # --- 功能分支判斷 ---
-        if text == "開團":
-            handle_start_group_selection(event, line_bot_api)
-        elif text == "我的開團":
-            handle_show_user_closed_groups(event, line_bot_api, user_id)
-        elif text.endswith("開團"):
-            handle_create_group_intent(event, line_bot_api, text, user_id)
-        elif text == "閉團":
-            handle_close_group_selection(event, line_bot_api, user_id)
-        elif text.endswith("閉團") and text != "閉團":
-            handle_close_group_action(event, line_bot_api, text, user_id)
-        elif text == "目前團購":
-            handle_show_active_groups(event, line_bot_api)
-        elif text.startswith("我要點"):
-            handle_add_order_item(event, line_bot_api, text, user_id)
-        elif text == "我的訂單":
-            handle_user_order_summary(event, line_bot_api)
-        elif redis_client.exists(f'waiting_time_input:{user_id}'):
-            handle_custom_close_time_input(event, line_bot_api, text, user_id)
+        # 清除狀態
+        redis_client.delete(state_key)
+        
+        if new_note.lower() == '取消':
+            reply_text = "已取消修改備註。"
+            # 可以選擇重新顯示修改介面
+            handle_edit_order(event, line_bot_api, group_order_id, user_id)
+            # line_bot_api.reply_message(
+            #     ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply_text)])
+            # )
+        else:
+            # 調用更新備註的函數 (注意：我們需要修改 handle_update_note)
+            handle_update_note(event, line_bot_api, group_order_id, item, new_note)
+            # handle_update_note 會處理回覆和重新顯示介面，所以這裡不用再回覆
+        return # 處理完畢，結束此函數
+
+    # --- 功能分支判斷 ---
+    if text == "開團":
+        handle_start_group_selection(event, line_bot_api)
+    elif text == "我的開團":
+        handle_show_user_closed_groups(event, line_bot_api, user_id)
+    elif text.endswith("開團"):
+        handle_create_group_intent(event, line_bot_api, text, user_id)
+    elif text == "閉團":
+        handle_close_group_selection(event, line_bot_api, user_id)
+    elif text.endswith("閉團") and text != "閉團":
+        handle_close_group_action(event, line_bot_api, text, user_id)
+    elif text == "目前團購":
+        handle_show_active_groups(event, line_bot_api)
+    elif text.startswith("我要點"):
+        handle_add_order_item(event, line_bot_api, text, user_id)
+    elif text == "我的訂單":
+        handle_user_order_summary(event, line_bot_api)
+    elif redis_client.exists(f'waiting_time_input:{user_id}'):
+        handle_custom_close_time_input(event, line_bot_api, text, user_id)
 
 @line_handler.add(PostbackEvent)
 def handle_postback(event):
@@ -209,133 +290,200 @@ def handle_postback(event):
     處理使用者點擊 Template Message 中的按鈕 (PostbackAction) 所觸發的事件。
     根據 postback data 執行相應操作。
     """
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        data = event.postback.data
-        user_id = event.source.user_id
-        params = event.postback.params if hasattr(event.postback, 'params') else {}
+    line_bot_api = messaging_client.api
+    data = event.postback.data
+    user_id = event.source.user_id
+    params = event.postback.params if hasattr(event.postback, 'params') else {}
+    
+    # 解析 postback 數據
+    if "action=" in data:
+        action = data.split("action=")[1].split("&")[0]
+        params = dict(param.split("=") for param in data.split("&")[1:])
         
-        # 解析 postback 數據
-        if "action=" in data:
-            action = data.split("action=")[1].split("&")[0]
-            params = dict(param.split("=") for param in data.split("&")[1:])
-            
-            if action == "edit_order":
-                handle_edit_order(event, line_bot_api, params.get("group_order_id"), user_id)
-            elif action == "increase_item":
-                handle_increase_item(event, line_bot_api, params.get("group_order_id"), params.get("item"))
-            elif action == "decrease_item":
-                handle_decrease_item(event, line_bot_api, params.get("group_order_id"), params.get("item"))
-            elif action == "prompt_update_note":
-                group_order_id = params.get("group_order_id")
-                item = params.get("item")
-                if group_order_id and item:
-                    # 將使用者狀態存入 Redis，表示正在等待輸入備註
-                    state_key = f'user_state:{user_id}'
-                    redis_client.hset(state_key, mapping={
-                        'state': 'waiting_note_input',
-                        'group_order_id': group_order_id,
-                        'item': item
-                    })
-                    # 設置一個超時時間，例如 5 分鐘
-                    redis_client.expire(state_key, 300)
-
-                    # 解析原始商品名稱
-                    item_name = item
-                    if "(" in item and ")" in item:
-                        item_name = item[:item.find("(")]
-
-                    reply_text = f"請輸入【{item_name}】的新備註：(輸入\"取消\"可放棄)"
-                    line_bot_api.reply_message(
-                        ReplyMessageRequest(
-                            reply_token=event.reply_token,
-                            messages=[TextMessage(text=reply_text)]
-                        )
+        if action == "edit_order":
+            handle_edit_order(event, line_bot_api, params.get("group_order_id"), user_id)
+        elif action == "increase_item":
+            handle_increase_item(event, line_bot_api, params.get("group_order_id"), params.get("item"))
+        elif action == "decrease_item":
+            handle_decrease_item(event, line_bot_api, params.get("group_order_id"), params.get("item"))
+        elif action == "prompt_update_note":
+            group_order_id = params.get("group_order_id")
+            item = params.get("item")
+            if group_order_id and item:
+                # 將使用者狀態存入 Redis，表示正在等待輸入備註
+                state_key = f'user_state:{user_id}'
+                redis_client.hset(state_key, mapping={
+                    'state': 'waiting_note_input',
+                    'group_order_id': group_order_id,
+                    'item': item
+                })
+                # 設置一個超時時間，例如 5 分鐘
+                redis_client.expire(state_key, 300)
+
+                # 解析原始商品名稱
+                item_name = item
+                if "(" in item and ")" in item:
+                    item_name = item[:item.find("(")]
+
+                reply_text = f"請輸入【{item_name}】的新備註：(輸入\"取消\"可放棄)"
+                line_bot_api.reply_message(
+                    ReplyMessageRequest(
+                        reply_token=event.reply_token,
+                        messages=[TextMessage(text=reply_text)]
                     )
-                else:
-                    app.logger.error("處理 prompt_update_note 時缺少參數")
-            elif action == "update_note":
-                # 這個 action 實際上已不再被 Flex Message 使用，但保留以防萬一
-                # 如果需要處理來自舊介面或其他來源的此 action，可以在這裡加入邏輯
-                app.logger.warning(f"收到已棄用的 update_note action: {params}")
-                pass # 或添加處理邏輯
-            elif action == "save_edit":
-                handle_save_edit(event, line_bot_api, params.get("group_order_id"))
-            elif action == "clear_my_order":
-                handle_delete_order_action(event, line_bot_api, params.get("group_order_id"), user_id)
-        else:
-            app.logger.info(f"收到 Postback: data={data}, params={params}, user_id={user_id}")
-
-            # --- Postback 功能分支判斷 ---
-            ## 結束此團購
-            if data.startswith("close_group_"):
-                restaurant = data.replace("close_group_", "")
-                handle_close_group_action(event, line_bot_api, restaurant, user_id)
-            ## 選擇此團購
-            elif data.startswith("select_group_"):
-                group_order_id = data.replace("select_group_", "")
-                handle_select_group_action(event, line_bot_api, group_order_id, user_id)
-            ## 編輯訂單
-            elif data.startswith("edit_order_"):
-                group_order_id = data.replace("edit_order_", "")
-                handle_edit_order(event, line_bot_api, group_order_id, user_id)
-            ## 查看菜單
-            elif data.startswith("menu_"):
-                restaurant = data.replace("menu_", "")
-                handle_show_menu_action(event, line_bot_api, restaurant)
-            ## 刪除訂單 
-            elif data.startswith("delete_order_"):
-                group_order_id = data.replace("delete_order_", "")
-                handle_delete_order_action(event, line_bot_api, group_order_id, user_id)
-            ## 設定閉團時間
-            elif data.startswith("set_time_"):
-                group_order_id = data.replace("set_time_", "")
-                handle_set_close_time_action(event, line_bot_api, group_order_id, user_id, params)
+                )
+            else:
+                app.logger.error("處理 prompt_update_note 時缺少參數")
+        elif action == "update_note":
+            # 這個 action 實際上已不再被 Flex Message 使用，但保留以防萬一
+            # 如果需要處理來自舊介面或其他來源的此 action，可以在這裡加入邏輯
+            app.logger.warning(f"收到已棄用的 update_note action: {params}")
+            pass # 或添加處理邏輯
+        elif action == "save_edit":
+            handle_save_edit(event, line_bot_api, params.get("group_order_id"))
+        elif action == "clear_my_order":
+            handle_delete_order_action(event, line_bot_api, params.get("group_order_id"), user_id)
+    else:
+        app.logger.info(f"收到 Postback: data={data}, params={params}, user_id={user_id}")
+
+        # --- Postback 功能分支判斷 ---
+        ## 結束此團購
+        if data.startswith("close_group_"):
+            restaurant = data.replace("close_group_", "")
+            handle_close_group_action(event, line_bot_api, restaurant, user_id)
+        ## 選擇此團購
+        elif data.startswith("select_group_"):
+            group_order_id = data.replace("select_group_", "")
+            handle_select_group_action(event, line_bot_api, group_order_id, user_id)
+        ## 編輯訂單
+        elif data.startswith("edit_order_"):
+            group_order_id = data.replace("edit_order_", "")
+            handle_edit_order(event, line_bot_api, group_order_id, user_id)
+        ## 查看菜單
+        elif data.startswith("menu_"):
+            restaurant = data.replace("menu_", "")
+            handle_show_menu_action(event, line_bot_api, restaurant)
+        ## 刪除訂單 
+        elif data.startswith("delete_order_"):
+            group_order_id = data.replace("delete_order_", "")
+            handle_delete_order_action(event, line_bot_api, group_order_id, user_id)
+        ## 設定閉團時間
+        elif data.startswith("set_time_"):
+            group_order_id = data.replace("set_time_", "")
+            handle_set_close_time_action(event, line_bot_api, group_order_id, user_id, params)
 
 def create_rich_menu():
     """創建 LINE Bot 的 Rich Menu"""
     try:
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            line_bot_blob_api = MessagingApiBlob(api_client)
-
-            rich_menu_request = RichMenuRequest(
-                size=RichMenuSize(**env_config.RICH_MENU_SIZE),
-                selected=True,
-                name="圖文選單 1",
-                chat_bar_text="查看更多資訊",
-                areas=[
-                    RichMenuArea(
-                        bounds=RichMenuBounds(**area['bounds']),
-                        action=MessageAction(text=area['action'])
-                    ) for area in LineBotConfig.RICH_MENU_AREAS
-                ]
-            )
+        line_bot_api = messaging_client.api
+        line_bot_blob_api = messaging_client.blob_api
+
+        rich_menu_request = RichMenuRequest(
+            size=RichMenuSize(**env_config.RICH_MENU_SIZE),
+            selected=True,
+            name="圖文選單 1",
+            chat_bar_text="查看更多資訊",
+            areas=[
+                RichMenuArea(
+                    bounds=RichMenuBounds(**area['bounds']),
+                    action=MessageAction(text=area['action'])
+                ) for area in LineBotConfig.RICH_MENU_AREAS
+            ]
+        )
 
-            rich_menu_id = line_bot_api.create_rich_menu(rich_menu_request=rich_menu_request).rich_menu_id
-            print(f"Rich menu created: {rich_menu_id}")
+        rich_menu_id = line_bot_api.create_rich_menu(rich_menu_request=rich_menu_request).rich_menu_id
+        print(f"Rich menu created: {rich_menu_id}")
 
-            with open(f"{env_config.STATIC_FOLDER}/{env_config.RICH_MENU_IMAGE}", 'rb') as image:
-                line_bot_blob_api.set_rich_menu_image(
-                    rich_menu_id=rich_menu_id,
-                    body=bytearray(image.read()),
-                    _headers={'Content-Type': 'image/png'}
-                )
-            print("Rich menu image uploaded")
+        with open(f"{env_config.STATIC_FOLDER}/{env_config.RICH_MENU_IMAGE}", 'rb') as image:
+            line_bot_blob_api.set_rich_menu_image(
+                rich_menu_id=rich_menu_id,
+                body=bytearray(image.read()),
+                _headers={'Content-Type': 'image/png'}
+            )
+        print("Rich menu image uploaded")
 
-            line_bot_api.set_default_rich_menu(rich_menu_id=rich_menu_id)
-            print("Rich menu set as default")
-            return rich_menu_id
+        line_bot_api.set_default_rich_menu(rich_menu_id=rich_menu_id)
+        print("Rich menu set as default")
+        return rich_menu_id
     except Exception as e:
         print(f"Error creating rich menu: {e}")
         return None
 
+def migrate_database():
+    """
+    建立不存在的資料表並套用尚未套用的結構遷移 (包含 upsert 需要的唯一索引與新增的欄位)
+    遷移以 advisory lock 執行，多個行程同時呼叫時只有一個行程套用，其他行程等待後略過。
+    """
+    global _database_migrated
+    with app.app_context():
+        db.create_all()
+    applied = run_migrations()
+    if applied:
+        app.logger.info(f"已套用資料庫遷移: {', '.join(applied)}")
+    _database_migrated = True
+    _migration_status.update(state='applied', applied=applied, last_error=None)
+
+def _migrate_database_with_retry():
+    """背景執行緒：套用資料庫遷移，失敗時以指數退避重試，嘗試 MIGRATION_MAX_ATTEMPTS 次後停止"""
+    backoff = env_config.MIGRATION_RETRY_BACKOFF_SECONDS
+    for attempt in range(1, env_config.MIGRATION_MAX_ATTEMPTS + 1):
+        _migration_status.update(state='running', attempts=attempt)
+        try:
+            migrate_database()
+            return
+        except Exception as e:
+            _migration_status['last_error'] = str(e)
+            app.logger.error(f"套用資料庫遷移失敗 (第 {attempt} 次): {e}")
+        if attempt < env_config.MIGRATION_MAX_ATTEMPTS:
+            time.sleep(backoff)
+            backoff *= 2
+    _migration_status['state'] = 'failed'
+    app.logger.error("已停止重試資料庫遷移，請於部署步驟執行 python migrations.py upgrade")
+
+def is_database_ready():
+    """資料庫結構是否已是目前版本 (AUTO_MIGRATE=false 時由部署步驟負責，視為已完成)"""
+    return _database_migrated or not env_config.AUTO_MIGRATE
+
+def start_database_migration():
+    """
+    以 WSGI 伺服器 (含 Vercel) 啟動時不會執行 __main__ 的 initialize_redis_and_db，
+    改於背景執行緒套用遷移；請求不會等待 DDL 或 advisory lock，遷移完成前 /callback 回覆 503 讓 LINE Platform 重送，
+    避免事件處理函式查詢尚未建立的欄位。
+    每個行程只啟動一次，重試次數用盡後不再重試，結果見 /metrics 的 schema_migration。
+    AUTO_MIGRATE=false 時改由部署步驟執行 python migrations.py upgrade。
+    """
+    global _migration_started
+    if _migration_started or _database_migrated or not env_config.AUTO_MIGRATE:
+        return
+    with _migration_lock:
+        if _migration_started or _database_migrated:
+            return
+        _migration_started = True
+        threading.Thread(target=_migrate_database_with_retry, name='schema-migration', daemon=True).start()
+
 def initialize_redis_and_db():
     try:
-        # 確保資料庫表格存在
-        with app.app_context():
-            db.create_all()
+        # 確保資料庫表格存在，並套用尚未套用的結構遷移
+        try:
+            migrate_database()
+        except Exception as e:
+            _migration_status.update(state='failed', attempts=1, last_error=str(e))
+            print(f"套用資料庫遷移失敗，訂單更新可能無法使用 upsert: {e}")
+
+        # 分區表需確保本月與未來的分區存在，寫入才不會失敗
+        if env_config.PARTITIONING_ENABLED:
+            run_partition_maintenance()
             
+        # 清除 Redis 前，先將尚未寫回 PostgreSQL 的訂單變更寫回
+        try:
+            replayed = write_behind.replay()
+            if replayed:
+                print(f"已寫回 {replayed} 筆尚未同步的訂單變更")
+        except Exception as e:
+            # Redis 中仍有 PostgreSQL 沒有的變更，不可清除後由 PostgreSQL 重建
+            print(f"寫回尚未同步的訂單變更時發生錯誤，保留現有的 Redis 資料: {e}")
+            return
+
         # 清除所有 Redis 資料
         all_keys = redis_client.keys('*')
         
@@ -343,38 +491,194 @@ def initialize_redis_and_db():
         if all_keys:
             redis_client.delete(*all_keys)
         
-        # 從 PostgreSQL 讀取活躍訂單
-        with app.app_context():
-            active_orders = GroupOrder.query.filter_by(status='open').all()
-            for order in active_orders:
-                # 重新將活躍訂單寫入 Redis，使用 hset 替代 hmset
-                redis_client.hset(
-                    f'group_order:{order.id}',
-                    mapping={
-                        'restaurant': str(order.restaurant),
-                        'leader_id': str(order.leader_id),
-                        'status': 'open'
-                    }
-                )
-                
-                # 同步該團購的所有用戶訂單
-                user_orders = UserOrder.query.filter_by(group_order_id=order.id).all()
-                for user_order in user_orders:
-                    redis_client.hset(
-                        f'group_order:{order.id}:orders',
-                        user_order.user_id,
-                        json.dumps(user_order.items)
-                    )
+        # 從 PostgreSQL 讀取活躍訂單，並重建 Redis 快取與活躍團購索引
+        db_manager.rebuild_active_orders_cache()
                     
     except Exception as e:
         print(f"初始化資料庫時發生錯誤: {e}")
 
-# 定時檢查並關閉到期的團購
-def check_and_close_orders():
-    print("檢查是否有需要自動閉團的團購...")
+def send_multicast(to, messages, retry_key):
+    """以 LINE multicast 發送訊息，retry_key 讓重試不會重複發送"""
+    messaging_client.api.multicast(MulticastRequest(to=to, messages=messages), x_line_retry_key=retry_key)
+
+# 閉團通知：每個團購的摘要以 multicast 一次發送給所有收件者
+close_notifier = MulticastNotifier(
+    send_multicast,
+    app.logger,
+    max_workers=env_config.CLOSE_NOTIFY_WORKERS,
+    batch_size=env_config.CLOSE_NOTIFY_BATCH_SIZE,
+    rate_per_second=env_config.CLOSE_NOTIFY_RATE_PER_SECOND,
+    max_retries=env_config.CLOSE_NOTIFY_MAX_RETRIES,
+    backoff_seconds=env_config.CLOSE_NOTIFY_BACKOFF_SECONDS
+)
+
+def build_closing_summary(restaurant, all_orders, totals, user_names, closing_note="團購已關閉！"):
+    """
+    生成閉團時的訂單摘要 (手動閉團的回覆與閉團通知共用)
+    totals 為 db_manager 維護的品項總數，不需重新統計所有訂單。
+    """
+    summary = f"【{restaurant}】團購訂單明細：\n=================\n"
+    
+    if all_orders:
+        # 添加總訂單統計
+        summary += "總訂單統計：\n"
+        for item, count in totals.items():
+            summary += f"{item}: {count}份\n"
+        
+        # 添加個人訂單明細
+        summary += "\n個人訂單明細：\n"
+        for user_id, items in all_orders.items():
+            user_name = user_names[user_id]
+            personal_items = ", ".join([f"{item}*{count}" for item, count in order_lines.quantities(items).items()])
+            summary += f"{user_name}：{personal_items}\n"
+    else:
+        summary += "沒有任何訂單。\n"
+        
+    summary += f"=================\n{closing_note}"
+    return summary
+
+def notify_closing_summary(summary, recipient_ids):
+    """將閉團摘要以 multicast 發送給收件者 (不等待發送完成)"""
+    if env_config.CLOSE_NOTIFY_ENABLED:
+        close_notifier.notify(recipient_ids, [TextMessage(text=text) for text in split_text(summary)])
+
+# 到期引擎自動關閉團購後的處理
+def handle_expired_orders(closed_orders):
+    print(f"已自動關閉 {len(closed_orders)} 個團購: {[order['id'] for order in closed_orders]}")
+    if not env_config.CLOSE_NOTIFY_ENABLED:
+        return
+    try:
+        # 以一個 Redis pipeline 取得所有團購的訂單，並一次查詢所有參與者名稱
+        group_ids = [order['id'] for order in closed_orders]
+        orders_by_group = db_manager.get_user_orders_many(group_ids)
+        totals_by_group = db_manager.get_group_totals_many(group_ids)
+        participant_ids = [user_id for all_orders in orders_by_group.values() for user_id in all_orders]
+        user_names = get_user_names(participant_ids, timeout=env_config.PROFILE_PREFETCH_DEADLINE_SECONDS)
+        for order in closed_orders:
+            all_orders = orders_by_group[order['id']]
+            summary = build_closing_summary(
+                order['restaurant'], all_orders, totals_by_group[order['id']], user_names, "已到閉團時間，團購已自動關閉！"
+            )
+            notify_closing_summary(summary, [order['leader_id'], *all_orders])
+    except Exception as e:
+        app.logger.error(f"發送自動閉團通知時發生錯誤: {e}")
+
+# 到期引擎：依 Redis 的到期佇列在閉團時間準時關閉團購，閉團時間變更時由 db_manager 喚醒
+expiry_engine = GroupExpiryEngine(
+    db_manager,
+    app.logger,
+    max_sleep=env_config.EXPIRY_MAX_SLEEP_SECONDS,
+    on_closed=handle_expired_orders
+)
+
+# 背景工作 (自動閉團、分區維護) 的執行方式，見 config.SCHEDULER_MODE
+scheduler = BackgroundScheduler()
+scheduler_election = LeaderElection(
+    redis_client,
+    'scheduler',
+    app.logger,
+    lease_seconds=env_config.SCHEDULER_LEASE_SECONDS,
+    heartbeat_interval=env_config.SCHEDULER_HEARTBEAT_SECONDS,
+    on_elected=expiry_engine.start,
+    on_demoted=expiry_engine.stop
+) if env_config.SCHEDULER_MODE == 'leader' else None
+_background_started = False
+_background_lock = threading.Lock()
+_database_migrated = False
+_migration_started = False
+_migration_lock = threading.Lock()
+# 資料庫遷移的狀態 (disabled / pending / running / applied / failed)，於 /metrics 回報
+_migration_status = {
+    'state': 'pending' if env_config.AUTO_MIGRATE else 'disabled',
+    'attempts': 0,
+    'applied': [],
+    'last_error': None
+}
+
+def is_scheduler_active():
+    """本行程是否應執行背景工作"""
+    if env_config.SCHEDULER_MODE == 'local':
+        return True
+    return scheduler_election is not None and scheduler_election.is_leader
+
+def run_scheduled_partition_maintenance():
+    # 每個行程都有排程，只有 leader 實際執行
+    if is_scheduler_active():
+        run_partition_maintenance()
+
+def run_scheduled_expiry_sweep():
+    """
+    到期佇列的安全網：直接查詢 PostgreSQL (部分索引 ix_group_orders_open_close_time) 關閉已到期的團購
+    開團時寫入到期佇列失敗或佇列遺失時，團購最晚在一個掃描間隔後關閉。
+    """
+    if not is_scheduler_active():
+        return
     closed_orders = db_manager.check_and_close_expired_orders()
     if closed_orders:
-        print(f"已自動關閉 {len(closed_orders)} 個團購")
+        app.logger.warning(f"到期佇列遺漏的團購已由定期掃描關閉: {[order['id'] for order in closed_orders]}")
+        handle_expired_orders(closed_orders)
+    try:
+        # PostgreSQL 已關閉但 Redis 更新失敗的團購，在 Redis 中補上關閉狀態
+        synced_orders = db_manager.sync_closed_groups()
+        if synced_orders:
+            app.logger.warning(f"已同步 Redis 中未關閉的團購: {[order['id'] for order in synced_orders]}")
+    except Exception as e:
+        app.logger.error(f"同步已關閉團購的 Redis 狀態時發生錯誤: {e}")
+
+def reload_asset_manifest():
+    """餐廳圖片更新時重新建立圖片清單；清單版本改變後快取的訊息自動失效"""
+    try:
+        if asset_manifest.reload_if_changed():
+            app.logger.info(f"餐廳圖片已更新，圖片清單版本: {asset_manifest.version}")
+    except Exception as e:
+        app.logger.error(f"重新建立圖片清單時發生錯誤: {e}")
+
+def run_scheduled_totals_check():
+    """核對活躍團購的品項總數與點餐人數，不一致時由訂單重建"""
+    if not is_scheduler_active():
+        return
+    try:
+        mismatched = db_manager.check_group_totals()
+        if mismatched:
+            app.logger.warning(f"已重建 {len(mismatched)} 個團購的品項總數: {mismatched}")
+    except Exception as e:
+        app.logger.error(f"核對團購品項總數時發生錯誤: {e}")
+
+def start_background_services():
+    """於背景套用資料庫遷移，並依 SCHEDULER_MODE 啟動到期引擎與定時任務 (重複呼叫不會重複啟動)"""
+    global _background_started
+    start_database_migration()
+    if _background_started:
+        return
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+        # 圖片清單屬於各個行程，不論 SCHEDULER_MODE 都需定期檢查
+        scheduler.add_job(
+            reload_asset_manifest, 'interval', seconds=env_config.ASSET_MANIFEST_CHECK_INTERVAL_SECONDS,
+            id='asset_manifest_job'
+        )
+        scheduler.start()
+        if env_config.SCHEDULER_MODE == 'off':
+            app.logger.info("SCHEDULER_MODE=off，本行程不執行自動閉團與定時任務。")
+            return
+        scheduler.add_job(
+            run_scheduled_expiry_sweep, 'interval', minutes=env_config.EXPIRY_SWEEP_INTERVAL_MINUTES, id='expiry_sweep_job'
+        )
+        scheduler.add_job(
+            run_scheduled_totals_check, 'interval', minutes=env_config.TOTALS_CHECK_INTERVAL_MINUTES, id='totals_check_job'
+        )
+        if env_config.PARTITIONING_ENABLED:
+            # 每日預先建立未來的分區，並分離超過保留期限的分區
+            scheduler.add_job(run_scheduled_partition_maintenance, 'cron', hour=4, id='partition_maintenance_job')
+        if scheduler_election is not None:
+            # 由取得 leader 鎖的行程執行到期引擎，leader 中斷時由其他行程接手
+            scheduler_election.start()
+            app.logger.info("已加入背景工作的 leader 選舉。")
+        else:
+            expiry_engine.start()
+            app.logger.info("到期引擎已啟動，團購將於閉團時間自動關閉。")
 
 def get_user_closed_group_orders_summary(leader_id):
     """根據 leader_id 獲取該使用者開的已關閉團購的訂單資訊明細"""
@@ -388,31 +692,31 @@ def get_user_closed_group_orders_summary(leader_id):
         summary = "已關閉團購訂單明細：\n"
         summary += "=================\n"
 
+        # 以一個 Redis pipeline 取得所有團購的訂單，並一次預先查詢所有參與者名稱
+        group_ids = [order.id for order in closed_group_orders]
+        orders_by_group = db_manager.get_user_orders_many(group_ids)
+        totals_by_group = db_manager.get_group_totals_many(group_ids)
+        participant_ids = [user_id for all_orders in orders_by_group.values() for user_id in all_orders]
+        user_names = get_user_names(participant_ids, timeout=env_config.PROFILE_PREFETCH_DEADLINE_SECONDS)
+
         for order in closed_group_orders:
             restaurant = order.restaurant
-            order_id = order.id
             
             # 獲取該團購的所有用戶訂單
-            all_orders = db_manager.get_user_orders(order_id)
+            all_orders = orders_by_group[order.id]
             if all_orders:
-                # 統計訂單
-                counter = Counter()
-                for items in all_orders.values():
-                    counter.update(items)
-
-                # 生成訂單總結
+                # 生成訂單總結 (使用維護中的品項總數)
                 summary += f"【{restaurant}】 團購總結：\n"
-                for item, count in counter.items():
+                for item, count in totals_by_group[order.id].items():
                     summary += f"{item}: {count}份\n"
                 
                 # 加入個人訂單詳細資訊
                 summary += "\n個人訂單明細：\n"
                 for user_id, items in all_orders.items():
                     # 取得用戶名稱
-                    user_name = get_user_name(user_id)
+                    user_name = user_names[user_id]
                     # 計算個人訂單項目
-                    personal_counter = Counter(items)
-                    personal_items = ", ".join([f"{item}*{count}" for item, count in personal_counter.items()])
+                    personal_items = ", ".join([f"{item}*{count}" for item, count in order_lines.quantities(items).items()])
                     summary += f"{user_name}：{personal_items}\n"
                 summary += "=================\n"
             else:
@@ -430,12 +734,23 @@ def get_user_closed_group_orders_summary(leader_id):
 
 def handle_start_group_selection(event, line_bot_api):
     """處理使用者輸入「開團」的請求，顯示可選餐廳的 Carousel Template。"""
-    columns = []
     if not env_config.RESTAURANTS:
         reply_text = "目前沒有可供選擇的餐廳。"
         line_bot_api.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply_text)]))
         return
 
+    template_message = rendered_messages.get_or_render('restaurant_picker', request.url_root, build_restaurant_picker_message)
+    if template_message:
+        line_bot_api.reply_message(
+            ReplyMessageRequest(reply_token=event.reply_token, messages=[template_message])
+        )
+    else:
+        reply_text = "無法生成餐廳選項，請稍後再試。"
+        line_bot_api.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply_text)]))
+
+def build_restaurant_picker_message():
+    """建構可選餐廳的 Carousel Template，沒有任何餐廳時回傳 None。"""
+    columns = []
     for restaurant in env_config.RESTAURANTS:
         url = get_restaurant_image_url(restaurant)
         column = CarouselColumn(
@@ -446,37 +761,36 @@ def handle_start_group_selection(event, line_bot_api):
         )
         columns.append(column)
 
-    if columns:
-        carousel_template = CarouselTemplate(columns=columns)
-        template_message = TemplateMessage(alt_text="選擇要開團的店家", template=carousel_template)
-        line_bot_api.reply_message(
-            ReplyMessageRequest(reply_token=event.reply_token, messages=[template_message])
-        )
-    else:
-        reply_text = "無法生成餐廳選項，請稍後再試。"
-        line_bot_api.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply_text)]))
+    if not columns:
+        return None
+    carousel_template = CarouselTemplate(columns=columns)
+    return TemplateMessage(alt_text="選擇要開團的店家", template=carousel_template)
+
+def get_menu_image_message(restaurant: str):
+    """取得餐廳菜單的 ImageMessage (經由靜態回覆訊息快取)，沒有菜單圖片時回傳 None。"""
+    if not env_config.MENU_DICT.get(restaurant):
+        return None
+
+    def render():
+        image_url = get_restaurant_image_url(restaurant)
+        return ImageMessage(original_content_url=image_url, preview_image_url=image_url)
+
+    return rendered_messages.get_or_render(f'menu:{restaurant}', request.url_root, render)
 
 def get_restaurant_image_url(restaurant_name: str) -> str:
     """
     根據餐廳名稱獲取對應的圖片 URL。
-    會檢查設定檔中的菜單圖片名稱，並尋找對應的靜態圖片檔。
+    從啟動時建立的資產清單查詢圖片檔，並以內容雜湊作為版本參數，讓客戶端可以快取圖片。
     如果找不到特定餐廳圖片，返回預設圖片 URL。
     """
-    menu_image = env_config.MENU_DICT.get(restaurant_name)
-    url = None
-    if menu_image:
-        image_extensions = ['jpg', 'png', 'jpeg']
-        for ext in image_extensions:
-            image_path = f"{env_config.STATIC_FOLDER}/store_images/{menu_image}.{ext}"
-            if os.path.exists(image_path):
-                image_path = image_path.replace("\\", "/")
-                url = f"{request.url_root}{image_path}?t={int(time.time())}".replace("http://", "https://")
-                break
-    
-    if not url:
-        url = f"{request.url_root}{env_config.STATIC_FOLDER}/default.png".replace("http://", "https://")
+    asset = asset_manifest.get(restaurant_name)
+    if asset:
+        image_path, digest = asset
+        url = f"{request.url_root}{image_path}?v={digest}"
+    else:
+        url = f"{request.url_root}{env_config.STATIC_FOLDER}/default.png"
     
-    return url
+    return url.replace("http://", "https://")
 
 def handle_show_user_closed_groups(event, line_bot_api, user_id):
     """處理使用者輸入「我的開團」的請求，顯示該使用者已關閉的團購摘要。"""
@@ -499,8 +813,7 @@ def handle_create_group_intent(event, line_bot_api, text, user_id):
         return
 
     # 檢查是否已經有此餐廳的活躍團購
-    active_orders = db_manager.get_active_orders()
-    existing_order = next((order for order in active_orders if order['restaurant'] == restaurant), None)
+    existing_order = db_manager.get_open_group_by_restaurant(restaurant)
     
     # 已有存在開團
     if existing_order:
@@ -543,8 +856,7 @@ def handle_create_group_intent(event, line_bot_api, text, user_id):
 
 def handle_close_group_selection(event, line_bot_api, user_id):
     """處理使用者輸入「閉團」的請求，顯示該使用者開啟的活躍團購供選擇。"""
-    active_orders = db_manager.get_active_orders()
-    user_groups = [order for order in active_orders if order['leader_id'] == user_id]
+    user_groups = db_manager.get_open_groups_by_leader(user_id)
 
     if not user_groups:
         reply_text = "您目前沒有開團！"
@@ -580,10 +892,13 @@ def handle_show_active_groups(event, line_bot_api):
         return
 
     columns = []
+    participant_counts = db_manager.get_participant_counts([order['id'] for order in active_orders])
+    leader_names = get_user_names([order['leader_id'] for order in active_orders],
+                                  timeout=env_config.PROFILE_PREFETCH_DEADLINE_SECONDS)
     for order in active_orders:
         restaurant = order['restaurant']
         leader_id = order['leader_id']
-        leader_name = get_user_name(leader_id)
+        leader_name = leader_names[leader_id]
         close_time = order.get('close_time')
         
         # 計算剩餘時間
@@ -621,7 +936,7 @@ def handle_show_active_groups(event, line_bot_api):
                 time_remaining = "⏰ 時間格式錯誤"
 
         url = get_restaurant_image_url(restaurant)
-        order_count = len(db_manager.get_user_orders(order['id']))
+        order_count = participant_counts[order['id']]
         
         column = CarouselColumn(
             thumbnail_image_url=url,
@@ -642,60 +957,6 @@ def handle_show_active_groups(event, line_bot_api):
         reply_text = "無法顯示團購資訊，請稍後再試。"
         line_bot_api.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply_text)]))
 
-def parse_order_message(msg: str) -> dict:
-    """
-    解析點餐訊息，支援多種輸入格式
-    
-    支援的格式：
-    - 我要點 珍奶（少冰半糖加波霸）
-    - 我要點珍奶（半糖去冰）
-    - 我要點 珍奶 半糖去冰
-    - 點 珍奶
-    - 珍奶
-    
-    Args:
-        msg: 點餐訊息字串
-    
-    Returns:
-        dict: 包含商品名稱和備註的字典
-        {
-            "item": "商品名稱",
-            "note": "備註內容"  # 若無備註則為空字串
-        }
-    """
-    # 移除所有多餘的空格
-    msg = msg.strip()
-    
-    # 定義多個正規表達式模式來匹配不同格式
-    patterns = [
-        # 格式1：我要點 珍奶（少冰半糖加波霸）
-        r'^(?:我要點|點)?\s*([^\s（(]+)(?:[（(]([^）)]+)[）)])?$',
-        
-        # 格式2：我要點 珍奶 半糖去冰
-        r'^(?:我要點|點)?\s*([^\s]+)(?:\s+(.+))?$'
-    ]
-    
-    for pattern in patterns:
-        match = re.match(pattern, msg)
-        if match:
-            item = match.group(1)
-            note = match.group(2) if match.group(2) else ""
-            
-            # 清理可能的空白
-            item = item.strip()
-            note = note.strip()
-            
-            return {
-                "item": item,
-                "note": note
-            }
-    
-    # 如果都沒有匹配到，假設整個訊息就是商品名稱
-    return {
-        "item": msg,
-        "note": ""
-    }
-
 def handle_add_order_item(event, line_bot_api, text, user_id):
     """處理使用者輸入「我要點 xxx」的請求，將餐點加入使用者選擇的團購中。"""
     # 撈出團購編號
@@ -707,9 +968,7 @@ def handle_add_order_item(event, line_bot_api, text, user_id):
 
     group_order_id = selected_group
     # 撈出團購資訊
-    active_orders = db_manager.get_active_orders()
-    # 撈出此團購所有訂單
-    order = next((order for order in active_orders if order['id'] == group_order_id), None)
+    order = db_manager.get_open_group(group_order_id)
     
     if not order:
         reply_text = "您選擇的團購已不存在！"
@@ -720,29 +979,27 @@ def handle_add_order_item(event, line_bot_api, text, user_id):
     restaurant = order['restaurant']
     
     # 使用新的解析方法處理點餐訊息
-    order_info = parse_order_message(text)
+    try:
+        order_info = parse_order_message(text)
+    except ValueError as e:
+        reply_text = f"{e}，請重新輸入，例如：我要點 珍珠奶茶*2"
+        line_bot_api.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply_text)]))
+        return
     if not order_info["item"]:
         reply_text = "請輸入餐點名稱，例如：我要點 珍珠奶茶(微糖微冰)"
         line_bot_api.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply_text)]))
         return
 
-    # 組合商品名稱和備註
-    meal_text = order_info["item"]
-    if order_info["note"]:
-        meal_text = f"{meal_text}({order_info['note']})"
-
     try:
-        # 獲取現有訂單
-        existing_order = db_manager.get_user_order(group_order_id, user_id)
-        all_meals = existing_order + [meal_text] if existing_order else [meal_text]
-        
-        # 更新訂單
-        db_manager.add_user_order(group_order_id, user_id, all_meals)
+        # 在 Redis 中原子地加入品項，相同品項 (商品與備註皆相同) 直接累加數量
+        meal_text = order_lines.make_key(order_info["item"], order_info["note"])
+        user_order = db_manager.adjust_user_order_item(
+            group_order_id, user_id, meal_text, order_info["quantity"], order_info["item"], order_info["note"]
+        )
         
-        # 使用 Counter 統計所有品項數量
-        meal_counter = Counter(all_meals)
-        order_summary = "、".join([f"{item}*{count}" for item, count in meal_counter.items()])
-        reply_text = f"已將 {meal_text} 加入您在 {restaurant} 的訂單中！\n目前訂單：{order_summary}"
+        order_summary = "、".join([f"{item}*{count}" for item, count in order_lines.quantities(user_order).items()])
+        added_text = meal_text if order_info["quantity"] == 1 else f"{meal_text}*{order_info['quantity']}"
+        reply_text = f"已將 {added_text} 加入您在 {restaurant} 的訂單中！\n目前訂單：{order_summary}"
         
     except Exception as e:
         app.logger.error(f"更新訂單失敗: {e}")
@@ -757,8 +1014,7 @@ def handle_close_group_action(event, line_bot_api, restaurant, user_id):
     """
     try:
         # 檢查是否為團購發起人
-        active_orders = db_manager.get_active_orders()
-        order = next((order for order in active_orders if order['restaurant'] == restaurant), None)
+        order = db_manager.get_open_group_by_restaurant(restaurant)
         
         if not order:
             reply_text = f"找不到 {restaurant} 的團購！"
@@ -770,41 +1026,28 @@ def handle_close_group_action(event, line_bot_api, restaurant, user_id):
             line_bot_api.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply_text)]))
             return
             
-        # 獲取所有訂單
+        # 先關閉團購，之後的訂單變更不會遺漏在摘要之外；其他請求或自動閉團已先關閉時不重複關閉
         order_id = order['id']
+        notify_participants = True
+        if not db_manager.close_group_orders([order_id]):
+            # PostgreSQL 已關閉但 Redis 仍為開啟 (先前的關閉未完成)：補同步後仍回覆摘要，不再重複通知參與者
+            if not db_manager.sync_closed_groups([order_id]):
+                reply_text = f"{restaurant} 的團購已關閉！"
+                line_bot_api.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply_text)]))
+                return
+            notify_participants = False
+
+        # 獲取所有訂單並生成訂單摘要 (一次預先查詢所有參與者名稱)
         all_orders = db_manager.get_user_orders(order_id)
+        user_names = get_user_names(list(all_orders), timeout=env_config.PROFILE_PREFETCH_DEADLINE_SECONDS)
+        summary = build_closing_summary(restaurant, all_orders, db_manager.get_group_totals(order_id), user_names)
         
-        # 生成訂單摘要
-        summary = f"【{restaurant}】團購訂單明細：\n=================\n"
-        
-        if all_orders:
-            # 統計總訂單
-            counter = Counter()
-            for items in all_orders.values():
-                counter.update(items)
-                
-            # 添加總訂單統計
-            summary += "總訂單統計：\n"
-            for item, count in counter.items():
-                summary += f"{item}: {count}份\n"
-            
-            # 添加個人訂單明細
-            summary += "\n個人訂單明細：\n"
-            for user_id, items in all_orders.items():
-                user_name = get_user_name(user_id)
-                personal_counter = Counter(items)
-                personal_items = ", ".join([f"{item}*{count}" for item, count in personal_counter.items()])
-                summary += f"{user_name}：{personal_items}\n"
-        else:
-            summary += "沒有任何訂單。\n"
-            
-        summary += "=================\n團購已關閉！"
-        
-        # 關閉團購
-        db_manager.close_group_order(order_id)
-        
-        # 發送訂單摘要
-        line_bot_api.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=summary)]))
+        # 回覆開團者訂單摘要，並以 multicast 通知其他參與者
+        line_bot_api.reply_message(ReplyMessageRequest(
+            reply_token=event.reply_token, messages=[TextMessage(text=text) for text in split_text(summary)]
+        ))
+        if notify_participants:
+            notify_closing_summary(summary, [participant_id for participant_id in all_orders if participant_id != user_id])
         
     except Exception as e:
         app.logger.error(f"關閉團購時發生錯誤: {e}")
@@ -818,8 +1061,7 @@ def handle_select_group_action(event, line_bot_api, group_order_id, user_id):
     """
     try:
         # 檢查團購是否存在且開放中
-        active_orders = db_manager.get_active_orders()
-        order = next((order for order in active_orders if order['id'] == group_order_id), None)
+        order = db_manager.get_open_group(group_order_id)
         
         if not order:
             reply_text = "此團購已不存在或已關閉！"
@@ -832,13 +1074,12 @@ def handle_select_group_action(event, line_bot_api, group_order_id, user_id):
         
         # 獲取餐廳菜單圖片
         restaurant = order['restaurant']
-        menu_image = env_config.MENU_DICT.get(restaurant)
+        menu_message = get_menu_image_message(restaurant)
         
-        if menu_image:
+        if menu_message:
             # 發送菜單圖片和使用說明
-            image_url = get_restaurant_image_url(restaurant)
             messages = [
-                ImageMessage(original_content_url=image_url, preview_image_url=image_url),
+                menu_message,
                 TextMessage(text=f"您已選擇 {restaurant} 的團購！\n請輸入「我要點 xxx」來點餐。\n例如：我要點 珍珠奶茶(微糖微冰)")
             ]
         else:
@@ -891,101 +1132,28 @@ def handle_user_order_summary(event, line_bot_api):
         bubbles = []
         for order_data in user_orders_data:
             # 統計訂單項目並產生摘要文字
-            counter = Counter(order_data['items'])
-            order_summary_text = "\n".join([f"- {item}: {count} 份" for item, count in counter.items()])
+            order_summary_text = "\n".join([
+                f"- {item}: {count} 份" for item, count in order_lines.quantities(order_data['items']).items()
+            ])
             if not order_summary_text:
                 order_summary_text = "您的訂單是空的"
             
             # 創建每個餐廳的 bubble
-            bubble = {
-                "type": "bubble",
-                "hero": {
-                    "type": "image",
-                    "url": get_restaurant_image_url(order_data['restaurant']),
-                    "size": "full",
-                    "aspectRatio": "20:13",
-                    "aspectMode": "cover"
-                },
-                "body": {
-                    "type": "box",
-                    "layout": "vertical",
-                    "spacing": "md", # 調整間距
-                    "contents": [
-                        {
-                            "type": "text",
-                            "text": f"【{order_data['restaurant']}】",
-                            "weight": "bold",
-                            "size": "lg",
-                            "color": "#000000"
-                        },
-                        {
-                            "type": "separator",
-                            "margin": "lg" # 調整間距
-                        },
-                        {
-                            "type": "text",
-                            "text": "您的訂單內容：",
-                            "weight": "bold",
-                            "margin": "lg", # 調整間距
-                            "size": "md"
-                        },
-                        {
-                            "type": "text",
-                            "text": order_summary_text,
-                            "wrap": True,
-                            "margin": "sm", # 調整間距
-                            "size": "sm",
-                            "color": "#555555"
-                        }
-                    ]
-                },
-                "footer": {
-                    "type": "box",
-                    "layout": "vertical",
-                    "spacing": "sm",
-                    "contents": [
-                        {
-                            "type": "button",
-                            "style": "primary",
-                            "color": "#4CAF50", # 綠色
-                            "height": "sm",
-                            "action": {
-                                "type": "postback",
-                                "label": "✏️ 修改訂單",
-                                "data": f"action=edit_order&group_order_id={order_data['order_id']}",
-                                "displayText": f"修改 {order_data['restaurant']} 訂單"
-                            }
-                        },
-                        {
-                            "type": "button",
-                            "style": "primary",
-                            "color": "#F44336", # 紅色 (調整了顏色)
-                            "height": "sm",
-                            "action": {
-                                "type": "postback",
-                                "label": "🗑️ 清空此訂單",
-                                "data": f"action=clear_my_order&group_order_id={order_data['order_id']}",
-                                "displayText": f"確定要清空 {order_data['restaurant']} 的訂單嗎？"
-                            }
-                        }
-                    ]
-                }
-            }
+            bubble = flex_messages.build_order_summary_bubble(
+                order_data['restaurant'],
+                get_restaurant_image_url(order_data['restaurant']),
+                order_summary_text,
+                order_data['order_id']
+            )
             bubbles.append(bubble)
 
-        # 創建 carousel flex message
-        carousel_flex = {
-            "type": "carousel",
-            "contents": bubbles
-        }
-
-        # 發送 flex message
+        # 發送 carousel flex message
         line_bot_api.reply_message(
             ReplyMessageRequest(
                 reply_token=event.reply_token,
                 messages=[FlexMessage(
                     alt_text="您的訂單明細",
-                    contents=FlexContainer.from_json(json.dumps(carousel_flex))
+                    contents=flex_messages.build_carousel(bubbles)
                 )]
             )
         )
@@ -1005,10 +1173,9 @@ def handle_show_menu_action(event, line_bot_api, restaurant):
     處理顯示餐廳菜單的請求。
     """
     try:
-        menu_image = env_config.MENU_DICT.get(restaurant)
-        if menu_image:
-            image_url = get_restaurant_image_url(restaurant)
-            messages = [ImageMessage(original_content_url=image_url, preview_image_url=image_url)]
+        menu_message = get_menu_image_message(restaurant)
+        if menu_message:
+            messages = [menu_message]
         else:
             messages = [TextMessage(text=f"抱歉，目前沒有 {restaurant} 的菜單圖片。")]
             
@@ -1025,18 +1192,18 @@ def handle_delete_order_action(event, line_bot_api, group_order_id, user_id):
     """
     try:
         # 檢查團購是否存在且開放中
-        active_orders = db_manager.get_active_orders()
-        order = next((order for order in active_orders if order['id'] == group_order_id), None)
+        order = db_manager.get_open_group(group_order_id)
         
         if not order:
             reply_text = "此團購已不存在或已關閉！"
             line_bot_api.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply_text)]))
             return
             
-        # 刪除訂單
-        db_manager.delete_user_order(group_order_id, user_id)
-        
-        reply_text = f"已刪除您在 {order['restaurant']} 的所有訂單！"
+        # 刪除訂單 (失敗時拋出例外，回覆錯誤訊息)
+        if db_manager.delete_user_order(group_order_id, user_id):
+            reply_text = f"已刪除您在 {order['restaurant']} 的所有訂單！"
+        else:
+            reply_text = f"您在 {order['restaurant']} 沒有訂單。"
         line_bot_api.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply_text)]))
         
     except Exception as e:
@@ -1055,10 +1222,7 @@ def handle_set_close_time_action(event, line_bot_api, group_order_id, user_id, p
         group_order_id = str(group_order_id)
         
         # 檢查團購是否存在且開放中
-        active_orders = db_manager.get_active_orders()
-        app.logger.info(f"活躍團購列表: {active_orders}")
-        
-        order = next((order for order in active_orders if str(order['id']) == group_order_id), None)
+        order = db_manager.get_open_group(group_order_id)
         
         if not order:
             app.logger.error(f"找不到團購: {group_order_id}")
@@ -1121,8 +1285,7 @@ def handle_custom_close_time_input(event, line_bot_api, text, user_id):
             return
             
         # 檢查團購是否存在且開放中
-        active_orders = db_manager.get_active_orders()
-        order = next((order for order in active_orders if order['id'] == group_order_id), None)
+        order = db_manager.get_open_group(group_order_id)
         
         if not order:
             reply_text = "此團購已不存在或已關閉！"
@@ -1205,11 +1368,12 @@ def handle_custom_close_time_input(event, line_bot_api, text, user_id):
         reply_text = "設置閉團時間時發生錯誤，請稍後再試。"
         line_bot_api.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=reply_text)]))
 
-def handle_edit_order(event, line_bot_api, group_order_id, user_id):
-    """處理修改訂單的請求"""
+def handle_edit_order(event, line_bot_api, group_order_id, user_id, user_order=None):
+    """處理修改訂單的請求，user_order 為剛調整完的訂單時不需再讀取一次"""
     try:
         # 獲取用戶的訂單
-        user_order = db_manager.get_user_order(group_order_id, user_id)
+        if user_order is None:
+            user_order = db_manager.get_user_order(group_order_id, user_id)
         if not user_order:
             reply_text = "找不到您的訂單！"
             line_bot_api.reply_message(
@@ -1220,121 +1384,22 @@ def handle_edit_order(event, line_bot_api, group_order_id, user_id):
             )
             return
 
-        # 統計訂單項目
-        counter = Counter(user_order)
-        
         # 創建修改訂單的 Flex Message
         items_components = []
-        for item, count in counter.items():
-            item_name = item
-            note = ""
-            if "(" in item and ")" in item:
-                item_name = item[:item.find("(")]
-                note = item[item.find("(")+1:item.find(")")]
-            
-            items_components.append({
-                "type": "box",
-                "layout": "vertical",
-                "margin": "md",
-                "contents": [
-                    {
-                        "type": "text",
-                        "text": item_name,
-                        "size": "md",
-                        "color": "#555555",
-                        "weight": "bold"
-                    },
-                    {
-                        "type": "box",
-                        "layout": "horizontal",
-                        "margin": "sm",
-                        "contents": [
-                            {
-                                "type": "button",
-                                "style": "secondary",
-                                "height": "sm",
-                                "action": {
-                                    "type": "postback",
-                                    "label": "-",
-                                    "data": f"action=decrease_item&group_order_id={group_order_id}&item={item}"
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": str(count),
-                                "size": "md",
-                                "color": "#111111",
-                                "align": "center",
-                                "gravity": "center",
-                                "flex": 1
-                            },
-                            {
-                                "type": "button",
-                                "style": "secondary",
-                                "height": "sm",
-                                "action": {
-                                    "type": "postback",
-                                    "label": "+",
-                                    "data": f"action=increase_item&group_order_id={group_order_id}&item={item}"
-                                }
-                            }
-                        ]
-                    },
-                    {
-                        "type": "text",
-                        "text": f"備註：{note if note else '無'}",
-                        "size": "sm",
-                        "color": "#888888",
-                        "wrap": True,
-                        "margin": "sm"
-                    },
-                    {
-                        "type": "button",
-                        "style": "link",
-                        "height": "sm",
-                        "margin": "xs",
-                        "action": {
-                            "type": "postback",
-                            "label": "✏️ 編輯備註",
-                            "data": f"action=prompt_update_note&group_order_id={group_order_id}&item={item}"
-                        }
-                    }
-                ]
-            })
+        for item, line in user_order.items():
+            items_components.append(
+                flex_messages.build_edit_item_box(item, line["item"], line["note"], line["qty"], group_order_id)
+            )
 
         # 創建修改訂單的 Flex Message
-        edit_flex = {
-            "type": "bubble",
-            "body": {
-                "type": "box", "layout": "vertical", "contents": [
-                    { "type": "text", "text": "修改訂單", "weight": "bold", "size": "xl" },
-                    { "type": "separator", "margin": "xxl" },
-                    {
-                        "type": "box", "layout": "vertical", "margin": "xl", "spacing": "sm",
-                        "contents": items_components
-                    }
-                ]
-            },
-            "footer": {
-                "type": "box", "layout": "vertical", "spacing": "sm", "contents": [
-                    {
-                        "type": "button", "style": "primary", "color": "#4CAF50",
-                        "action": {
-                            "type": "postback", "label": "💾完成修改",
-                            "data": f"action=save_edit&group_order_id={group_order_id}"
-                        }
-                    }
-                ]
-            }
-        }
+        edit_flex = flex_messages.build_edit_order_bubble(items_components, group_order_id)
 
         # 發送修改訂單的 Flex Message
         try:
                 line_bot_api.reply_message(
                 ReplyMessageRequest(
                     reply_token=event.reply_token,
-                    messages=[FlexMessage(alt_text="修改訂單",
-                                        contents=FlexContainer.from_json(json.dumps(edit_flex)))]
+                    messages=[FlexMessage(alt_text="修改訂單", contents=edit_flex)]
                 )
             )
         except Exception as e:
@@ -1343,10 +1408,7 @@ def handle_edit_order(event, line_bot_api, group_order_id, user_id):
             line_bot_api.push_message(
                 PushMessageRequest(
                     to=user_id,
-                    messages=[FlexMessage(
-                        alt_text="修改訂單",
-                        contents=FlexContainer.from_json(json.dumps(edit_flex))
-                    )]
+                    messages=[FlexMessage(alt_text="修改訂單", contents=edit_flex)]
                 )
             )
 
@@ -1370,42 +1432,45 @@ def handle_edit_order(event, line_bot_api, group_order_id, user_id):
                 )
             )
 
+def reply_order_update_error(event, line_bot_api):
+    """訂單變更未完成 (已還原) 時告知使用者，讓使用者知道需要重試"""
+    try:
+        line_bot_api.reply_message(ReplyMessageRequest(
+            reply_token=event.reply_token,
+            messages=[TextMessage(text="更新訂單時發生錯誤，訂單未變更，請稍後再試。")]
+        ))
+    except Exception as e:
+        app.logger.error(f"發送更新訂單錯誤訊息時發生錯誤: {e}")
+
 def handle_increase_item(event, line_bot_api, group_order_id, item):
     """處理增加商品數量的請求"""
     try:
         user_id = event.source.user_id
-        user_order = db_manager.get_user_order(group_order_id, user_id)
-        if not user_order:
-            return
 
-        # 增加商品數量
-        user_order.append(item)
-        db_manager.add_user_order(group_order_id, user_id, user_order)
+        # 在 Redis 中原子地增加商品數量 (啟用 write-behind 時 PostgreSQL 於背景寫回)
+        user_order = db_manager.adjust_user_order_item(group_order_id, user_id, item, 1)
         
         # 重新顯示修改訂單介面
-        handle_edit_order(event, line_bot_api, group_order_id, user_id)
+        handle_edit_order(event, line_bot_api, group_order_id, user_id, user_order)
 
     except Exception as e:
         app.logger.error(f"增加商品數量時發生錯誤: {e}")
+        reply_order_update_error(event, line_bot_api)
 
 def handle_decrease_item(event, line_bot_api, group_order_id, item):
     """處理減少商品數量的請求"""
     try:
         user_id = event.source.user_id
-        user_order = db_manager.get_user_order(group_order_id, user_id)
-        if not user_order:
-            return
 
-        # 減少商品數量
-        if item in user_order:
-            user_order.remove(item)
-            db_manager.add_user_order(group_order_id, user_id, user_order)
+        # 在 Redis 中原子地減少商品數量，數量歸零時移除品項 (啟用 write-behind 時 PostgreSQL 於背景寫回)
+        user_order = db_manager.adjust_user_order_item(group_order_id, user_id, item, -1)
         
         # 重新顯示修改訂單介面
-        handle_edit_order(event, line_bot_api, group_order_id, user_id)
+        handle_edit_order(event, line_bot_api, group_order_id, user_id, user_order)
 
     except Exception as e:
         app.logger.error(f"減少商品數量時發生錯誤: {e}")
+        reply_order_update_error(event, line_bot_api)
 
 def handle_update_note(event, line_bot_api, group_order_id, item, new_note):
     """處理更新商品備註的請求"""
@@ -1423,24 +1488,10 @@ def handle_update_note(event, line_bot_api, group_order_id, item, new_note):
                 app.logger.error(f"發送更新備註錯誤訊息失敗: {inner_e}")
             return
 
-        # 更新商品備註
-        item_name = item
-        if "(" in item and ")" in item:
-            item_name = item[:item.find("(")]
-        
-        # 清理新的備註，移除前後空格
-        new_note_cleaned = new_note.strip()
-        
-        new_item = f"{item_name}({new_note_cleaned})" if new_note_cleaned else item_name
-        
-        # 替換舊的商品
-        # 需要找到第一個匹配的 item 進行替換
-        new_order = list(user_order) # 創建副本以修改
-        try:
-            index_to_replace = new_order.index(item)
-            new_order[index_to_replace] = new_item
-        except ValueError:
+        # 更新商品備註：將該品項中的一份改為新的備註
+        if order_lines.update_note(user_order, item, new_note) is None:
             # 如果原始項目找不到 (理論上不應發生，因為是從狀態來的)
+            item_name, _ = order_lines.split_key(item)
             app.logger.error(f"更新備註時找不到原始項目 '{item}' 在訂單中")
             reply_text = f"更新備註失敗，找不到原始項目 '{item_name}'。"
             try:
@@ -1451,7 +1502,7 @@ def handle_update_note(event, line_bot_api, group_order_id, item, new_note):
                 app.logger.error(f"發送更新備註失敗訊息失敗: {inner_e}")
             return
 
-        db_manager.add_user_order(group_order_id, user_id, new_order)
+        db_manager.add_user_order(group_order_id, user_id, user_order)
         
         # 回覆確認訊息並重新顯示修改訂單介面
         # 注意：這裡不再使用 reply_token，因為可能已經過期
@@ -1499,25 +1550,21 @@ if __name__ == "__main__":
         
         # 檢查並設置 Rich Menu
         try:
-            with ApiClient(configuration) as api_client:
-                line_bot_api = MessagingApi(api_client)
-                response = line_bot_api.get_default_rich_menu_id()
-                default_rich_menu_id = response.rich_menu_id if hasattr(response, 'rich_menu_id') else None
-                
-                if not default_rich_menu_id:
-                    app.logger.info("沒有找到預設的 Rich Menu，嘗試創建...")
-                    create_rich_menu()
-                else:
-                    app.logger.info(f"已存在預設的 Rich Menu ID: {default_rich_menu_id}")
+            line_bot_api = messaging_client.api
+            response = line_bot_api.get_default_rich_menu_id()
+            default_rich_menu_id = response.rich_menu_id if hasattr(response, 'rich_menu_id') else None
+            
+            if not default_rich_menu_id:
+                app.logger.info("沒有找到預設的 Rich Menu，嘗試創建...")
+                create_rich_menu()
+            else:
+                app.logger.info(f"已存在預設的 Rich Menu ID: {default_rich_menu_id}")
         except Exception as e:
             app.logger.error(f"檢查或創建 Rich Menu 時發生錯誤: {e}。嘗試強制創建...")
             create_rich_menu()
 
-    # --- 啟動定時任務 ---
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(check_and_close_orders, 'interval', minutes=env_config.SCHEDULER_INTERVAL_MINUTES, id='check_orders_job')
-    scheduler.start()
-    app.logger.info(f"定時任務已啟動，每 {env_config.SCHEDULER_INTERVAL_MINUTES} 分鐘檢查一次過期團購。")
+    # --- 啟動到期引擎與定時任務 ---
+    start_background_services()
 
     # --- 啟動 Flask Web 伺服器 ---
     app.run(host='0.0.0.0', port=os.environ.get('PORT', 5000), debug=app.debug)
\ No newline at end of file
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+靜態圖片資產清單
+
+啟動時掃描一次 static/store_images，建立「餐廳 → 圖片檔案與內容雜湊」的對應表，
+產生圖片 URL 時不需要任何檔案系統呼叫，並以內容雜湊作為版本參數，讓 LINE 與 CDN 可以快取圖片。
+圖片更新後由 reload_if_changed() 察覺 (主程式定期呼叫，只比對檔案的修改時間與大小) 並重新建立清單。
+"""
+import hashlib
+import os
+import threading
+
+
+class AssetManifest:
+    """餐廳圖片的資產清單"""
+
+    IMAGE_EXTENSIONS = ['jpg', 'png', 'jpeg']  # 同名檔案存在多種副檔名時的優先順序
+
+    def __init__(self, static_folder, menu_dict):
+        self.static_folder = static_folder
+        self.menu_dict = menu_dict  # 餐廳名稱 → 圖片檔名 (不含副檔名)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._signature = None
+        self.version = ''
+        self.reload()
+
+    def _scan(self):
+        """列出圖片資料夾中的檔案，回傳 ({檔名: 路徑}, 檔名、修改時間與大小組成的簽章)"""
+        image_dir = os.path.join(self.static_folder, 'store_images')
+        files = {}
+        signature = []
+        if os.path.isdir(image_dir):
+            with os.scandir(image_dir) as scanned:
+                for entry in scanned:
+                    if entry.is_file():
+                        files[entry.name] = entry.path
+                        stat = entry.stat()
+                        signature.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        return files, tuple(sorted(signature))
+
+    def reload_if_changed(self):
+        """圖片資料夾的檔案有新增、刪除或修改時重新建立清單，回傳是否重新建立"""
+        _, signature = self._scan()
+        if signature == self._signature:
+            return False
+        self.reload()
+        return True
+
+    def reload(self):
+        """重新掃描圖片資料夾並計算內容雜湊，回傳新的清單版本"""
+        files, signature = self._scan()
+
+        entries = {}
+        for restaurant, menu_image in self.menu_dict.items():
+            for ext in self.IMAGE_EXTENSIONS:
+                file_name = f"{menu_image}.{ext}"
+                if file_name in files:
+                    with open(files[file_name], 'rb') as image:
+                        digest = hashlib.sha1(image.read()).hexdigest()[:12]
+                    entries[restaurant] = (f"{self.static_folder}/store_images/{file_name}", digest)
+                    break
+
+        version = hashlib.sha1(repr(sorted(entries.items())).encode('utf-8')).hexdigest()[:12]
+        with self._lock:
+            self._entries = entries
+            self._signature = signature
+            self.version = version
+        return version
+
+    def get(self, restaurant):
+        """回傳 (相對路徑, 內容雜湊)，找不到圖片時回傳 None"""
+        return self._entries.get(restaurant)
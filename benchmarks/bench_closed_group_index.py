@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+已關閉團購數量成長時，閉團查詢延遲的基準測試。
+
+比較舊版以 KEYS 'group_order:*' 掃描尋找開啟團購的方式，
+與以餐廳索引 (restaurant_open:<name>) 查詢的方式。
+
+需要一個可寫入的 Redis，預設使用 db 15，執行前會清空該 db：
+    BENCH_REDIS_URL=redis://localhost:6379/15 python benchmarks/bench_closed_group_index.py
+"""
+import os
+import sys
+import time
+
+from redis import Redis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import DatabaseManager  # noqa: E402
+
+HISTORY_SIZES = [1_000, 10_000, 100_000]
+ROUNDS = 20
+BATCH = 5_000
+
+
+def legacy_find_open_group(redis_client, restaurant, leader_id):
+    """舊版 close_group_order 的查詢方式：掃描所有 group_order:* 鍵"""
+    for key in redis_client.keys('group_order:*'):
+        if key.endswith(':orders'):
+            continue
+        order_data = redis_client.hgetall(key)
+        if (order_data.get('restaurant') == restaurant and
+                order_data.get('leader_id') == leader_id and
+                order_data.get('status') == 'open'):
+            return key.split(':')[1]
+    return None
+
+
+def seed_closed_groups(redis_client, start_id, count):
+    """寫入 count 筆已關閉團購 (含 orders 子 hash)"""
+    for offset in range(0, count, BATCH):
+        pipe = redis_client.pipeline(transaction=False)
+        for group_order_id in range(start_id + offset, start_id + min(offset + BATCH, count)):
+            pipe.hset(f'group_order:{group_order_id}', mapping={
+                'id': str(group_order_id),
+                'restaurant': '50嵐',
+                'leader_id': f'U{group_order_id % 50}',
+                'status': 'closed',
+                'close_time': ''
+            })
+            pipe.hset(f'group_order:{group_order_id}:orders', f'U{group_order_id % 7}', '[]')
+            pipe.sadd(DatabaseManager.CLOSED_GROUPS_KEY, group_order_id)
+        pipe.execute()
+
+
+def measure(func, rounds=ROUNDS):
+    """回傳 func 的平均執行時間 (毫秒)"""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - started) * 1000 / rounds
+
+
+def main():
+    redis_client = Redis.from_url(os.getenv('BENCH_REDIS_URL', 'redis://localhost:6379/15'), decode_responses=True)
+    redis_client.flushdb()
+    db_manager = DatabaseManager(redis_client)
+
+    # 一筆開啟中的團購，並標記索引已同步，避免觸發 PostgreSQL 重建
+    open_id = 0
+    pipe = redis_client.pipeline()
+    pipe.hset(f'group_order:{open_id}', mapping={
+        'id': str(open_id), 'restaurant': '大茗', 'leader_id': 'U_LEADER', 'status': 'open', 'close_time': ''
+    })
+    db_manager._index_open_group(pipe, open_id, '大茗', 'U_LEADER')
+    pipe.set(DatabaseManager.OPEN_GROUPS_SYNCED_KEY, 1)
+    pipe.execute()
+
+    print(f"{'closed groups':>14} | {'KEYS scan (ms)':>14} | {'index (ms)':>10}")
+    seeded = 0
+    for size in HISTORY_SIZES:
+        seed_closed_groups(redis_client, seeded + 1, size - seeded)
+        seeded = size
+
+        legacy_ms = measure(lambda: legacy_find_open_group(redis_client, '大茗', 'U_LEADER'), rounds=3)
+        indexed_ms = measure(lambda: db_manager.get_open_group_by_restaurant('大茗'))
+        print(f"{size:>14,} | {legacy_ms:>14.2f} | {indexed_ms:>10.3f}")
+
+    redis_client.flushdb()
+
+
+if __name__ == '__main__':
+    main()
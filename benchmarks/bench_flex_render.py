@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Flex Message 建構方式的微基準測試。
+
+比較舊版「dict → json.dumps → FlexContainer.from_json」的建構方式，
+與 flex_messages 直接建立 SDK 模型物件的方式；兩者皆包含最終序列化成請求內容的成本。
+
+    python benchmarks/bench_flex_render.py
+"""
+import json
+import os
+import sys
+import timeit
+
+from linebot.v3.messaging import FlexContainer, FlexMessage, ReplyMessageRequest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import flex_messages  # noqa: E402
+
+ROUNDS = 200
+IMAGE_URL = "https://example.com/static/store_images/50lan.png?v=090171c53d2c"
+
+
+def legacy_summary_bubble(restaurant, image_url, summary_text, group_order_id):
+    """舊版 handle_user_order_summary 的 bubble dict"""
+    return {
+        "type": "bubble",
+        "hero": {"type": "image", "url": image_url, "size": "full", "aspectRatio": "20:13", "aspectMode": "cover"},
+        "body": {
+            "type": "box", "layout": "vertical", "spacing": "md",
+            "contents": [
+                {"type": "text", "text": f"【{restaurant}】", "weight": "bold", "size": "lg", "color": "#000000"},
+                {"type": "separator", "margin": "lg"},
+                {"type": "text", "text": "您的訂單內容：", "weight": "bold", "margin": "lg", "size": "md"},
+                {"type": "text", "text": summary_text, "wrap": True, "margin": "sm", "size": "sm", "color": "#555555"}
+            ]
+        },
+        "footer": {
+            "type": "box", "layout": "vertical", "spacing": "sm",
+            "contents": [
+                {"type": "button", "style": "primary", "color": "#4CAF50", "height": "sm",
+                 "action": {"type": "postback", "label": "✏️ 修改訂單",
+                            "data": f"action=edit_order&group_order_id={group_order_id}",
+                            "displayText": f"修改 {restaurant} 訂單"}},
+                {"type": "button", "style": "primary", "color": "#F44336", "height": "sm",
+                 "action": {"type": "postback", "label": "🗑️ 清空此訂單",
+                            "data": f"action=clear_my_order&group_order_id={group_order_id}",
+                            "displayText": f"確定要清空 {restaurant} 的訂單嗎？"}}
+            ]
+        }
+    }
+
+
+def legacy_edit_item_box(item, item_name, note, count, group_order_id):
+    """舊版 handle_edit_order 的品項 dict"""
+    return {
+        "type": "box", "layout": "vertical", "margin": "md",
+        "contents": [
+            {"type": "text", "text": item_name, "size": "md", "color": "#555555", "weight": "bold"},
+            {"type": "box", "layout": "horizontal", "margin": "sm", "contents": [
+                {"type": "button", "style": "secondary", "height": "sm",
+                 "action": {"type": "postback", "label": "-",
+                            "data": f"action=decrease_item&group_order_id={group_order_id}&item={item}"}},
+                {"type": "text", "text": str(count), "size": "md", "color": "#111111",
+                 "align": "center", "gravity": "center", "flex": 1},
+                {"type": "button", "style": "secondary", "height": "sm",
+                 "action": {"type": "postback", "label": "+",
+                            "data": f"action=increase_item&group_order_id={group_order_id}&item={item}"}}
+            ]},
+            {"type": "text", "text": f"備註：{note if note else '無'}", "size": "sm", "color": "#888888",
+             "wrap": True, "margin": "sm"},
+            {"type": "button", "style": "link", "height": "sm", "margin": "xs",
+             "action": {"type": "postback", "label": "✏️ 編輯備註",
+                        "data": f"action=prompt_update_note&group_order_id={group_order_id}&item={item}"}}
+        ]
+    }
+
+
+def legacy_edit_bubble(item_boxes, group_order_id):
+    """舊版 handle_edit_order 的 bubble dict"""
+    return {
+        "type": "bubble",
+        "body": {"type": "box", "layout": "vertical", "contents": [
+            {"type": "text", "text": "修改訂單", "weight": "bold", "size": "xl"},
+            {"type": "separator", "margin": "xxl"},
+            {"type": "box", "layout": "vertical", "margin": "xl", "spacing": "sm", "contents": item_boxes}
+        ]},
+        "footer": {"type": "box", "layout": "vertical", "spacing": "sm", "contents": [
+            {"type": "button", "style": "primary", "color": "#4CAF50",
+             "action": {"type": "postback", "label": "💾完成修改",
+                        "data": f"action=save_edit&group_order_id={group_order_id}"}}
+        ]}
+    }
+
+
+ORDERS = [(f"餐廳{i}", i, "- 珍珠奶茶(半糖少冰): 2 份\n- 四季春(無糖): 1 份") for i in range(10)]
+ITEMS = [(f"品項{i}(半糖)", f"品項{i}", "半糖", i % 3 + 1) for i in range(20)]
+
+
+def serialize(contents, alt_text):
+    """序列化為送出的請求內容"""
+    return ReplyMessageRequest(
+        reply_token="token", messages=[FlexMessage(alt_text=alt_text, contents=contents)]
+    ).to_json()
+
+
+def legacy_carousel():
+    bubbles = [legacy_summary_bubble(r, IMAGE_URL, text, gid) for r, gid, text in ORDERS]
+    contents = FlexContainer.from_json(json.dumps({"type": "carousel", "contents": bubbles}))
+    return serialize(contents, "您的訂單明細")
+
+
+def direct_carousel():
+    bubbles = [flex_messages.build_order_summary_bubble(r, IMAGE_URL, text, gid) for r, gid, text in ORDERS]
+    return serialize(flex_messages.build_carousel(bubbles), "您的訂單明細")
+
+
+def legacy_edit_view():
+    boxes = [legacy_edit_item_box(item, name, note, count, 1) for item, name, note, count in ITEMS]
+    contents = FlexContainer.from_json(json.dumps(legacy_edit_bubble(boxes, 1)))
+    return serialize(contents, "修改訂單")
+
+
+def direct_edit_view():
+    boxes = [flex_messages.build_edit_item_box(item, name, note, count, 1) for item, name, note, count in ITEMS]
+    return serialize(flex_messages.build_edit_order_bubble(boxes, 1), "修改訂單")
+
+
+def main():
+    # 兩種方式產生的請求內容必須一致
+    assert json.loads(legacy_carousel()) == json.loads(direct_carousel())
+    assert json.loads(legacy_edit_view()) == json.loads(direct_edit_view())
+
+    for name, legacy, direct in [
+        ("10-bubble carousel", legacy_carousel, direct_carousel),
+        ("20-item edit view", legacy_edit_view, direct_edit_view),
+    ]:
+        legacy_ms = min(timeit.repeat(legacy, number=ROUNDS, repeat=3)) * 1000 / ROUNDS
+        direct_ms = min(timeit.repeat(direct, number=ROUNDS, repeat=3)) * 1000 / ROUNDS
+        print(f"{name:<20} legacy {legacy_ms:7.3f} ms | direct {direct_ms:7.3f} ms | {legacy_ms / direct_ms:4.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+點餐訊息解析的吞吐量基準測試。
+
+以實際的中英文點餐訊息比較舊版 parse_order_message (每次以字串傳入 re.match、依序嘗試兩個樣式)
+與 order_parser 的解析速度，並確認不含數量標記的訊息解析結果與舊版一致。
+"new item/note" 只產生與舊版相同的商品與備註；"new structured" 為完整結果 (含數量與調整項目)。
+
+    python benchmarks/bench_order_parser.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from order_parser import parse_order_message, _parse_fast, _parse_with_patterns  # noqa: E402
+
+ROUNDS = 500
+REPEAT = 20
+
+CORPUS = [
+    "我要點 珍奶(半糖少冰)",
+    "我要點珍奶（半糖去冰）",
+    "我要點 珍珠奶茶(微糖微冰)",
+    "我要點 四季春青茶(無糖去冰)",
+    "我要點 黃金烏龍(二分糖、少冰)",
+    "我要點 冬瓜檸檬",
+    "我要點紅茶拿鐵",
+    "我要點 波霸奶茶（少冰半糖加波霸）",
+    "我要點 芒果青 半糖去冰",
+    "我要點 8冰綠 微糖 少冰",
+    "我要點 鐵觀音奶茶(熱,半糖)",
+    "我要點 烏龍綠(無糖/常溫)",
+    "我要點 布丁奶茶",
+    "我要點 仙草凍奶茶(全糖)",
+    "我要點 Latte(oat milk)",
+    "我要點 Americano",
+    "我要點 Black Tea less sugar",
+    "我要點 Matcha(no ice)",
+    "我要點 Green tea (half sugar)",
+    "我要點 mango smoothie no ice",
+    "點 珍奶",
+    "點 紅茶(去冰)",
+    "我要點 珍奶(半糖)*2",
+    "我要點 Latte x3",
+    "我要點 多多綠 半糖 2杯",
+    "我要點 檸檬綠(微糖)×4",
+]
+
+_LEGACY_PATTERNS = [
+    r'^(?:我要點|點)?\s*([^\s（(]+)(?:[（(]([^）)]+)[）)])?$',
+    r'^(?:我要點|點)?\s*([^\s]+)(?:\s+(.+))?$'
+]
+
+
+def legacy_parse_order_message(msg):
+    """舊版 parse_order_message"""
+    msg = msg.strip()
+    for pattern in _LEGACY_PATTERNS:
+        match = re.match(pattern, msg)
+        if match:
+            item = match.group(1)
+            note = match.group(2) if match.group(2) else ""
+            return {"item": item.strip(), "note": note.strip()}
+    return {"item": msg, "note": ""}
+
+
+def main():
+    # 不含數量標記的訊息，商品與備註必須與舊版相同
+    for msg in CORPUS:
+        parsed = parse_order_message(msg)
+        if parsed["quantity"] == 1:
+            legacy = legacy_parse_order_message(msg)
+            assert (parsed["item"], parsed["note"]) == (legacy["item"], legacy["note"]), msg
+
+    def run_legacy():
+        for msg in CORPUS:
+            legacy_parse_order_message(msg)
+
+    def run_item_note():
+        # 與舊版相同的輸出 (只有商品與備註)
+        for msg in CORPUS:
+            msg = msg.strip()
+            item, note = _parse_fast(msg) or _parse_with_patterns(msg)
+            {"item": item, "note": note}
+
+    def run_new():
+        for msg in CORPUS:
+            parse_order_message(msg)
+
+    # 交錯執行並取最佳值，降低機器負載波動的影響
+    runs = [("legacy", run_legacy), ("new item/note", run_item_note), ("new structured", run_new)]
+    best = {name: float('inf') for name, _ in runs}
+    for _ in range(REPEAT):
+        for name, run in runs:
+            best[name] = min(best[name], timeit.timeit(run, number=ROUNDS))
+
+    messages = ROUNDS * len(CORPUS)
+    for name, _ in runs:
+        print(f"{name:<16} {messages / best[name]:>10,.0f} msg/s ({best['legacy'] / best[name]:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,16 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy  # 引入 Flask-SQLAlchemy 來處理資料庫交互
+from sqlalchemy import any_  # 引入 ANY，以單一陣列參數比對多個 ID
+from sqlalchemy.dialects.postgresql import insert as pg_insert, ARRAY  # 引入 PostgreSQL 的 INSERT ... ON CONFLICT 與陣列型別
 from redis import Redis  # 引入 Redis 來處理緩存
 import json  # 引入 json 來處理 JSON 資料
 from datetime import datetime, UTC, timedelta,timezone  # 引入 datetime 來處理日期時間，UTC 來處理時區
 from config import get_config
+import order_lines  # 使用者訂單的品項格式 (含舊格式轉換)
+import threading  # 引入 threading 來保護跨執行緒共用的統計數據
 db = SQLAlchemy()
+# 資料庫端的當前 UTC 時間 (不含時區的 TIMESTAMP 欄位)，每筆資料寫入時才計算
+UTC_NOW = db.func.timezone('utc', db.func.now())
 # 初始化 Flask 應用
 app = Flask(__name__, static_folder='static')
 
@@ -24,21 +30,302 @@ class GroupOrder(db.Model):  # 定義 GroupOrder 模型
     restaurant = db.Column(db.String(100), nullable=False)  # 定義餐廳名稱欄位
     leader_id = db.Column(db.String(100), nullable=False)  # 定義團購領導者 ID 欄位
     status = db.Column(db.String(20), default='open')  # 定義團購狀態欄位，預設為 'open'
-    created_at = db.Column(db.DateTime, default=datetime.now(UTC))  # 定義創建時間欄位，預設為 UTC 時區的當前時間
+    created_at = db.Column(db.DateTime, server_default=UTC_NOW)  # 定義創建時間欄位，由資料庫於寫入時填入 UTC 當前時間
     closed_at = db.Column(db.DateTime)  # 定義關閉時間欄位
     close_time = db.Column(db.DateTime(timezone=True))  # 新增: 預計閉團時間欄位，並指定為 UTC 時間  # 新增: 預計閉團時間欄位
 
+    # 常用查詢條件的索引 (既有資料庫由 migrations.py 建立)
+    __table_args__ = (
+        # 活躍團購與到期檢查：只索引 status = 'open' 的少數團購
+        db.Index('ix_group_orders_open_close_time', 'close_time', postgresql_where=db.text("status = 'open'")),
+        # 開團者的團購 (依狀態)
+        db.Index('ix_group_orders_leader_status', 'leader_id', 'status'),
+    )
+
 class UserOrder(db.Model):  # 定義 UserOrder 模型
     __tablename__ = 'user_orders'  # 定義資料表名稱
     id = db.Column(db.Integer, primary_key=True)  # 定義 id 欄位為主鍵
     group_order_id = db.Column(db.Integer, db.ForeignKey('group_orders.id'))  # 定義團購 ID 欄位，參考 GroupOrder 模型的 id
     user_id = db.Column(db.String(100), nullable=False)  # 定義用戶 ID 欄位
     items = db.Column(db.JSON)  # 定義訂單項目欄位，使用 JSON 類型
-    created_at = db.Column(db.DateTime, default=datetime.now(UTC))  # 定義創建時間欄位，預設為 UTC 時區的當前時間
+    created_at = db.Column(db.DateTime, server_default=UTC_NOW)  # 定義創建時間欄位，由資料庫於寫入時填入 UTC 當前時間
+    updated_at = db.Column(db.DateTime, server_default=UTC_NOW, onupdate=UTC_NOW)  # 定義更新時間欄位，每次更新時由資料庫填入
+    group_created_at = db.Column(db.DateTime)  # 所屬團購的建立時間，分區表以此欄位分區，使同一團購的訂單位於同一分區
+
+    # 每位用戶在每個團購只保留一筆訂單，修改訂單時以 upsert 覆寫
+    __table_args__ = (
+        db.UniqueConstraint('group_order_id', 'user_id', name='uq_user_orders_group_user'),
+    )
+
+# 訂單腳本共用的 Lua 函式：依訂單變更前後的內容，以差值更新團購的品項總數與點餐人數
+# KEYS[1]: group_order:{id}:orders，KEYS[2]: group_order:{id}:totals，KEYS[3]: group_order:{id}:participants
+# Redis 不會回復執行到一半失敗的腳本，因此各腳本先解析與驗證所有輸入、算出所有差值，最後才依序寫入訂單、總數與 stream
+_ORDER_TOTALS_LUA = """
+    -- 單一品項的數量上限 (多次加點累計)，避免數量超出整數範圍使 HINCRBY 失敗
+    local MAX_LINE_QTY = 9999
+
+    local function valid_qty(qty, min_qty)
+        return type(qty) == 'number' and qty == math.floor(qty) and qty >= min_qty and qty <= MAX_LINE_QTY
+    end
+
+    local function decode_lines(raw)
+        if not raw or raw == '' then
+            return {}
+        end
+        local ok, lines = pcall(cjson.decode, raw)
+        if not ok or type(lines) ~= 'table' then
+            error('invalid order json')
+        end
+        return lines
+    end
+
+    -- 與 order_lines.split_key 相同：將品項鍵拆回商品名稱與備註
+    local function split_key(key)
+        local open = string.find(key, '(', 1, true)
+        if open and open > 1 and string.sub(key, -1) == ')' then
+            return string.sub(key, 1, open - 1), string.sub(key, open + 1, -2)
+        end
+        return key, ''
+    end
+
+    -- 與 order_lines.normalize 相同：舊格式 (重複字串的清單) 依首次出現的順序轉成品項格式
+    local function to_keyed_lines(lines)
+        if type(lines[1]) ~= 'string' then
+            return lines
+        end
+        local keyed = {}
+        local seq = 0
+        for _, key in ipairs(lines) do
+            if type(key) ~= 'string' then
+                error('invalid order line')
+            end
+            if keyed[key] then
+                keyed[key]['qty'] = keyed[key]['qty'] + 1
+            else
+                seq = seq + 1
+                local item, note = split_key(key)
+                keyed[key] = {item = item, note = note, qty = 1, seq = seq}
+            end
+        end
+        return keyed
+    end
+
+    local function count_lines(lines)
+        local counts = {}
+        for key, line in pairs(lines) do
+            if type(line) == 'table' then
+                local qty = tonumber(line['qty']) or 0
+                if not valid_qty(qty, 0) then
+                    error('invalid quantity')
+                end
+                counts[key] = (counts[key] or 0) + qty
+            elseif type(line) == 'string' then
+                -- 舊格式：重複字串的清單
+                counts[line] = (counts[line] or 0) + 1
+            else
+                error('invalid order line')
+            end
+        end
+        return counts
+    end
+
+    -- 計算品項總數的差值與點餐人數的增減，不寫入任何資料
+    local function diff_totals(old_counts, new_counts)
+        local diffs = {}
+        for key, qty in pairs(new_counts) do
+            local diff = qty - (old_counts[key] or 0)
+            if diff ~= 0 then
+                diffs[key] = diff
+            end
+        end
+        for key, qty in pairs(old_counts) do
+            if new_counts[key] == nil then
+                diffs[key] = -qty
+            end
+        end
+        local had_items = next(old_counts) ~= nil
+        local has_items = next(new_counts) ~= nil
+        local participants = 0
+        if has_items and not had_items then
+            participants = 1
+        elseif had_items and not has_items then
+            participants = -1
+        end
+        return diffs, participants
+    end
+
+    local function apply_totals(diffs, participants)
+        for key, diff in pairs(diffs) do
+            if redis.call('HINCRBY', KEYS[2], key, diff) <= 0 then
+                redis.call('HDEL', KEYS[2], key)
+            end
+        end
+        if participants > 0 then
+            redis.call('INCR', KEYS[3])
+        elseif participants < 0 then
+            redis.call('DECR', KEYS[3])
+        end
+    end
+"""
+
+def _match_ids(column, ids):
+    """column = ANY(:ids)：以單一陣列參數比對多個 ID，語句不隨 ID 數量改變"""
+    return column == any_(db.bindparam('ids', [int(i) for i in ids], type_=ARRAY(db.Integer)))
 
 class DatabaseManager:  # 定義 DatabaseManager 類別
-    def __init__(self, redis_client):  # 初始化方法，接收 Redis 客戶端實例
+    # Redis 中活躍團購的索引集合，以及代表索引已完整同步的標記鍵
+    OPEN_GROUPS_KEY = 'open_groups'
+    OPEN_GROUPS_SYNCED_KEY = 'open_groups:synced'
+    # 活躍團購的次級索引：依餐廳、依開團者，並記錄所有已建立的次級索引鍵以便重建時清除
+    RESTAURANT_OPEN_KEY = 'restaurant_open:{}'
+    LEADER_OPEN_KEY = 'leader_open:{}'
+    OPEN_GROUP_INDEXES_KEY = 'open_groups:indexes'
+    # 已關閉團購的狀態索引，以及代表索引已從 PostgreSQL 完整同步的標記鍵
+    CLOSED_GROUPS_KEY = 'closed_groups'
+    CLOSED_GROUPS_SYNCED_KEY = 'closed_groups:synced'
+    # 活躍團購的到期佇列 (sorted set)：member 為團購 ID，score 為閉團時間的 epoch 秒數
+    CLOSE_TIMES_KEY = 'group_close_times'
+
+    # 團購的品項總數 (品項鍵 → 數量) 與點餐人數 (訂單中有品項的用戶數)，由訂單腳本以差值更新
+    TOTALS_KEY = 'group_order:{}:totals'
+    PARTICIPANTS_KEY = 'group_order:{}:participants'
+
+    # 在 Redis 端原子地調整單一品項的數量 (order_lines 格式)，並更新品項總數與點餐人數，
+    # 回傳 {調整後的訂單 JSON, 調整前的訂單 JSON (原本沒有訂單時為空字串)}；沒有任何變更時回傳 false
+    # KEYS[1..3]: 見 _ORDER_TOTALS_LUA，KEYS[4] (選用): write-behind stream，提供時同時寫入變更紀錄
+    # ARGV: user_id, 品項鍵, 數量增減, 商品名稱, 備註, group_order_id
+    ADJUST_ITEM_SCRIPT = _ORDER_TOTALS_LUA + """
+    local delta = tonumber(ARGV[3])
+    if not delta or not valid_qty(math.abs(delta), 0) then
+        error('invalid quantity delta')
+    end
+    if delta == 0 then
+        return false
+    end
+    local raw = redis.call('HGET', KEYS[1], ARGV[1])
+    -- 舊格式的訂單先轉成品項格式，否則加入品項鍵後會編碼成陣列與物件混合的內容
+    local lines = to_keyed_lines(decode_lines(raw))
+    local old_counts = count_lines(lines)
+    local key = ARGV[2]
+    local line = lines[key]
+    if not line then
+        if delta <= 0 then
+            return false
+        end
+        local seq = 0
+        for _, existing in pairs(lines) do
+            if type(existing) == 'table' then
+                seq = math.max(seq, tonumber(existing['seq']) or 0)
+            end
+        end
+        line = {item = ARGV[4], note = ARGV[5], qty = 0, seq = seq + 1}
+        lines[key] = line
+    end
+    line['qty'] = line['qty'] + delta
+    if line['qty'] <= 0 then
+        lines[key] = nil
+    elseif line['qty'] > MAX_LINE_QTY then
+        error('quantity exceeds limit')
+    end
+    local encoded = '{}'
+    if next(lines) ~= nil then
+        encoded = cjson.encode(lines)
+    end
+    local diffs, participants = diff_totals(old_counts, count_lines(lines))
+
+    redis.call('HSET', KEYS[1], ARGV[1], encoded)
+    apply_totals(diffs, participants)
+    if KEYS[4] then
+        redis.call('XADD', KEYS[4], '*', 'group_order_id', ARGV[6], 'user_id', ARGV[1], 'op', 'upsert', 'items', encoded)
+    end
+    return {encoded, raw or ''}
+    """
+
+    # 覆寫或刪除用戶的整筆訂單，並更新品項總數與點餐人數；回傳原本的訂單 JSON，原本沒有訂單時回傳 false
+    # KEYS[1..3]: 見 _ORDER_TOTALS_LUA，KEYS[4] (選用): write-behind stream
+    # ARGV: user_id, 新的訂單 JSON (空字串表示刪除), group_order_id,
+    #       預期的目前訂單 JSON (選用，空字串表示沒有訂單；與目前的訂單不同時不做任何變更並回傳 false)
+    REPLACE_ORDER_SCRIPT = _ORDER_TOTALS_LUA + """
+    local old = redis.call('HGET', KEYS[1], ARGV[1])
+    if ARGV[4] and (old or '') ~= ARGV[4] then
+        return false
+    end
+    local op = 'upsert'
+    if ARGV[2] == '' then
+        op = 'delete'
+    end
+    local diffs, participants = diff_totals(count_lines(decode_lines(old)), count_lines(decode_lines(ARGV[2])))
+
+    if op == 'delete' then
+        redis.call('HDEL', KEYS[1], ARGV[1])
+    else
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    end
+    apply_totals(diffs, participants)
+    if KEYS[4] then
+        redis.call('XADD', KEYS[4], '*', 'group_order_id', ARGV[3], 'user_id', ARGV[1], 'op', op, 'items', ARGV[2])
+    end
+    return old
+    """
+
+    # 由訂單重新計算品項總數與點餐人數，與現有的計數不一致時回傳 1；ARGV[1] 為 '1' 時一併覆寫
+    # KEYS[1..3]: 見 _ORDER_TOTALS_LUA
+    CHECK_TOTALS_SCRIPT = _ORDER_TOTALS_LUA + """
+    local totals = {}
+    local participants = 0
+    local orders = redis.call('HGETALL', KEYS[1])
+    for i = 2, #orders, 2 do
+        local counts = count_lines(decode_lines(orders[i]))
+        if next(counts) ~= nil then
+            participants = participants + 1
+            for key, qty in pairs(counts) do
+                totals[key] = (totals[key] or 0) + qty
+            end
+        end
+    end
+
+    local mismatch = tonumber(redis.call('GET', KEYS[3]) or '0') ~= participants
+    local unmatched = 0
+    for _ in pairs(totals) do
+        unmatched = unmatched + 1
+    end
+    local current = redis.call('HGETALL', KEYS[2])
+    for i = 1, #current, 2 do
+        if totals[current[i]] == tonumber(current[i + 1]) then
+            unmatched = unmatched - 1
+        else
+            mismatch = true
+        end
+    end
+    if unmatched ~= 0 then
+        mismatch = true
+    end
+
+    if mismatch and ARGV[1] == '1' then
+        redis.call('DEL', KEYS[2])
+        for key, qty in pairs(totals) do
+            redis.call('HSET', KEYS[2], key, qty)
+        end
+        redis.call('SET', KEYS[3], participants)
+    end
+    if mismatch then
+        return 1
+    end
+    return 0
+    """
+
+    def __init__(self, redis_client, write_behind=None):  # 初始化方法，接收 Redis 客戶端實例
         self.redis = redis_client  # 將 Redis 客戶端實例存儲為類別屬性
+        # 啟用 write-behind 時訂單變更只寫入 Redis，由 UserOrderWriteBehind 批次寫回 PostgreSQL
+        self.write_behind = write_behind
+        # 統計快照資料來源 (cache / database)，用於觀察昂貴的重建路徑被觸發的頻率
+        self._snapshot_stats = {'cache': 0, 'database': 0}
+        self._snapshot_stats_lock = threading.Lock()
+        self._adjust_item_script = self.redis.register_script(self.ADJUST_ITEM_SCRIPT)
+        self._replace_order_script = self.redis.register_script(self.REPLACE_ORDER_SCRIPT)
+        self._check_totals_script = self.redis.register_script(self.CHECK_TOTALS_SCRIPT)
+        # 閉團時間變更時通知的回呼 (例如喚醒 GroupExpiryEngine)
+        self._close_time_listeners = []
 
     def create_group_order(self, restaurant, leader_id):  # 創建新的團購
         """創建新的團購"""
@@ -57,13 +344,19 @@ class DatabaseManager:  # 定義 DatabaseManager 類別
             try:
                 # 使用 Redis 的 hset 命令將團購資訊儲存為 hash 結構
                 # redis_key 格式為 'group_order:{id}'
-                self.redis.hset(redis_key, mapping={
+                pipe = self.redis.pipeline()
+                pipe.hset(redis_key, mapping={
+                    'id': str(group_order.id),    # 儲存團購 ID
                     'restaurant': restaurant,      # 儲存餐廳名稱
                     'leader_id': leader_id,       # 儲存開團者 ID
                     'status': 'open',             # 設定團購狀態為開啟
                     'created_at': str(datetime.now(UTC)),  # 儲存建立時間(UTC)
                     'close_time': group_order.close_time.isoformat() if group_order.close_time else ''  # 儲存預計關閉時間,若無則存空字串
                 })
+                self._index_open_group(pipe, group_order.id, restaurant, leader_id)  # 加入活躍團購索引
+                pipe.zadd(self.CLOSE_TIMES_KEY, {str(group_order.id): group_order.close_time.timestamp()})  # 加入到期佇列
+                pipe.execute()
+                self._notify_close_time_changed()
             except Exception as redis_error:
                 print(f"Redis 錯誤: {redis_error}")
                 # Redis 錯誤不應該影響主要功能，所以只記錄不拋出
@@ -75,178 +368,592 @@ class DatabaseManager:  # 定義 DatabaseManager 類別
             raise  # 重新拋出異常以便上層處理
 
     def get_active_orders(self):
+        """獲取所有活躍團購 (僅回傳快照中的團購列表)"""
+        return self.get_active_orders_snapshot()['orders']
+
+    def get_active_orders_snapshot(self):
+        """
+        讀取活躍團購的唯讀快照。
+        優先以 pipeline 批次從 Redis 讀取；只有在快取缺漏時，才以單一 JOIN 查詢從 PostgreSQL 重建。
+
+        Returns:
+            dict: {'orders': [團購資料, ...], 'source': 'cache' | 'database'}
+        """
         try:
-            active_orders = []
-            self.redis.ping()
+            orders = self._read_active_orders_from_cache()
+            source = 'cache'
+            if orders is None:
+                orders = self.rebuild_active_orders_cache()
+                source = 'database'
+
+            with self._snapshot_stats_lock:
+                self._snapshot_stats[source] += 1
+            return {'orders': orders, 'source': source}
+
+        except Exception as e:
+            app.logger.error(f"獲取活躍訂單時發生錯誤: {e}")
+            return {'orders': [], 'source': 'error'}
+
+    def get_snapshot_stats(self):
+        """回傳快照讀取來源的累計次數"""
+        with self._snapshot_stats_lock:
+            return dict(self._snapshot_stats)
+
+    def _read_active_orders_from_cache(self):
+        """從 Redis 讀取活躍團購；若索引尚未同步或資料不完整則回傳 None"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.exists(self.OPEN_GROUPS_SYNCED_KEY)
+        pipe.smembers(self.OPEN_GROUPS_KEY)
+        synced, group_ids = pipe.execute()
+        if not synced:
+            return None
+
+        group_ids = sorted(group_ids, key=int)
+        pipe = self.redis.pipeline(transaction=False)
+        for group_order_id in group_ids:
+            pipe.hgetall(f'group_order:{group_order_id}')
+
+        active_orders = []
+        for group_order_id, order_data in zip(group_ids, pipe.execute()):
+            # 索引指向的團購不存在或狀態不一致，視為快取缺漏
+            if not order_data or order_data.get('status') != 'open':
+                return None
+            active_orders.append(self._to_order_dict(group_order_id, order_data))
+        return active_orders
+
+    def rebuild_active_orders_cache(self):
+        """以單一 JOIN 查詢從 PostgreSQL 讀取活躍團購與其用戶訂單，並一次寫回 Redis"""
+        if self.write_behind is not None:
+            # 啟用 write-behind 時 PostgreSQL 可能落後於 Redis，先寫回尚未同步的變更再讀取
+            self.write_behind.replay()
+        with app.app_context():
+            rows = (
+                db.session.query(GroupOrder, UserOrder)
+                .outerjoin(UserOrder, UserOrder.group_order_id == GroupOrder.id)
+                .filter(GroupOrder.status == 'open')
+                .order_by(GroupOrder.id, UserOrder.id)
+                .all()
+            )
+
+        # 先取得舊的次級索引鍵，於同一個 transaction 中清除後重建
+        stale_indexes = self.redis.smembers(self.OPEN_GROUP_INDEXES_KEY)
+        # 讀取 PostgreSQL 之後才寫入 stream 的訂單變更，以 Redis 中的訂單為準
+        pending_orders = self.write_behind.pending_keys() if self.write_behind is not None else set()
+
+        groups = {}
+        pipe = self.redis.pipeline()
+        pipe.delete(self.OPEN_GROUPS_KEY, self.OPEN_GROUP_INDEXES_KEY, self.CLOSE_TIMES_KEY, *stale_indexes)
+        for order, user_order in rows:
+            if order.id not in groups:
+                order_data = {
+                    'id': str(order.id),
+                    'restaurant': str(order.restaurant),
+                    'leader_id': str(order.leader_id),
+                    'status': 'open',
+                    'close_time': order.close_time.isoformat() if order.close_time else ''
+                }
+                groups[order.id] = order_data
+                pipe.hset(f'group_order:{order.id}', mapping=order_data)
+                self._index_open_group(pipe, order.id, order.restaurant, order.leader_id)
+                if order.close_time:
+                    pipe.zadd(self.CLOSE_TIMES_KEY, {str(order.id): order.close_time.timestamp()})
+            if user_order is not None and (str(order.id), user_order.user_id) not in pending_orders:
+                # 依 id 排序寫入，同一用戶的多筆紀錄以最新一筆為準
+                # 舊格式 (重複字串清單) 的紀錄在此一併轉成品項格式
+                pipe.hset(f'group_order:{order.id}:orders', user_order.user_id,
+                          json.dumps(order_lines.normalize(user_order.items)))
+        for group_order_id in groups:
+            # 由重建後的訂單重新計算品項總數與點餐人數
+            self._check_totals_script(keys=self._order_keys(group_order_id)[:3], args=['1'], client=pipe)
+        pipe.set(self.OPEN_GROUPS_SYNCED_KEY, 1)
+        pipe.execute()
+        self._notify_close_time_changed()
 
-            # 先從 PostgreSQL 獲取活躍訂單
+        return [self._to_order_dict(group_order_id, order_data) for group_order_id, order_data in groups.items()]
+
+    def rebuild_closed_groups_index(self, chunk_size=1000):
+        """
+        從 PostgreSQL 重建已關閉團購的資料與狀態索引 (重新啟動或 Redis 清空後)
+
+        已關閉團購隨歷史增加，依 ID 分段讀取，每段以一個 pipeline 寫入，
+        單次查詢與 pipeline 的大小不隨歷史成長；全部寫入後才設定同步標記。
+        """
+        rebuilt = 0
+        last_id = 0
+        while True:
             with app.app_context():
-                pg_orders = GroupOrder.query.filter_by(status='open').all()
-                
-                # 將 PostgreSQL 訂單同步到 Redis
-                for order in pg_orders:
-                    redis_key = f'group_order:{order.id}'
-                    # 每次都更新 Redis 中的資料
-                    self.redis.hset(
-                        redis_key,
-                        mapping={
-                            'restaurant': str(order.restaurant),
-                            'leader_id': str(order.leader_id),
-                            'status': 'open',
-                            'close_time': order.close_time.isoformat() if order.close_time else '',
-                            'id': str(order.id)
-                        }
-                    )
+                rows = db.session.execute(
+                    db.select(GroupOrder.id, GroupOrder.restaurant, GroupOrder.leader_id,
+                              GroupOrder.close_time, GroupOrder.closed_at)
+                    .where(GroupOrder.status == 'closed', GroupOrder.id > last_id)
+                    .order_by(GroupOrder.id)
+                    .limit(chunk_size)
+                ).all()
+            if not rows:
+                break
+
+            # 只加入不移除：重建期間由其他行程關閉的團購仍保留在索引中
+            pipe = self.redis.pipeline(transaction=False)
+            for group_order_id, restaurant, leader_id, close_time, closed_at in rows:
+                pipe.hset(f'group_order:{group_order_id}', mapping={
+                    'id': str(group_order_id),
+                    'restaurant': str(restaurant),
+                    'leader_id': str(leader_id),
+                    'status': 'closed',
+                    'close_time': close_time.isoformat() if close_time else '',
+                    'closed_at': str(closed_at) if closed_at else ''
+                })
+                pipe.sadd(self.CLOSED_GROUPS_KEY, group_order_id)
+            pipe.execute()
+            rebuilt += len(rows)
+            last_id = rows[-1][0]
+            if len(rows) < chunk_size:
+                break
+        self.redis.set(self.CLOSED_GROUPS_SYNCED_KEY, 1)
+        return rebuilt
+
+    def _ensure_closed_index(self):
+        """
+        確認已關閉團購索引已同步，未同步時從 PostgreSQL 重建
+
+        只在讀取已關閉團購時呼叫，不在活躍團購的快取缺漏路徑上執行。
+        """
+        if not self.redis.exists(self.CLOSED_GROUPS_SYNCED_KEY):
+            self.rebuild_closed_groups_index()
 
-                    # 同步該團購的所有用戶訂單
-                    user_orders = UserOrder.query.filter_by(group_order_id=order.id).all()
-                    for user_order in user_orders:
-                        self.redis.hset(
-                            f'group_order:{order.id}:orders',
-                            user_order.user_id,
-                            json.dumps(user_order.items)
-                        )
-
-                    # 從 Redis 讀取資料並正確處理編碼
-                    order_data = self.redis.hgetall(redis_key)
-                    order_dict = {
-                        'id': order_data.get("id", '') or '',
-                        'restaurant': order_data.get('restaurant', '') or '',
-                        'leader_id': order_data.get('leader_id', '') or '',
-                        'status': order_data.get('status', '') or '',
-                        'close_time': order_data.get('close_time', '') or ''
-                    }
-                    active_orders.append(order_dict)
-
-            return active_orders
+    def _index_open_group(self, pipe, group_order_id, restaurant, leader_id):
+        """在 pipeline 中將團購加入活躍團購索引與次級索引"""
+        restaurant_key = self.RESTAURANT_OPEN_KEY.format(restaurant)
+        leader_key = self.LEADER_OPEN_KEY.format(leader_id)
+        pipe.sadd(self.OPEN_GROUPS_KEY, group_order_id)
+        pipe.sadd(restaurant_key, group_order_id)
+        pipe.sadd(leader_key, group_order_id)
+        pipe.sadd(self.OPEN_GROUP_INDEXES_KEY, restaurant_key, leader_key)
 
+    def _unindex_open_group(self, pipe, group_order_id, restaurant, leader_id):
+        """在 pipeline 中將團購從活躍團購索引與次級索引移除"""
+        pipe.srem(self.OPEN_GROUPS_KEY, group_order_id)
+        pipe.srem(self.RESTAURANT_OPEN_KEY.format(restaurant), group_order_id)
+        pipe.srem(self.LEADER_OPEN_KEY.format(leader_id), group_order_id)
+        pipe.zrem(self.CLOSE_TIMES_KEY, group_order_id)
+
+    def _ensure_open_indexes(self):
+        """確認活躍團購索引已同步，未同步時從 PostgreSQL 重建"""
+        if not self.redis.exists(self.OPEN_GROUPS_SYNCED_KEY):
+            self.rebuild_active_orders_cache()
+
+    def _read_open_groups(self, group_ids):
+        """以單一 pipeline 讀取指定團購，只回傳仍為開啟狀態者 (依 ID 排序)"""
+        group_ids = sorted(group_ids, key=int)
+        pipe = self.redis.pipeline(transaction=False)
+        for group_order_id in group_ids:
+            pipe.hgetall(f'group_order:{group_order_id}')
+        return [
+            self._to_order_dict(group_order_id, order_data)
+            for group_order_id, order_data in zip(group_ids, pipe.execute())
+            if order_data and order_data.get('status') == 'open'
+        ]
+
+    def get_open_group(self, group_order_id):
+        """依團購 ID 查詢開啟中的團購，找不到時回傳 None"""
+        try:
+            self._ensure_open_indexes()
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.sismember(self.OPEN_GROUPS_KEY, str(group_order_id))
+            pipe.hgetall(f'group_order:{group_order_id}')
+            is_open, order_data = pipe.execute()
+            if not is_open or not order_data or order_data.get('status') != 'open':
+                return None
+            return self._to_order_dict(group_order_id, order_data)
         except Exception as e:
-            app.logger.error(f"獲取活躍訂單時發生錯誤: {e}")
+            app.logger.error(f"查詢團購 {group_order_id} 時發生錯誤: {e}")
+            return None
+
+    def get_open_group_by_restaurant(self, restaurant):
+        """依餐廳名稱查詢開啟中的團購，找不到時回傳 None"""
+        try:
+            self._ensure_open_indexes()
+            group_ids = self.redis.smembers(self.RESTAURANT_OPEN_KEY.format(restaurant))
+            groups = self._read_open_groups(group_ids)
+            return groups[0] if groups else None
+        except Exception as e:
+            app.logger.error(f"查詢 {restaurant} 的團購時發生錯誤: {e}")
+            return None
+
+    def get_open_groups_by_leader(self, leader_id):
+        """查詢指定開團者所有開啟中的團購"""
+        try:
+            self._ensure_open_indexes()
+            group_ids = self.redis.smembers(self.LEADER_OPEN_KEY.format(leader_id))
+            return self._read_open_groups(group_ids)
+        except Exception as e:
+            app.logger.error(f"查詢開團者 {leader_id} 的團購時發生錯誤: {e}")
             return []
-    
+
+    @staticmethod
+    def _to_order_dict(group_order_id, order_data):
+        """將 Redis hash 轉換為對外使用的團購資料格式"""
+        return {
+            'id': str(group_order_id),
+            'restaurant': order_data.get('restaurant', '') or '',
+            'leader_id': order_data.get('leader_id', '') or '',
+            'status': order_data.get('status', '') or '',
+            'close_time': order_data.get('close_time', '') or ''
+        }
+
     def get_closed_orders(self):
         try:
-            # 初始化一個空列表，用於存儲活躍的訂單
-            active_orders = []
-
-            # 確保 Redis 連接正常，檢查連接是否可用
-            # 如果 Redis 連接出現問題，這裡會拋出異常
-            self.redis.ping()
-
-            # 使用 Redis 的 keys 方法查找所有符合 'group_order:*' 模式的鍵
-            # 這意味著找出所有團體訂單相關的鍵
-            for key in self.redis.keys('group_order:*'):
-                try:
-                    # 使用 hgetall 獲取特定鍵的所有雜湊值
-                    # 這將返回該訂單的所有相關數據
-                    order_data = self.redis.hgetall(key)
-
-                    # 檢查訂單數據是否存在，並且狀態是 'open'
-                    # 使用 .get() 方法安全地獲取狀態，預設為空字節串
-                    # 使用 decode() 將字節串轉換為普通字串
-                    if order_data and order_data.get(b'status', b'').decode() == 'closed':
-                        # 如果訂單是活躍的，將其添加到 active_orders 列表
-                        active_orders.append({
-                            # 從鍵中提取訂單 ID（假設鍵的格式是 'group_order:ID'）
-                            'id': key.decode().split(':')[1],
-                            # 解碼並提取餐廳名稱
-                            'restaurant': order_data[b'restaurant'].decode(),
-                            # 解碼並提取訂單發起人（團長）的 ID
-                            'leader_id': order_data[b'leader_id'].decode(),
-                            # 解碼並提取訂單的閉團時間
-                            'close_time': order_data[b'close_time'].decode()
-                        })
-                except Exception as e:
-                    # 如果處理單個訂單時出現異常，捕獲並列印錯誤，然後繼續處理下一個訂單
-                    print(f"處理訂單資料時發生錯誤: {e}")
-                    continue
-
-            # 返回所有活躍的訂單列表
-            return active_orders
+            # 從已關閉團購的狀態索引取得成員，再以單一 pipeline 批次讀取團購資料
+            self._ensure_closed_index()
+            group_ids = sorted(self.redis.smembers(self.CLOSED_GROUPS_KEY), key=int)
+            pipe = self.redis.pipeline(transaction=False)
+            for group_order_id in group_ids:
+                pipe.hgetall(f'group_order:{group_order_id}')
+
+            closed_orders = []
+            for group_order_id, order_data in zip(group_ids, pipe.execute()):
+                if order_data and order_data.get('status') == 'closed':
+                    closed_orders.append(self._to_order_dict(group_order_id, order_data))
+
+            # 返回所有已關閉的訂單列表
+            return closed_orders
 
         except Exception as e:
             # 如果在整個獲取過程中出現任何嚴重錯誤，列印錯誤並返回空列表
-            print(f"獲取活躍訂單時發生錯誤: {e}")
+            print(f"獲取已關閉訂單時發生錯誤: {e}")
             return []
 
     def close_group_order(self, restaurant, leader_id):  # 關閉團購
         """關閉團購"""
-        # 從 Redis 獲取團購 ID
-        for key in self.redis.keys('group_order:*'):  # 遍歷所有以 'group_order:' 開頭的 Redis 鍵
-            order_data = self.redis.hgetall(key)  # 獲取團購的 Hash 值
-            if (order_data[b'restaurant'].decode() == restaurant and 
-                order_data[b'leader_id'].decode() == leader_id and 
-                order_data[b'status'].decode() == 'open'):  # 檢查團購是否符合條件
-                group_order_id = key.decode().split(':')[1]  # 解析團購 ID
-                
-                # 更新 PostgreSQL
-                group_order = GroupOrder.query.get(group_order_id)  # 根據團購 ID 獲取團購實例
-                if group_order:
-                    group_order.status = 'closed'  # 更新團購狀態為 'closed'
-                    group_order.closed_at = datetime.now(UTC)  # 設置關閉時間
-                    db.session.commit()  # 提交資料庫變更
-                
-                # 更新 Redis
-                self.redis.hset(key, 'status', 'closed')  # 更新團購狀態為 'closed'
-                self.redis.hset(key, 'closed_at', str(datetime.now(UTC)))  # 設置關閉時間
-                return True  # 返回成功標誌
-        return False  # 如果未找到符合條件的團購，返回失敗標誌
-
-    def add_user_order(self, group_order_id, user_id, items):  # 添加用戶訂單
-        """添加用戶訂單"""
-        # 保存到 PostgreSQL
-        user_order = UserOrder(
-            group_order_id=group_order_id,
-            user_id=user_id,
-            items=items
+        # 餐廳索引與開團者索引的交集即為該開團者在此餐廳的團購，不再掃描整個 keyspace
+        # 不同開團者可能同時開了同一家餐廳的團購，因此不能只取餐廳索引的第一筆
+        try:
+            self._ensure_open_indexes()
+            group_ids = self.redis.sinter(
+                self.RESTAURANT_OPEN_KEY.format(restaurant), self.LEADER_OPEN_KEY.format(leader_id)
+            )
+            orders = self._read_open_groups(group_ids)
+        except Exception as e:
+            app.logger.error(f"查詢開團者 {leader_id} 在 {restaurant} 的團購時發生錯誤: {e}")
+            return False
+        if not orders:
+            return False  # 如果未找到符合條件的團購，返回失敗標誌
+        return bool(self.close_group_orders([orders[0]['id']]))
+
+    def close_group_orders(self, group_ids=None, due_before=None):
+        """
+        批次關閉團購：PostgreSQL 以單一 UPDATE ... WHERE id = ANY(...) RETURNING 更新，
+        Redis 的狀態、活躍團購索引與到期佇列以一個 pipeline 更新
+
+        只會關閉仍為開啟狀態的團購，多個行程同時關閉時每個團購只會由其中一個行程關閉。
+
+        Args:
+            group_ids: 要關閉的團購 ID，None 表示不限定團購 (此時必須提供 due_before)
+            due_before: 只關閉閉團時間不晚於此時間的團購
+
+        Returns:
+            list: 本次關閉的團購 [{'id', 'restaurant', 'leader_id'}, ...]
+
+        Raises:
+            ValueError: group_ids 與 due_before 皆未提供 (會關閉所有團購且無法復原)
+        """
+        if group_ids is None and due_before is None:
+            raise ValueError("close_group_orders 需要 group_ids 或 due_before")
+        if group_ids is not None and not group_ids:
+            return []
+        closed_at = datetime.now(UTC)
+        stmt = db.update(GroupOrder).where(GroupOrder.status == 'open')
+        if group_ids is not None:
+            stmt = stmt.where(_match_ids(GroupOrder.id, group_ids))
+        if due_before is not None:
+            stmt = stmt.where(GroupOrder.close_time <= due_before)
+        stmt = stmt.values(status='closed', closed_at=closed_at).returning(
+            GroupOrder.id, GroupOrder.restaurant, GroupOrder.leader_id
         )
-        db.session.add(user_order)  # 將用戶訂單添加到資料庫會話中
-        db.session.commit()  # 提交資料庫變更
-        
-        # 更新 Redis
-        redis_key = f'group_order:{group_order_id}:orders'  # 生成 Redis 鍵
-        self.redis.hset(redis_key, user_id, json.dumps(items))  # 使用 Redis 的 Hash 類型存儲用戶訂單
+        with app.app_context():
+            try:
+                rows = db.session.execute(stmt).all()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+        closed_orders = [
+            {'id': group_order_id, 'restaurant': restaurant, 'leader_id': leader_id}
+            for group_order_id, restaurant, leader_id in rows
+        ]
+        if closed_orders:
+            # 更新 Redis：狀態、關閉時間與狀態索引在同一個 transaction 中切換
+            # PostgreSQL 已提交，Redis 更新失敗時仍回傳本次關閉的團購，未同步的團購由 sync_closed_groups() 補正
+            try:
+                pipe = self.redis.pipeline()
+                for order in closed_orders:
+                    self._mark_group_closed(pipe, order, closed_at)
+                pipe.execute()
+            except Exception as e:
+                app.logger.error(f"更新 Redis 中已關閉團購 {[order['id'] for order in closed_orders]} 的狀態時發生錯誤: {e}")
+        return closed_orders
+
+    def _mark_group_closed(self, pipe, order, closed_at):
+        """在 pipeline 中將團購標記為已關閉，並從活躍團購索引移除"""
+        pipe.hset(f'group_order:{order["id"]}', mapping={
+            'status': 'closed',
+            'closed_at': str(closed_at) if closed_at else ''
+        })
+        self._unindex_open_group(pipe, order['id'], order['restaurant'], order['leader_id'])
+        pipe.sadd(self.CLOSED_GROUPS_KEY, order['id'])
+
+    def sync_closed_groups(self, group_ids=None):
+        """
+        將 PostgreSQL 中已關閉、但 Redis 仍為開啟的團購同步為關閉 (close_group_orders 更新 Redis 失敗時)
+
+        Args:
+            group_ids: 要檢查的團購 ID，None 表示 Redis 活躍團購索引中的所有團購
+
+        Returns:
+            list: 本次同步的團購 [{'id', 'restaurant', 'leader_id'}, ...]
+        """
+        if group_ids is None:
+            group_ids = self.redis.smembers(self.OPEN_GROUPS_KEY)
+        if not group_ids:
+            return []
+        with app.app_context():
+            rows = db.session.execute(
+                db.select(GroupOrder.id, GroupOrder.restaurant, GroupOrder.leader_id, GroupOrder.closed_at)
+                .where(GroupOrder.status == 'closed', _match_ids(GroupOrder.id, group_ids))
+            ).all()
+        if not rows:
+            return []
+
+        synced_orders = []
+        pipe = self.redis.pipeline()
+        for group_order_id, restaurant, leader_id, closed_at in rows:
+            order = {'id': group_order_id, 'restaurant': restaurant, 'leader_id': leader_id}
+            self._mark_group_closed(pipe, order, closed_at)
+            synced_orders.append(order)
+        pipe.execute()
+        return synced_orders
+
+    @staticmethod
+    def build_user_order_upsert(rows):
+        """
+        建立 user_orders 的 INSERT ... ON CONFLICT DO UPDATE 語句
+
+        Args:
+            rows: [{'group_order_id': ..., 'user_id': ..., 'items': ...}, ...]
+        """
+        # 一併寫入所屬團購的建立時間 (分區鍵)
+        stmt = pg_insert(UserOrder).values([
+            dict(row, group_created_at=db.select(GroupOrder.created_at)
+                 .where(GroupOrder.id == row['group_order_id']).scalar_subquery())
+            for row in rows
+        ])
+        # 分區表的唯一索引必須包含分區鍵
+        index_elements = [UserOrder.group_order_id, UserOrder.user_id]
+        if env_config.PARTITIONING_ENABLED:
+            index_elements.append(UserOrder.group_created_at)
+        return stmt.on_conflict_do_update(
+            index_elements=index_elements,
+            # ON CONFLICT DO UPDATE 不會套用欄位的 onupdate，需明確更新 updated_at
+            set_={'items': stmt.excluded['items'], 'updated_at': UTC_NOW}
+        )
+
+    def add_user_order(self, group_order_id, user_id, items):  # 添加或更新用戶訂單
+        """添加或更新用戶訂單，items 為 order_lines 格式的 {品項鍵: 品項}"""
+        if self.write_behind is not None:
+            # 訂單、品項總數與變更紀錄在同一個 Lua 腳本中寫入 Redis，PostgreSQL 由背景批次寫回
+            self._replace_order(group_order_id, user_id, json.dumps(items))
+            self.write_behind.start()
+            return
+
+        # 更新 Redis 的用戶訂單與品項總數，並在回覆前寫回 PostgreSQL (失敗時還原 Redis 並拋出例外)
+        encoded = json.dumps(items)
+        previous = self._replace_order(group_order_id, user_id, encoded)
+        self._persist_or_revert(group_order_id, user_id, previous, encoded)
+
+    def _order_keys(self, group_order_id):
+        """訂單腳本使用的 KEYS：訂單、品項總數、點餐人數 (啟用 write-behind 時再加上 stream)"""
+        keys = [
+            f'group_order:{group_order_id}:orders',
+            self.TOTALS_KEY.format(group_order_id),
+            self.PARTICIPANTS_KEY.format(group_order_id)
+        ]
+        if self.write_behind is not None:
+            keys.append(self.write_behind.STREAM_KEY)
+        return keys
+
+    def _replace_order(self, group_order_id, user_id, encoded):
+        """覆寫 (encoded 為空字串時刪除) 用戶的整筆訂單並更新品項總數，回傳原本的訂單 JSON (原本沒有訂單時為 None)"""
+        return self._replace_order_script(
+            keys=self._order_keys(group_order_id),
+            args=[user_id, encoded, str(group_order_id)]
+        )
+
+    def _persist_or_revert(self, group_order_id, user_id, previous, written):
+        """
+        同步寫回 PostgreSQL；失敗時將 Redis 的訂單還原為變更前的內容後重新拋出例外
+
+        使用者收到錯誤回覆後重試，不會因為 Redis 已保留第一次的變更而重複加點。
+        只有在 Redis 的訂單仍是本次寫入的內容 (written) 時才還原，不覆寫之後其他請求的變更。
+        """
+        try:
+            self._persist_user_order(group_order_id, user_id)
+        except Exception:
+            try:
+                self._replace_order_script(
+                    keys=self._order_keys(group_order_id),
+                    args=[user_id, previous or '', str(group_order_id), written]
+                )
+            except Exception as e:
+                app.logger.error(f"還原團購 {group_order_id} 用戶 {user_id} 的 Redis 訂單時發生錯誤: {e}")
+            raise
+
+    def adjust_user_order_item(self, group_order_id, user_id, key, delta, item=None, note=None):
+        """
+        在 Redis 中原子地增減單一品項的數量，並在回覆前寫回 PostgreSQL (失敗時還原 Redis 並拋出例外)
+        (啟用 write-behind 時變更紀錄由同一個 Lua 腳本寫入 stream，由背景批次寫回)
+
+        Args:
+            key: 品項鍵 (order_lines.make_key)
+            delta: 數量增減，品項數量歸零時移除
+            item, note: 新增品項時使用的商品名稱與備註，未提供時由品項鍵拆出
+
+        Returns:
+            dict: 調整後的訂單 ({品項鍵: 品項})；品項不存在而無法減少時回傳 None
+        """
+        if item is None:
+            item, note = order_lines.split_key(key)
+        result = self._adjust_item_script(
+            keys=self._order_keys(group_order_id),
+            args=[user_id, key, delta, item, note or "", str(group_order_id)]
+        )
+        if not result:
+            return None
+        encoded, previous = result
+        if self.write_behind is not None:
+            self.write_behind.start()
+        else:
+            self._persist_or_revert(group_order_id, user_id, previous, encoded)
+        return order_lines.normalize(json.loads(encoded))
+
+    def _persist_user_order(self, group_order_id, user_id):
+        """
+        將 Redis 中目前的用戶訂單同步寫回 PostgreSQL (Redis 中已無訂單時刪除該筆紀錄)
+
+        同一用戶的寫回以 advisory lock 依序執行，並在取得鎖之後才讀取 Redis：
+        每次寫回都在自己的 Redis 變更之後讀取，最後 commit 的寫回必定讀到最新的訂單，
+        交錯的請求不會以舊的內容覆寫 (或還原已刪除的) 訂單。
+        """
+        with app.app_context():
+            try:
+                if db.engine.dialect.name == 'postgresql':
+                    db.session.execute(
+                        db.text("SELECT pg_advisory_xact_lock(:group_order_id, hashtext(:user_id))"),
+                        {'group_order_id': int(group_order_id), 'user_id': user_id}
+                    )
+                encoded = self.redis.hget(f'group_order:{group_order_id}:orders', user_id)
+                if encoded is None:
+                    UserOrder.query.filter_by(
+                        group_order_id=int(group_order_id),
+                        user_id=user_id
+                    ).delete(synchronize_session=False)
+                else:
+                    db.session.execute(self.build_user_order_upsert([{
+                        'group_order_id': int(group_order_id),
+                        'user_id': user_id,
+                        'items': order_lines.normalize(json.loads(encoded))
+                    }]))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def get_user_orders_many(self, group_order_ids):
+        """以一個 pipeline 獲取多個團購的所有訂單，回傳 {團購 ID: {用戶 ID: 訂單}}"""
+        pipe = self.redis.pipeline(transaction=False)
+        for group_order_id in group_order_ids:
+            pipe.hgetall(f'group_order:{group_order_id}:orders')
+        return {
+            group_order_id: {k: order_lines.normalize(json.loads(v)) for k, v in orders.items()}
+            for group_order_id, orders in zip(group_order_ids, pipe.execute())
+        }
+
+    def get_group_totals(self, group_order_id):
+        """獲取團購的品項總數 {品項鍵: 數量}"""
+        return {key: int(qty) for key, qty in self.redis.hgetall(self.TOTALS_KEY.format(group_order_id)).items()}
+
+    def get_group_totals_many(self, group_order_ids):
+        """以一個 pipeline 獲取多個團購的品項總數，回傳 {團購 ID: {品項鍵: 數量}}"""
+        pipe = self.redis.pipeline(transaction=False)
+        for group_order_id in group_order_ids:
+            pipe.hgetall(self.TOTALS_KEY.format(group_order_id))
+        return {
+            group_order_id: {key: int(qty) for key, qty in totals.items()}
+            for group_order_id, totals in zip(group_order_ids, pipe.execute())
+        }
+
+    def get_participant_counts(self, group_order_ids):
+        """以一個 pipeline 獲取多個團購的點餐人數，回傳 {團購 ID: 人數}"""
+        counts = self.redis.mget([self.PARTICIPANTS_KEY.format(group_order_id) for group_order_id in group_order_ids]) \
+            if group_order_ids else []
+        return {group_order_id: int(count or 0) for group_order_id, count in zip(group_order_ids, counts)}
+
+    def check_group_totals(self, group_order_ids=None, repair=True):
+        """
+        由訂單重新計算品項總數與點餐人數，找出與計數不一致的團購
+
+        Args:
+            group_order_ids: 要檢查的團購 ID，None 表示所有活躍團購
+            repair: 是否以重新計算的結果覆寫不一致的計數
+
+        Returns:
+            list: 計數不一致的團購 ID
+        """
+        if group_order_ids is None:
+            group_order_ids = sorted(int(group_order_id) for group_order_id in self.redis.smembers(self.OPEN_GROUPS_KEY))
+        pipe = self.redis.pipeline(transaction=False)
+        for group_order_id in group_order_ids:
+            self._check_totals_script(
+                keys=self._order_keys(group_order_id)[:3], args=['1' if repair else '0'], client=pipe
+            )
+        return [group_order_id for group_order_id, mismatch in zip(group_order_ids, pipe.execute()) if mismatch]
 
     def get_user_orders(self, group_order_id):
         """獲取團購中的所有訂單"""
         redis_key = f'group_order:{group_order_id}:orders'  # 生成 Redis 鍵
         orders = self.redis.hgetall(redis_key)  # 獲取團購中的所有訂單
-        return {k: json.loads(v) for k, v in orders.items()}  # 直接使用字串，不需要 decode
+        return {k: order_lines.normalize(json.loads(v)) for k, v in orders.items()}  # 直接使用字串，不需要 decode
 
     def get_user_order(self, group_order_id, user_id):
-        """獲取特定用戶的訂單"""
+        """獲取特定用戶的訂單 ({品項鍵: 品項})，沒有訂單時回傳 None"""
         redis_key = f'group_order:{group_order_id}:orders'
         order = self.redis.hget(redis_key, user_id)
         if order:
             if isinstance(order, bytes):
-                return json.loads(order.decode())
-            else:
-                return json.loads(order)
+                order = order.decode()
+            return order_lines.normalize(json.loads(order))
         return None
     
     def delete_user_order(self, group_order_id, user_id):
-        """刪除訂單"""
+        """
+        刪除訂單，回傳原本是否有訂單
+
+        同步寫回 PostgreSQL 失敗時還原 Redis 中的訂單並拋出例外，由呼叫端回覆錯誤訊息。
+        """
+        if self.write_behind is not None:
+            # 刪除 Redis 中的訂單並記錄變更，PostgreSQL 由背景批次刪除
+            previous = self._replace_order(group_order_id, user_id, '')
+            self.write_behind.start()
+            return previous is not None
+
+        # 與 write-behind 相同先刪除 Redis 中的訂單並更新品項總數，再同步刪除 PostgreSQL 的紀錄
+        previous = self._replace_order(group_order_id, user_id, '')
         try:
-            # 從 PostgreSQL 刪除所有符合條件的訂單
-            user_orders = UserOrder.query.filter_by(
-                group_order_id=group_order_id,
-                user_id=user_id
-            ).all()  # 使用 .all() 取得所有符合的訂單
-            
-            if user_orders:
-                for order in user_orders:
-                    db.session.delete(order)
-                db.session.commit()
-                
-                # 修正：使用正確的 Redis 鍵值格式
-                redis_key = f'group_order:{group_order_id}:orders'  # 與 get_user_order 使用相同的鍵值格式
-                self.redis.hdel(redis_key, user_id)  # 使用 hdel 刪除 hash 中的特定欄位
-                return True
-            return False
+            self._persist_or_revert(group_order_id, user_id, previous, '')
         except Exception as e:
-            print(f"刪除訂單時發生錯誤: {e}")
-            db.session.rollback()  # 發生錯誤時回滾事務
-            return False
+            app.logger.error(f"刪除團購 {group_order_id} 用戶 {user_id} 的訂單時發生錯誤: {e}")
+            raise
+        return previous is not None
 
     def set_group_order_close_time(self, group_order_id, close_time):
         """設定團購閉團時間"""
@@ -264,15 +971,20 @@ class DatabaseManager:  # 定義 DatabaseManager 類別
                 utc_time = close_time.astimezone(UTC)
                 
                 # 更新 PostgreSQL，保留時區信息
-                group_order = GroupOrder.query.get(group_order_id)
+                group_order = db.session.get(GroupOrder, group_order_id)
                 if group_order:
                     # 直接存儲 UTC 時間，保留時區信息
                     group_order.close_time = utc_time
                     db.session.commit()
                     
-                    # 更新 Redis，存儲帶時區的 ISO 格式時間字符串
+                    # 更新 Redis，存儲帶時區的 ISO 格式時間字符串，並更新到期佇列
                     redis_key = f'group_order:{group_order_id}'
-                    self.redis.hset(redis_key, 'close_time', utc_time.isoformat())
+                    pipe = self.redis.pipeline()
+                    pipe.hset(redis_key, 'close_time', utc_time.isoformat())
+                    if group_order.status == 'open':
+                        pipe.zadd(self.CLOSE_TIMES_KEY, {str(group_order_id): utc_time.timestamp()})
+                    pipe.execute()
+                    self._notify_close_time_changed()
                     return True
                 return False
         except Exception as e:
@@ -283,26 +995,56 @@ class DatabaseManager:  # 定義 DatabaseManager 類別
     def check_and_close_expired_orders(self):
         """檢查並關閉已到期的團購"""
         try:
-            with app.app_context():  # 確保在應用上下文中執行
-                # 從 PostgreSQL 獲取所有開啟的團購
-                current_time = datetime.now(UTC)
-                orders_to_close = GroupOrder.query.filter(
-                    GroupOrder.status == 'open',
-                    GroupOrder.close_time <= current_time
-                ).all()
-                
-                closed_orders = []
-                
-                # 關閉已到期的團購
-                for order in orders_to_close:
-                    self.close_group_order(order.restaurant, order.leader_id)
-                    closed_orders.append({
-                        'id': order.id,
-                        'restaurant': order.restaurant,
-                        'leader_id': order.leader_id
-                    })
-                
-                return closed_orders
+            return self.close_group_orders(due_before=datetime.now(UTC))
         except Exception as e:
             print(f"檢查並關閉到期團購時發生錯誤: {e}")
-            return []
\ No newline at end of file
+            return []
+
+    def add_close_time_listener(self, callback):
+        """註冊閉團時間變更 (開團、修改閉團時間、重建快取) 時呼叫的回呼"""
+        self._close_time_listeners.append(callback)
+
+    def _notify_close_time_changed(self):
+        for callback in self._close_time_listeners:
+            callback()
+
+    def get_next_close_time(self):
+        """回傳到期佇列中最早的 (團購 ID, 閉團時間 epoch 秒數)，佇列為空時回傳 None"""
+        head = self.redis.zrange(self.CLOSE_TIMES_KEY, 0, 0, withscores=True)
+        return head[0] if head else None
+
+    def get_due_group_ids(self, now=None):
+        """回傳到期佇列中閉團時間已到的團購 ID"""
+        now = datetime.now(UTC).timestamp() if now is None else now
+        return self.redis.zrangebyscore(self.CLOSE_TIMES_KEY, '-inf', now)
+
+    def close_due_group_orders(self, group_ids):
+        """
+        關閉到期佇列中已到期的團購，以 PostgreSQL 中的狀態與閉團時間為準
+
+        閉團時間已被延後的團購依新的時間重新排入佇列，已關閉或不存在的團購自佇列移除。
+
+        Returns:
+            list: 已關閉的團購 [{'id', 'restaurant', 'leader_id'}, ...]
+        """
+        closed_orders = self.close_group_orders(group_ids, due_before=datetime.now(UTC))
+        remaining_ids = set(map(str, group_ids)) - {str(order['id']) for order in closed_orders}
+        if not remaining_ids:
+            return closed_orders
+
+        # 未被關閉的團購：閉團時間已延後者重新排入，其餘自佇列移除
+        with app.app_context():
+            rows = db.session.query(GroupOrder.id, GroupOrder.status, GroupOrder.close_time).filter(
+                _match_ids(GroupOrder.id, remaining_ids)
+            ).all()
+        pipe = self.redis.pipeline()
+        for group_order_id, status, close_time in rows:
+            if status == 'open' and close_time is not None:
+                if close_time.tzinfo is None:
+                    close_time = close_time.replace(tzinfo=UTC)
+                pipe.zadd(self.CLOSE_TIMES_KEY, {str(group_order_id): close_time.timestamp()})
+                remaining_ids.discard(str(group_order_id))
+        if remaining_ids:
+            pipe.zrem(self.CLOSE_TIMES_KEY, *remaining_ids)
+        pipe.execute()
+        return closed_orders
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+團購到期引擎
+
+活躍團購的閉團時間存放在 Redis 的到期佇列 (DatabaseManager.CLOSE_TIMES_KEY, sorted set)，
+背景執行緒只在最早的閉團時間到達時醒來關閉團購，不再定時輪詢 PostgreSQL：
+閉團時間一到即關閉，閒置時只有每 max_sleep 秒一次的 Redis 查詢。
+開團或修改閉團時間時 DatabaseManager 會通知引擎，提前醒來重新計算下一個閉團時間；
+通知同時經由 Redis pub/sub 發送，多個 worker 行程時由任一行程修改的閉團時間也會喚醒執行中的引擎。
+到期佇列寫入失敗或遺失的團購，由 app 每 EXPIRY_SWEEP_INTERVAL_MINUTES 分鐘一次的 PostgreSQL 掃描
+(DatabaseManager.check_and_close_expired_orders) 關閉。
+"""
+import threading
+import time
+
+
+class GroupExpiryEngine:
+    """依到期佇列在閉團時間準時關閉團購"""
+
+    # 閉團時間變更的通知頻道
+    WAKEUP_CHANNEL = 'group_close_times:wakeup'
+
+    def __init__(self, db_manager, logger, max_sleep=60.0, retry_interval=1.0, on_closed=None):
+        """
+        Args:
+            max_sleep: 最長的睡眠秒數，其他行程修改到期佇列時最晚在此時間內察覺
+            retry_interval: 關閉失敗或 Redis 錯誤時的重試間隔秒數
+            on_closed: 關閉團購後呼叫的回呼，參數為 close_due_group_orders() 回傳的清單
+        """
+        self.db_manager = db_manager
+        self.logger = logger
+        self.max_sleep = max_sleep
+        self.retry_interval = retry_interval
+        self.on_closed = on_closed
+        self._wakeup = threading.Event()
+        # 每次啟動使用新的停止事件，stop() 之後再 start() 不會與先前的執行緒共用
+        self._stop_event = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'wakeups': 0, 'closed_groups': 0, 'errors': 0}
+        db_manager.add_close_time_listener(self.notify)
+
+    def start(self):
+        """啟動背景執行緒與喚醒通知的訂閱 (重複呼叫不會重複啟動)"""
+        with self._start_lock:
+            if self._stop_event is not None:
+                return
+            self._stop_event = stop_event = threading.Event()
+            threading.Thread(target=self._run, args=(stop_event,), name='group-expiry-engine', daemon=True).start()
+            threading.Thread(target=self._listen, args=(stop_event,), name='group-expiry-listener', daemon=True).start()
+
+    def stop(self):
+        """停止背景執行緒 (例如本行程不再是 leader)"""
+        with self._start_lock:
+            if self._stop_event is None:
+                return
+            self._stop_event.set()
+            self._stop_event = None
+        self._wakeup.set()
+
+    def wake(self):
+        """閉團時間有變更，讓本行程的背景執行緒立即重新計算下一個閉團時間"""
+        self._wakeup.set()
+
+    def notify(self):
+        """閉團時間有變更：喚醒本行程的引擎，並通知其他行程中執行中的引擎"""
+        self.wake()
+        try:
+            self.db_manager.redis.publish(self.WAKEUP_CHANNEL, '1')
+        except Exception as e:
+            # 其他行程的引擎最晚在 max_sleep 秒後察覺
+            self.logger.warning(f"發送閉團時間變更通知時發生錯誤: {e}")
+
+    def get_metrics(self):
+        """回傳喚醒次數、已關閉團購數與下一個閉團時間"""
+        with self._stats_lock:
+            metrics = dict(self._stats)
+        try:
+            next_close = self.db_manager.get_next_close_time()
+            metrics['scheduled_groups'] = self.db_manager.redis.zcard(self.db_manager.CLOSE_TIMES_KEY)
+        except Exception:
+            next_close = None
+            metrics['scheduled_groups'] = None
+        metrics['next_group_id'] = next_close[0] if next_close else None
+        metrics['next_close_in_seconds'] = round(next_close[1] - time.time(), 3) if next_close else None
+        metrics['running'] = self._stop_event is not None
+        return metrics
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def _run(self, stop_event):
+        while not stop_event.is_set():
+            # 先清除再讀取佇列：讀取之後的變更會讓下方的 wait 立即返回
+            self._wakeup.clear()
+            try:
+                timeout = self._close_due_groups()
+            except Exception as e:
+                self._count('errors')
+                self.logger.error(f"關閉到期團購時發生錯誤: {e}")
+                timeout = self.retry_interval
+            self._wakeup.wait(timeout)
+            self._count('wakeups')
+
+    def _listen(self, stop_event):
+        """訂閱閉團時間變更的通知，收到時喚醒背景執行緒"""
+        while not stop_event.is_set():
+            pubsub = self.db_manager.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.WAKEUP_CHANNEL)
+                while not stop_event.is_set():
+                    if pubsub.get_message(timeout=1.0):
+                        self.wake()
+            except Exception as e:
+                self.logger.error(f"訂閱閉團時間變更通知時發生錯誤: {e}")
+                stop_event.wait(self.retry_interval)
+            finally:
+                pubsub.close()
+
+    def _close_due_groups(self):
+        """
+        關閉已到期的團購
+
+        Returns:
+            float: 距離下一個閉團時間的秒數 (不超過 max_sleep)
+        """
+        due_ids = self.db_manager.get_due_group_ids(time.time())
+        if due_ids:
+            closed_orders = self.db_manager.close_due_group_orders(due_ids)
+            if closed_orders:
+                self._count('closed_groups', len(closed_orders))
+                if self.on_closed is not None:
+                    self.on_closed(closed_orders)
+
+        next_close = self.db_manager.get_next_close_time()
+        if next_close is None:
+            return self.max_sleep
+        delay = next_close[1] - time.time()
+        if delay <= 0:
+            # 剛到期或未能關閉的團購，稍後再處理，避免持續重試
+            return self.retry_interval
+        return min(delay, self.max_sleep)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Flex Message 建構函式
+
+直接建立 LINE SDK 的 Flex 模型物件，取代「dict → json.dumps → FlexContainer.from_json」的往返轉換。
+不隨資料變動的元件 (標題、分隔線、標籤文字) 在模組載入時建立一次並重複使用；
+模型物件在序列化時不會被修改，因此可安全地在多則訊息之間共用。
+重複出現的版型 (每間餐廳的訂單 bubble、每個品項的修改區塊) 以 FlexTemplate 預先編譯，每次只填入變動欄位。
+"""
+from linebot.v3.messaging import (
+    FlexBubble,
+    FlexBox,
+    FlexText,
+    FlexImage,
+    FlexButton,
+    FlexSeparator,
+    FlexCarousel,
+    PostbackAction,
+)
+
+from flex_template import FlexTemplate
+
+# ==============================================================================
+#  固定不變的元件
+# ==============================================================================
+
+_EDIT_TITLE = FlexText(text="修改訂單", weight="bold", size="xl")
+_EDIT_SEPARATOR = FlexSeparator(margin="xxl")
+
+
+# ==============================================================================
+#  我的訂單 (carousel)
+# ==============================================================================
+
+_ORDER_SUMMARY_BUBBLE = FlexTemplate(FlexBubble(
+    hero=FlexImage(url="{image_url}", size="full", aspect_ratio="20:13", aspect_mode="cover"),
+    body=FlexBox(
+        layout="vertical",
+        spacing="md",
+        contents=[
+            FlexText(text="【{restaurant}】", weight="bold", size="lg", color="#000000"),
+            FlexSeparator(margin="lg"),
+            FlexText(text="您的訂單內容：", weight="bold", margin="lg", size="md"),
+            FlexText(text="{summary_text}", wrap=True, margin="sm", size="sm", color="#555555")
+        ]
+    ),
+    footer=FlexBox(
+        layout="vertical",
+        spacing="sm",
+        contents=[
+            FlexButton(
+                style="primary",
+                color="#4CAF50",  # 綠色
+                height="sm",
+                action=PostbackAction(
+                    label="✏️ 修改訂單",
+                    data="action=edit_order&group_order_id={group_order_id}",
+                    display_text="修改 {restaurant} 訂單"
+                )
+            ),
+            FlexButton(
+                style="primary",
+                color="#F44336",  # 紅色
+                height="sm",
+                action=PostbackAction(
+                    label="🗑️ 清空此訂單",
+                    data="action=clear_my_order&group_order_id={group_order_id}",
+                    display_text="確定要清空 {restaurant} 的訂單嗎？"
+                )
+            )
+        ]
+    )
+))
+
+
+def build_order_summary_bubble(restaurant, image_url, summary_text, group_order_id):
+    """建立「我的訂單」中單一餐廳的 bubble"""
+    return _ORDER_SUMMARY_BUBBLE.render(
+        restaurant=restaurant,
+        image_url=image_url,
+        summary_text=summary_text,
+        group_order_id=group_order_id
+    )
+
+
+def build_carousel(bubbles):
+    """將多個 bubble 組成 carousel"""
+    return FlexCarousel(contents=bubbles)
+
+
+# ==============================================================================
+#  修改訂單 (bubble)
+# ==============================================================================
+
+_EDIT_ITEM_BOX = FlexTemplate(FlexBox(
+    layout="vertical",
+    margin="md",
+    contents=[
+        FlexText(text="{item_name}", size="md", color="#555555", weight="bold"),
+        FlexBox(
+            layout="horizontal",
+            margin="sm",
+            contents=[
+                FlexButton(
+                    style="secondary",
+                    height="sm",
+                    action=PostbackAction(
+                        label="-",
+                        data="action=decrease_item&group_order_id={group_order_id}&item={item}"
+                    )
+                ),
+                FlexText(text="{count}", size="md", color="#111111", align="center", gravity="center", flex=1),
+                FlexButton(
+                    style="secondary",
+                    height="sm",
+                    action=PostbackAction(
+                        label="+",
+                        data="action=increase_item&group_order_id={group_order_id}&item={item}"
+                    )
+                )
+            ]
+        ),
+        FlexText(text="備註：{note}", size="sm", color="#888888", wrap=True, margin="sm"),
+        FlexButton(
+            style="link",
+            height="sm",
+            margin="xs",
+            action=PostbackAction(
+                label="✏️ 編輯備註",
+                data="action=prompt_update_note&group_order_id={group_order_id}&item={item}"
+            )
+        )
+    ]
+))
+
+
+def build_edit_item_box(item, item_name, note, count, group_order_id):
+    """建立修改訂單介面中單一品項的區塊 (名稱、數量加減按鈕、備註與編輯備註按鈕)"""
+    return _EDIT_ITEM_BOX.render(
+        item=item,
+        item_name=item_name,
+        note=note if note else '無',
+        count=count,
+        group_order_id=group_order_id
+    )
+
+
+def build_edit_order_bubble(item_boxes, group_order_id):
+    """建立修改訂單的 bubble"""
+    return FlexBubble(
+        body=FlexBox(
+            layout="vertical",
+            contents=[
+                _EDIT_TITLE,
+                _EDIT_SEPARATOR,
+                FlexBox(layout="vertical", margin="xl", spacing="sm", contents=item_boxes)
+            ]
+        ),
+        footer=FlexBox(
+            layout="vertical",
+            spacing="sm",
+            contents=[
+                FlexButton(
+                    style="primary",
+                    color="#4CAF50",
+                    action=PostbackAction(
+                        label="💾完成修改",
+                        data=f"action=save_edit&group_order_id={group_order_id}"
+                    )
+                )
+            ]
+        )
+    )
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Flex 版型樣板
+
+以一般的 SDK 模型物件描述版型，需要替換的字串欄位寫成 "{slot}" 佔位符。
+樣板建立時只編譯一次，記錄所有佔位符所在的路徑；
+每次產生訊息時只複製「根節點到佔位符」路徑上的節點 (copy-on-write)，
+其餘不含佔位符的子樹直接與樣板共用，不需重新建立或驗證。
+"""
+from string import Formatter
+
+from pydantic.v1 import BaseModel
+
+
+class FlexTemplate:
+    """預先編譯的 Flex 版型，呼叫 render() 填入佔位符"""
+
+    def __init__(self, skeleton):
+        self.skeleton = skeleton
+        self._tree = self._compile(skeleton)
+        if self._tree is None:
+            raise ValueError("樣板中沒有任何佔位符")
+
+    def render(self, **values):
+        """依照佔位符名稱填入 values，回傳新的模型物件 (樣板本身不會被修改)"""
+        return self._fill(self.skeleton, self._tree, values)
+
+    @classmethod
+    def _compile(cls, node):
+        """
+        找出所有含佔位符的欄位。
+        回傳與模型結構對應的巢狀 dict：葉節點為樣板字串；不含佔位符的子樹回傳 None。
+        """
+        if isinstance(node, str):
+            return node if any(field for _, field, _, _ in Formatter().parse(node)) else None
+        if isinstance(node, BaseModel):
+            children = {name: cls._compile(getattr(node, name)) for name in node.__fields__}
+        elif isinstance(node, list):
+            children = {index: cls._compile(child) for index, child in enumerate(node)}
+        else:
+            return None
+        children = {key: child for key, child in children.items() if child is not None}
+        return children or None
+
+    @classmethod
+    def _fill(cls, node, tree, values):
+        if isinstance(tree, str):
+            return tree.format_map(values)
+        if isinstance(node, list):
+            filled = list(node)
+            for index, subtree in tree.items():
+                filled[index] = cls._fill(node[index], subtree, values)
+            return filled
+        # pydantic 的 copy(update=...) 為淺複製且不重新驗證，未更新的欄位與樣板共用
+        return node.copy(update={
+            name: cls._fill(getattr(node, name), subtree, values)
+            for name, subtree in tree.items()
+        })
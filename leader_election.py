@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+以 Redis 鎖選出單一行程執行背景工作 (自動閉團、分區維護)
+
+多個 worker 行程同時啟動時，只有取得鎖的行程成為 leader：
+鎖以 SET NX PX 取得並設定租約，leader 每隔 heartbeat_interval 秒以 Lua 腳本確認鎖仍屬於自己後延長租約。
+leader 中斷或無法續約時租約到期，其他行程會在下一次心跳時取得鎖並接手。
+無法連上 Redis 確認續約時，leader 會在租約到期前主動卸任，避免兩個行程同時執行。
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+
+
+class LeaderElection:
+    """以 Redis 鎖 (租約 + 心跳) 進行 leader 選舉"""
+
+    # 鎖仍屬於自己時才延長租約
+    RENEW_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+
+    # 鎖仍屬於自己時才釋放
+    RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, redis_client, name, logger, lease_seconds=15.0, heartbeat_interval=5.0,
+                 on_elected=None, on_demoted=None):
+        """
+        Args:
+            name: 鎖的名稱，Redis 鍵為 leader:{name}
+            lease_seconds: 租約長度，leader 中斷後最晚在此時間內由其他行程接手
+            heartbeat_interval: 續約 / 嘗試取得鎖的間隔秒數，需小於 lease_seconds
+            on_elected: 成為 leader 時呼叫的回呼
+            on_demoted: 卸任 leader 時呼叫的回呼
+        """
+        self.redis = redis_client
+        self.key = f'leader:{name}'
+        self.logger = logger
+        self.lease_ms = int(lease_seconds * 1000)
+        self.heartbeat_interval = heartbeat_interval
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.token = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._renew_script = self.redis.register_script(self.RENEW_SCRIPT)
+        self._release_script = self.redis.register_script(self.RELEASE_SCRIPT)
+        self._is_leader = False
+        # 租約在本行程的到期時間 (monotonic)，無法續約時據此決定何時卸任
+        self._lease_expires_at = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats = {'elections': 0, 'demotions': 0, 'errors': 0}
+
+    @property
+    def is_leader(self):
+        return self._is_leader
+
+    def start(self):
+        """啟動選舉執行緒 (重複呼叫不會重複啟動)"""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name=f'leader-election-{self.key}', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止選舉並釋放鎖，讓其他行程立即接手"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.heartbeat_interval)
+        if self._is_leader:
+            try:
+                self._release_script(keys=[self.key], args=[self.token])
+            except Exception as e:
+                self.logger.error(f"釋放 leader 鎖時發生錯誤: {e}")
+            self._demote()
+
+    def get_metrics(self):
+        """回傳本行程是否為 leader、目前的 leader 與選舉統計"""
+        metrics = dict(self._stats)
+        metrics['is_leader'] = self._is_leader
+        metrics['token'] = self.token
+        try:
+            metrics['current_leader'] = self.redis.get(self.key)
+        except Exception:
+            metrics['current_leader'] = None
+        return metrics
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._is_leader:
+                    self._renew()
+                else:
+                    self._try_acquire()
+            except Exception as e:
+                self._stats['errors'] += 1
+                self.logger.error(f"leader 選舉時發生錯誤: {e}")
+                # 下一次心跳前租約就會到期，無法確認仍持有鎖，先行卸任
+                if self._is_leader and time.monotonic() + self.heartbeat_interval >= self._lease_expires_at:
+                    self._demote()
+            self._stop.wait(self.heartbeat_interval)
+
+    def _try_acquire(self):
+        started_at = time.monotonic()
+        if self.redis.set(self.key, self.token, nx=True, px=self.lease_ms):
+            self._lease_expires_at = started_at + self.lease_ms / 1000
+            self._is_leader = True
+            self._stats['elections'] += 1
+            self.logger.info(f"已成為 {self.key} 的 leader ({self.token})")
+            self._callback(self.on_elected)
+
+    def _renew(self):
+        started_at = time.monotonic()
+        if self._renew_script(keys=[self.key], args=[self.token, self.lease_ms]):
+            self._lease_expires_at = started_at + self.lease_ms / 1000
+        else:
+            # 租約已到期且被其他行程取得
+            self._demote()
+
+    def _demote(self):
+        if not self._is_leader:
+            return
+        self._is_leader = False
+        self._stats['demotions'] += 1
+        self.logger.warning(f"已卸任 {self.key} 的 leader ({self.token})")
+        self._callback(self.on_demoted)
+
+    def _callback(self, callback):
+        if callback is None:
+            return
+        try:
+            callback()
+        except Exception as e:
+            self.logger.error(f"執行 leader 回呼時發生錯誤: {e}")
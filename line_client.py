@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+共用的 LINE Messaging API 客戶端
+
+每個行程只建立一個 ApiClient，所有事件處理共用同一組 urllib3 連線池，
+避免每次回覆都重新建立 TCP 與 TLS 連線。urllib3 的 PoolManager 可安全地跨執行緒使用。
+"""
+import socket
+
+import urllib3
+from urllib3.connection import HTTPConnection
+from linebot.v3.messaging import ApiClient, MessagingApi, MessagingApiBlob
+
+
+class PooledMessagingClient:
+    """行程內共用、具連線池的 LINE Messaging API 客戶端"""
+
+    def __init__(self, configuration, pool_size=10, timeout=10, keep_alive=True):
+        configuration.connection_pool_maxsize = pool_size
+        if keep_alive:
+            # 啟用 TCP keep-alive，避免閒置連線被中間設備靜默切斷
+            configuration.socket_options = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+        self.timeout = timeout
+        self.api_client = ApiClient(configuration)
+        self._apply_default_timeout()
+        self.api = MessagingApi(self.api_client)
+        self.blob_api = MessagingApiBlob(self.api_client)
+
+    def _apply_default_timeout(self):
+        """SDK 預設不設逾時，為未指定 _request_timeout 的請求套用預設值"""
+        rest_client = self.api_client.rest_client
+        request = rest_client.request
+
+        def request_with_timeout(*args, **kwargs):
+            if not kwargs.get('_request_timeout'):
+                kwargs['_request_timeout'] = self.timeout
+            return request(*args, **kwargs)
+
+        rest_client.request = request_with_timeout
+
+    def get_connection_stats(self):
+        """回傳連線建立與重複使用的次數"""
+        created = 0
+        requests = 0
+        pool_manager = self.api_client.rest_client.pool_manager
+        for key in list(pool_manager.pools.keys()):
+            pool = pool_manager.pools.get(key)
+            if isinstance(pool, urllib3.HTTPConnectionPool):
+                created += pool.num_connections
+                requests += pool.num_requests
+        return {
+            'connections_created': created,
+            'connections_reused': max(requests - created, 0),
+            'requests': requests
+        }
+
+    def close(self):
+        self.api_client.close()
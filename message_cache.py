@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+靜態回覆訊息快取
+
+餐廳選單、菜單圖片等回覆內容只會隨設定或圖片改變，
+因此以「名稱 + 網址根路徑 + 內容版本」為鍵快取建構完成的 LINE 訊息物件。
+內容版本 (餐廳設定與資產清單版本) 改變時，整個快取自動失效。
+"""
+import threading
+from collections import OrderedDict
+
+
+class RenderedMessageCache:
+    """已建構完成的 LINE 訊息物件快取"""
+
+    def __init__(self, version_func, max_entries=256):
+        self.version_func = version_func  # 回傳目前內容版本的函式
+        self.max_entries = max_entries  # 網址根路徑來自請求標頭，需限制快取大小
+        self._lock = threading.Lock()
+        self._messages = OrderedDict()
+        self._version = None
+
+    def get_or_render(self, name, url_root, render):
+        """取得快取的訊息，未命中時呼叫 render() 建構並存入快取"""
+        version = self.version_func()
+        key = (name, url_root)
+        with self._lock:
+            if version != self._version:
+                self._messages.clear()
+                self._version = version
+            if key in self._messages:
+                self._messages.move_to_end(key)
+                return self._messages[key]
+
+        message = render()
+        with self._lock:
+            if version == self._version:
+                self._messages[key] = message
+                while len(self._messages) > self.max_entries:
+                    self._messages.popitem(last=False)
+        return message
+
+    def invalidate(self):
+        """清除所有快取的訊息"""
+        with self._lock:
+            self._messages.clear()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+PostgreSQL 結構遷移
+
+db.create_all() 只會建立不存在的資料表，既有資料表新增的索引與欄位由這裡的遷移依序套用。
+已套用的版本記錄在 schema_migrations 資料表；多個行程同時啟動時以 advisory lock 確保只有一個行程執行。
+
+索引一律以 CREATE INDEX CONCURRENTLY 建立，不會在建立期間鎖住寫入；
+CONCURRENTLY 無法在 transaction 中執行，因此遷移使用 autocommit 連線，每個步驟都是單一且可重複執行的語句。
+
+直接執行 app 時由 initialize_redis_and_db() 套用；以 WSGI 伺服器 (含 Vercel) 啟動時由 start_background_services()
+在背景執行緒套用 (config.AUTO_MIGRATE)，請求不會等待遷移完成；完成前 /callback 回覆 503，由 LINE Platform 稍後重送。關閉 AUTO_MIGRATE 時需在部署步驟執行 upgrade，且須在新版程式接收請求之前完成。
+
+    python migrations.py status                          # 列出各遷移是否已套用
+    python migrations.py upgrade                         # 套用尚未套用的遷移
+    python migrations.py backfill-timestamps [--dry-run] # 修正舊版本寫入的建立時間
+"""
+import argparse
+
+from database import app, db
+
+# 同一時間只允許一個行程執行遷移 (pg_advisory_lock 的鍵值)
+MIGRATION_LOCK_ID = 7301001
+
+# 各索引的定義，benchmarks/bench_query_indexes.py 也使用相同的定義
+INDEXES = {
+    'uq_user_orders_group_user':
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_user_orders_group_user "
+        "ON user_orders (group_order_id, user_id)",
+    'ix_group_orders_open_close_time':
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_group_orders_open_close_time "
+        "ON group_orders (close_time) WHERE status = 'open'",
+    'ix_group_orders_leader_status':
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_group_orders_leader_status "
+        "ON group_orders (leader_id, status)",
+}
+
+
+def create_index_concurrently(conn, name):
+    """
+    建立 INDEXES 中的索引。
+    先前中斷的 CONCURRENTLY 建立會留下無效 (indisvalid = false) 的索引，IF NOT EXISTS 會直接略過，因此先將其移除。
+    """
+    invalid = conn.execute(db.text("""
+        SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+        WHERE pg_class.relname = :name AND NOT pg_index.indisvalid
+    """), {'name': name}).first()
+    if invalid:
+        conn.execute(db.text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    conn.execute(db.text(INDEXES[name]))
+
+
+def _0001_user_orders_unique(conn):
+    """合併舊版本累積的重複訂單 (每位用戶保留最新一筆)，並建立 (group_order_id, user_id) 唯一索引"""
+    conn.execute(db.text("""
+        DELETE FROM user_orders AS older
+        USING user_orders AS newer
+        WHERE older.group_order_id = newer.group_order_id
+          AND older.user_id = newer.user_id
+          AND older.id < newer.id
+    """))
+    create_index_concurrently(conn, 'uq_user_orders_group_user')
+
+
+def _0002_group_orders_indexes(conn):
+    """活躍團購 / 到期檢查的部分索引，以及開團者 + 狀態的複合索引"""
+    create_index_concurrently(conn, 'ix_group_orders_open_close_time')
+    create_index_concurrently(conn, 'ix_group_orders_leader_status')
+
+
+def _0003_timestamp_defaults(conn):
+    """
+    建立時間改由資料庫填入，並新增 user_orders.updated_at。
+    新增欄位時不設定預設值以避免重寫整張表，之後再設定只影響新資料的預設值；既有資料由 backfill_timestamps() 補上。
+    """
+    conn.execute(db.text("ALTER TABLE group_orders ALTER COLUMN created_at SET DEFAULT timezone('utc', now())"))
+    conn.execute(db.text("ALTER TABLE user_orders ALTER COLUMN created_at SET DEFAULT timezone('utc', now())"))
+    conn.execute(db.text("ALTER TABLE user_orders ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITHOUT TIME ZONE"))
+    conn.execute(db.text("ALTER TABLE user_orders ALTER COLUMN updated_at SET DEFAULT timezone('utc', now())"))
+
+
+def _0004_user_orders_group_created_at(conn):
+    """新增 user_orders.group_created_at (所屬團購的建立時間，分區表的分區鍵) 並補上既有資料"""
+    conn.execute(db.text("ALTER TABLE user_orders ADD COLUMN IF NOT EXISTS group_created_at TIMESTAMP WITHOUT TIME ZONE"))
+    conn.execute(db.text("""
+        UPDATE user_orders AS u
+        SET group_created_at = g.created_at
+        FROM group_orders AS g
+        WHERE u.group_order_id = g.id AND u.group_created_at IS NULL
+    """))
+
+
+# 依版本順序排列，已發布的遷移不可修改，只能新增
+MIGRATIONS = [
+    ('0001_user_orders_unique', _0001_user_orders_unique),
+    ('0002_group_orders_indexes', _0002_group_orders_indexes),
+    ('0003_timestamp_defaults', _0003_timestamp_defaults),
+    ('0004_user_orders_group_created_at', _0004_user_orders_group_created_at),
+]
+
+
+def _ensure_migrations_table(conn):
+    conn.execute(db.text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR(100) PRIMARY KEY,
+            applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+    """))
+
+
+def _applied_versions(conn):
+    return {row[0] for row in conn.execute(db.text("SELECT version FROM schema_migrations"))}
+
+
+def get_status():
+    """回傳 [(版本, 是否已套用), ...]"""
+    with app.app_context():
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            _ensure_migrations_table(conn)
+            applied = _applied_versions(conn)
+    return [(version, version in applied) for version, _ in MIGRATIONS]
+
+
+def run_migrations():
+    """
+    依序套用尚未套用的遷移
+
+    Returns:
+        list: 本次套用的版本
+    """
+    applied_now = []
+    with app.app_context():
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            _ensure_migrations_table(conn)
+            conn.execute(db.text("SELECT pg_advisory_lock(:id)"), {'id': MIGRATION_LOCK_ID})
+            try:
+                # 取得鎖之後再讀取，其他行程可能已經套用
+                applied = _applied_versions(conn)
+                for version, migrate in MIGRATIONS:
+                    if version in applied:
+                        continue
+                    migrate(conn)
+                    conn.execute(
+                        db.text("INSERT INTO schema_migrations (version) VALUES (:version)"),
+                        {'version': version}
+                    )
+                    applied_now.append(version)
+            finally:
+                conn.execute(db.text("SELECT pg_advisory_unlock(:id)"), {'id': MIGRATION_LOCK_ID})
+    return applied_now
+
+
+def backfill_timestamps(dry_run=False):
+    """
+    修正舊版本寫入的建立時間
+
+    舊版本的 default=datetime.now(UTC) 在模組載入時只計算一次，同一個行程寫入的資料都有相同的 created_at
+    (等於該行程的啟動時間，是真正建立時間的下限)。依以下規則推估：
+      - group_orders：create_group_order 以「建立時間 + 24 小時」作為預設閉團時間，因此以 close_time - 24 小時作為推估值。
+        開團者自訂的閉團時間 (日期時間選擇器或輸入的時間) 一律是整分鐘，預設閉團時間則帶有秒數與微秒，
+        因此只在 close_time 不是整分鐘 (確定是預設值) 且推估值介於原本的下限與關閉時間 (或現在) 之間時採用；
+        自訂過閉團時間而無法確定建立時間的資料維持原值 (真正建立時間的下限)。
+      - user_orders：建立時間不早於所屬團購的建立時間；尚無 updated_at 的資料以 created_at 補上；
+        group_created_at 同步為所屬團購修正後的建立時間。
+    應在 partitioning.py convert 之前執行。
+
+    Args:
+        dry_run: 只計算會更新的筆數，不寫入
+
+    Returns:
+        dict: 各項更新的筆數
+    """
+    counts = {}
+    with app.app_context():
+        with db.engine.connect() as conn:
+            counts['group_orders.created_at'] = conn.execute(db.text("""
+                UPDATE group_orders AS g
+                SET created_at = estimated.created_at
+                FROM (
+                    SELECT id, closed_at, created_at AS lower_bound,
+                           timezone('utc', close_time) - interval '24 hours' AS created_at
+                    FROM (
+                        SELECT id, created_at, closed_at, close_time,
+                               COUNT(*) OVER (PARTITION BY created_at) AS same_timestamp
+                        FROM group_orders
+                    ) AS grouped
+                    WHERE same_timestamp > 1 AND close_time IS NOT NULL
+                      AND close_time <> date_trunc('minute', close_time)
+                ) AS estimated
+                WHERE g.id = estimated.id
+                  AND estimated.created_at > estimated.lower_bound
+                  AND estimated.created_at <= COALESCE(estimated.closed_at, timezone('utc', now()))
+            """)).rowcount
+            counts['user_orders.created_at'] = conn.execute(db.text("""
+                UPDATE user_orders AS u
+                SET created_at = g.created_at
+                FROM group_orders AS g
+                WHERE u.group_order_id = g.id AND u.created_at < g.created_at
+            """)).rowcount
+            counts['user_orders.updated_at'] = conn.execute(db.text(
+                "UPDATE user_orders SET updated_at = created_at WHERE updated_at IS NULL"
+            )).rowcount
+            counts['user_orders.group_created_at'] = conn.execute(db.text("""
+                UPDATE user_orders AS u
+                SET group_created_at = g.created_at
+                FROM group_orders AS g
+                WHERE u.group_order_id = g.id AND u.group_created_at IS DISTINCT FROM g.created_at
+            """)).rowcount
+            if dry_run:
+                conn.rollback()
+            else:
+                conn.commit()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PostgreSQL 結構遷移")
+    parser.add_argument('command', choices=['status', 'upgrade', 'backfill-timestamps'])
+    parser.add_argument('--dry-run', action='store_true', help="backfill-timestamps 只計算筆數，不寫入")
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        for version, applied in get_status():
+            print(f"{'[x]' if applied else '[ ]'} {version}")
+    elif args.command == 'backfill-timestamps':
+        counts = backfill_timestamps(dry_run=args.dry_run)
+        for column, count in counts.items():
+            print(f"{column}: {count} 筆{' (dry run)' if args.dry_run else ''}")
+    else:
+        applied_now = run_migrations()
+        print(f"已套用 {len(applied_now)} 個遷移: {', '.join(applied_now)}" if applied_now else "沒有需要套用的遷移")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+閉團通知的 multicast 發送
+
+收件者去除重複後每 batch_size 人 (LINE multicast 上限 500 人) 合併為一次 multicast，
+交由 worker 執行緒池發送，呼叫端不需等待 LINE API。
+每次請求先向 token bucket 取得額度，避免超過設定的每秒請求數；
+遇到 429、5xx 或連線錯誤時以指數退避重試，重試沿用同一個 X-Line-Retry-Key，LINE 不會重複發送。
+"""
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# LINE multicast 的限制：每次最多 500 位收件者、5 則訊息，每則文字訊息最多 5000 字
+MULTICAST_MAX_RECIPIENTS = 500
+MULTICAST_MAX_MESSAGES = 5
+TEXT_MESSAGE_MAX_LENGTH = 5000
+
+
+def split_text(text, limit=TEXT_MESSAGE_MAX_LENGTH, max_parts=MULTICAST_MAX_MESSAGES):
+    """
+    將過長的文字依行切成多段，每段不超過 limit 字，最多 max_parts 段 (超過的部分截斷)
+
+    Returns:
+        list: 文字片段
+    """
+    parts = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            # 單行超過上限時直接切斷
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            parts.append(current)
+            current = ""
+        current += line
+    if current:
+        parts.append(current)
+    if len(parts) > max_parts:
+        parts = parts[:max_parts]
+        parts[-1] = parts[-1][:limit - 1] + "…"
+    return parts
+
+
+class TokenBucket:
+    """每秒補充 rate 個額度、最多累積 capacity 個額度的 token bucket"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取得一個額度，額度不足時等待，回傳等待的秒數"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class MulticastNotifier:
+    """以 worker 執行緒池、速率限制與重試發送 multicast"""
+
+    def __init__(self, send_multicast, logger, max_workers=2, batch_size=MULTICAST_MAX_RECIPIENTS,
+                 rate_per_second=50.0, max_retries=3, backoff_seconds=1.0):
+        """
+        Args:
+            send_multicast: 實際發送的函式 send_multicast(to, messages, retry_key)，
+                            失敗時拋出例外 (具 status 屬性者視為 HTTP 錯誤)
+            batch_size: 每次 multicast 的收件者數量上限
+            rate_per_second: 每秒最多發出的 multicast 請求數
+            max_retries: 可重試的錯誤最多重試次數
+            backoff_seconds: 第一次重試前的等待秒數，之後每次加倍
+        """
+        self.send_multicast = send_multicast
+        self.logger = logger
+        self.batch_size = min(batch_size, MULTICAST_MAX_RECIPIENTS)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._bucket = TokenBucket(rate_per_second)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='multicast-notifier')
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'requests': 0, 'recipients': 0, 'retries': 0, 'failed_requests': 0,
+            'failed_recipients': 0, 'throttled_seconds': 0.0
+        }
+
+    def notify(self, recipient_ids, messages):
+        """
+        將訊息發送給所有收件者 (去除重複，每 batch_size 人一次 multicast)，不等待發送完成
+
+        Returns:
+            list: 各批次的 Future，結果為該批次是否發送成功
+        """
+        recipients = list(dict.fromkeys(user_id for user_id in recipient_ids if user_id))
+        messages = list(messages)[:MULTICAST_MAX_MESSAGES]
+        if not recipients or not messages:
+            return []
+        return [
+            self._executor.submit(self._send_batch, recipients[start:start + self.batch_size], messages)
+            for start in range(0, len(recipients), self.batch_size)
+        ]
+
+    def get_metrics(self):
+        """回傳請求數、收件者數、重試與失敗次數，以及因速率限制等待的秒數"""
+        with self._stats_lock:
+            metrics = dict(self._stats)
+        metrics['throttled_seconds'] = round(metrics['throttled_seconds'], 3)
+        return metrics
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def _send_batch(self, recipients, messages):
+        # 同一批次的重試使用相同的 retry key，LINE 已受理的請求不會重複發送
+        retry_key = str(uuid.uuid4())
+        for attempt in range(self.max_retries + 1):
+            self._count('throttled_seconds', self._bucket.acquire())
+            try:
+                self._count('requests')
+                self.send_multicast(recipients, messages, retry_key)
+                self._count('recipients', len(recipients))
+                return True
+            except Exception as e:
+                status = getattr(e, 'status', None)
+                if status == 409:
+                    # 相同 retry key 的請求已被受理 (先前的請求逾時但實際已送出)
+                    self._count('recipients', len(recipients))
+                    return True
+                retryable = status is None or status == 429 or status >= 500
+                if not retryable or attempt == self.max_retries:
+                    self._count('failed_requests')
+                    self._count('failed_recipients', len(recipients))
+                    self.logger.error(f"發送 multicast 給 {len(recipients)} 位使用者失敗: {e}")
+                    return False
+                self._count('retries')
+                time.sleep(self._retry_delay(e, attempt))
+        return False
+
+    def _retry_delay(self, error, attempt):
+        """優先使用 Retry-After，否則為指數退避加上隨機抖動"""
+        headers = getattr(error, 'headers', None) or {}
+        retry_after = headers.get('Retry-After') if hasattr(headers, 'get') else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        delay = self.backoff_seconds * (2 ** attempt)
+        return delay + random.uniform(0, delay / 2)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+使用者訂單的品項格式
+
+每位使用者的訂單以「品項鍵 → 品項」的 dict 儲存 (PostgreSQL 的 items 欄位與 Redis 皆同)：
+    {"珍奶(半糖)": {"item": "珍奶", "note": "半糖", "qty": 2, "seq": 1}}
+品項鍵為「商品(備註)」，與畫面顯示及 postback 傳遞的文字相同；增減數量只需更新對應的 qty。
+seq 為品項加入的順序：Redis 端的 Lua 腳本以 cjson 重新編碼時不保留鍵的順序，讀取時依 seq 排序。
+
+舊資料為重複字串的清單 (["珍奶(半糖)", "珍奶(半糖)"])，讀取時以 normalize() 轉成新格式。
+"""
+from collections import Counter
+
+
+def make_key(item, note=""):
+    """由商品名稱與備註產生品項鍵"""
+    item = item.strip()
+    note = note.strip()
+    return f"{item}({note})" if note else item
+
+
+def split_key(key):
+    """將品項鍵 (或舊格式的字串) 拆回商品名稱與備註"""
+    open_index = key.find("(")
+    if open_index > 0 and key.endswith(")"):
+        return key[:open_index], key[open_index + 1:-1]
+    return key, ""
+
+
+def normalize(items):
+    """
+    將儲存的訂單轉成新格式
+
+    Args:
+        items: 新格式的 dict、舊格式的字串清單或 None
+
+    Returns:
+        dict: {品項鍵: {"item": 商品, "note": 備註, "qty": 數量, "seq": 順序}}，依品項加入的順序排列
+    """
+    if not items:
+        return {}
+    if isinstance(items, dict):
+        return dict(sorted(items.items(), key=lambda entry: entry[1].get("seq", 0)))
+
+    lines = {}
+    for seq, (key, qty) in enumerate(Counter(items).items(), start=1):
+        item, note = split_key(key)
+        lines[key] = {"item": item, "note": note, "qty": qty, "seq": seq}
+    return lines
+
+
+def next_seq(lines):
+    """下一個新品項的順序編號"""
+    return max((line.get("seq", 0) for line in lines.values()), default=0) + 1
+
+
+def add_item(lines, item, note="", qty=1):
+    """加入商品，已有相同品項時累加數量，回傳品項鍵"""
+    key = make_key(item, note)
+    line = lines.get(key)
+    if line:
+        line["qty"] += qty
+    else:
+        lines[key] = {"item": item.strip(), "note": note.strip(), "qty": qty, "seq": next_seq(lines)}
+    return key
+
+
+def decrement(lines, key, qty=1):
+    """減少品項數量，數量歸零時移除品項；品項不存在時回傳 False"""
+    line = lines.get(key)
+    if not line:
+        return False
+    line["qty"] -= qty
+    if line["qty"] <= 0:
+        del lines[key]
+    return True
+
+
+def update_note(lines, key, new_note, qty=1):
+    """
+    將品項中的 qty 份改為新的備註 (與原本只替換其中一份的行為相同)
+
+    Returns:
+        str: 新的品項鍵；原品項不存在時回傳 None
+    """
+    line = lines.get(key)
+    if not line:
+        return None
+    qty = min(qty, line["qty"])
+    decrement(lines, key, qty)
+    return add_item(lines, line["item"], new_note, qty)
+
+
+def quantities(lines):
+    """回傳 {品項鍵: 數量}，可直接用於 Counter.update 統計多位使用者的訂單"""
+    return {key: line["qty"] for key, line in lines.items()}
+
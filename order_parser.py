@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+點餐訊息解析
+
+常見的「我要點 珍奶(半糖)」、「我要點 珍奶 半糖」格式以字串操作直接解析，不經過正規表達式；
+其他格式才使用預先編譯的合併樣式，解析結果與原本依序嘗試兩個樣式相同。
+另外支援數量標記 (珍奶*2、Latte x2、珍奶 2杯)，並將備註拆成個別的調整項目。
+數量超過 MAX_QUANTITY 時拋出 ValueError，避免過大的數量寫入訂單與品項總數。
+"""
+import re
+
+ORDER_PREFIXES = ('我要點', '點')
+CLOSE_PARENS = ')）'
+# 數量標記：*2、×2、 x2、2杯、2份、2個
+MULTIPLY_SIGNS = '*＊×'
+QUANTITY_UNITS = '杯份個'
+# 單一品項一次可點的最大數量
+MAX_QUANTITY = 99
+
+# 格式1：我要點 珍奶（少冰半糖加波霸）
+# 格式2：我要點 珍奶 半糖去冰
+# 兩種格式合併為單一樣式，依序嘗試的行為與分別比對相同，但只需掃描一次
+_ORDER_PATTERN = re.compile(
+    r'^(?:'
+    r'(?:我要點|點)?\s*([^\s（(]+)(?:[（(]([^）)]+)[）)])?'
+    r'|'
+    r'(?:我要點|點)?\s*([^\s]+)(?:\s+(.+))?'
+    r')$'
+)
+# 備註中分隔調整項目的符號
+_MODIFIER_SEPARATOR = re.compile(r'[\s、，,/／]+')
+
+# 只有結尾是數字或數量單位時才需要嘗試比對數量標記
+_QUANTITY_TAIL = set('0123456789' + QUANTITY_UNITS)
+
+
+def parse_order_message(msg: str) -> dict:
+    """
+    解析點餐訊息，支援多種輸入格式
+
+    支援的格式：
+    - 我要點 珍奶（少冰半糖加波霸）
+    - 我要點珍奶（半糖去冰）
+    - 我要點 珍奶 半糖去冰
+    - 我要點 珍奶(半糖)*2、我要點 Latte x2、我要點 珍奶 2杯
+    - 點 珍奶
+    - 珍奶
+
+    Args:
+        msg: 點餐訊息字串
+
+    Raises:
+        ValueError: 數量標記超過 MAX_QUANTITY
+
+    Returns:
+        dict: 包含商品名稱、備註、數量與調整項目的字典
+        {
+            "item": "商品名稱",
+            "note": "備註內容",  # 若無備註則為空字串
+            "quantity": 1,
+            "modifiers": ["少冰", "半糖"]  # 備註依分隔符號拆開的項目
+        }
+    """
+    # 移除所有多餘的空格
+    msg = msg.strip()
+    quantity = 1
+    if msg and msg[-1] in _QUANTITY_TAIL:
+        msg, quantity = _split_quantity(msg)
+
+    item, note = _parse_fast(msg) or _parse_with_patterns(msg)
+    # 中英文字與數字皆屬 isalnum，沒有任何分隔符號時不需要經過正規表達式
+    if not note:
+        modifiers = []
+    elif note.isalnum():
+        modifiers = [note]
+    else:
+        modifiers = _split_modifiers(note)
+    return {
+        "item": item,
+        "note": note,
+        "quantity": quantity,
+        "modifiers": modifiers
+    }
+
+
+def _split_quantity(msg):
+    """
+    從訊息結尾取出數量標記，沒有標記時數量為 1。
+    標記只會出現在結尾，因此由後往前檢查字元，不需要從頭掃描整段訊息。
+    """
+    has_unit = msg[-1] in QUANTITY_UNITS
+    head = msg[:-1].rstrip() if has_unit else msg
+    start = len(head)
+    while start and head[start - 1].isdecimal():
+        start -= 1
+    if start == len(head):
+        return msg, 1
+
+    rest = head[:start].rstrip()
+    if not has_unit:
+        # 數字前必須是 *、＊、×，或是「空白 + x」
+        if rest[-1:] in MULTIPLY_SIGNS:
+            rest = rest[:-1].rstrip()
+        elif rest[-1:] in ('x', 'X') and rest[-2:-1].isspace():
+            rest = rest[:-1].rstrip()
+        else:
+            return msg, 1
+
+    # 只剩前綴或數量為 0 時，視為商品名稱的一部分
+    digits = head[start:].lstrip('0')
+    if not digits or rest in ('',) + ORDER_PREFIXES:
+        return msg, 1
+    # 先比較位數再轉換，極長的數字不需轉成整數
+    if len(digits) > len(str(MAX_QUANTITY)) or int(digits) > MAX_QUANTITY:
+        raise ValueError(f"數量不可超過 {MAX_QUANTITY}")
+    return rest, int(digits)
+
+
+def _split_modifiers(note):
+    """將備註依分隔符號拆成調整項目"""
+    modifiers = _MODIFIER_SEPARATOR.split(note)
+    if '' in modifiers:
+        modifiers = [modifier for modifier in modifiers if modifier]
+    return modifiers
+
+
+def _parse_fast(msg):
+    """
+    以字串操作解析常見的「前綴 + 商品(備註)」、「前綴 + 商品 備註」與「前綴 + 商品」格式。
+    結果與正規表達式相同；無法確定時回傳 None，交由正規表達式處理。
+    """
+    if msg.startswith('我要點'):
+        body = msg[3:].lstrip()
+    elif msg.startswith('點'):
+        body = msg[1:].lstrip()
+    else:
+        body = msg
+    if not body:
+        return None
+    # 中英文字與數字皆屬 isalnum，整段都是文字時就是商品名稱
+    if body.isalnum():
+        return body, ""
+
+    if body[-1] in CLOSE_PARENS:
+        open_index = body.find('(')
+        if open_index < 0:
+            open_index = body.find('（')
+        item = body[:open_index]
+        note = body[open_index + 1:-1]
+        if open_index > 0 and item.isalnum() and note and ')' not in note and '）' not in note:
+            return item, note.strip()
+        return None
+
+    # 沒有括號時，商品為第一段非空白文字，其餘為備註 (備註不可跨行)
+    if '(' in body or '（' in body or '\n' in body:
+        return None
+    parts = body.split(None, 1)
+    if len(parts) == 1:
+        return body, ""
+    return parts[0], parts[1]
+
+
+def _parse_with_patterns(msg):
+    """以預先編譯的合併樣式比對"""
+    match = _ORDER_PATTERN.match(msg)
+    if match:
+        paren_item, paren_note, item, note = match.groups()
+        if paren_item is not None:
+            return paren_item, (paren_note or "").strip()
+        return item, (note or "").strip()
+
+    # 如果都沒有匹配到，假設整個訊息就是商品名稱
+    return msg, ""
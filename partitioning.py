@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+group_orders / user_orders 的月份分區與保留政策
+
+group_orders 依 created_at、user_orders 依 group_created_at (所屬團購的建立時間) 以月份做 RANGE 分區：
+同一團購的訂單與團購本身位於同一個月份的分區，(group_order_id, user_id, group_created_at) 的唯一索引
+即等同原本的 (group_order_id, user_id)，upsert 仍可使用。
+PostgreSQL 分區表的主鍵必須包含分區鍵，且無法被外鍵參照，因此轉換後 user_orders 不再有指向 group_orders 的外鍵。
+
+分區命名為 {資料表}_pYYYYMM。每日的維護工作會：
+  - 預先建立未來 PARTITION_MONTHS_AHEAD 個月的分區，寫入不會因為缺少分區而失敗
+  - 將早於 PARTITION_RETENTION_MONTHS 個月、且沒有進行中團購的分區自主表分離 (CONCURRENTLY，不會鎖住主表的讀寫)，
+    並移至封存 schema；需要 PostgreSQL 14 以上
+
+    python partitioning.py convert    # 一次性將既有資料表轉為分區表 (需先停止服務)
+    python partitioning.py maintain   # 立即執行一次維護工作
+    python partitioning.py list       # 列出目前的分區
+"""
+import argparse
+from datetime import date, datetime, UTC
+
+from database import app, db, env_config
+
+# 分區表與其分區鍵
+PARTITIONED_TABLES = {
+    'group_orders': 'created_at',
+    'user_orders': 'group_created_at',
+}
+
+
+def _add_months(month_start, months):
+    """回傳 month_start 之後 months 個月的月初日期"""
+    month_index = month_start.year * 12 + month_start.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _current_month():
+    today = datetime.now(UTC).date()
+    return date(today.year, today.month, 1)
+
+
+def _partition_name(table, month_start):
+    return f"{table}_p{month_start:%Y%m}"
+
+
+def _create_month_partition(conn, table, month_start):
+    """建立 month_start 當月的分區 (已存在時略過)"""
+    conn.execute(db.text(
+        f"CREATE TABLE IF NOT EXISTS {_partition_name(table, month_start)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month_start.isoformat()}') TO ('{_add_months(month_start, 1).isoformat()}')"
+    ))
+
+
+def list_partitions(conn, table):
+    """回傳 [(分區名稱, 月初日期), ...]，依月份排序"""
+    rows = conn.execute(db.text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class AS parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+        JOIN pg_namespace ON pg_namespace.oid = child.relnamespace
+        WHERE parent.relname = :table AND pg_namespace.nspname = current_schema()
+    """), {'table': table})
+    partitions = []
+    prefix = f"{table}_p"
+    for (name,) in rows:
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+            partitions.append((name, date(int(suffix[:4]), int(suffix[4:]), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def ensure_future_partitions(conn, months_ahead=None):
+    """建立本月到未來 months_ahead 個月的分區，回傳新建立的分區數量"""
+    months_ahead = env_config.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    current_month = _current_month()
+    created = 0
+    for table in PARTITIONED_TABLES:
+        existing = {month_start for _, month_start in list_partitions(conn, table)}
+        for offset in range(months_ahead + 1):
+            month_start = _add_months(current_month, offset)
+            if month_start not in existing:
+                _create_month_partition(conn, table, month_start)
+                created += 1
+    return created
+
+
+def apply_retention(conn, retention_months=None, archive_schema=None):
+    """
+    將早於保留期限的分區自主表分離，並移至封存 schema (未設定時留在原 schema)
+
+    仍有進行中團購的月份會保留，該月份的 group_orders 與 user_orders 分區一起分離。
+    以 DETACH PARTITION ... CONCURRENTLY 分離 (PostgreSQL 14 以上)，主表只需 SHARE UPDATE EXCLUSIVE 鎖，
+    分離期間讀寫不會被阻塞；CONCURRENTLY 無法在 transaction 中執行，conn 必須是 autocommit 連線。
+    先前中斷而停在 detach pending 狀態的分區以 FINALIZE 完成分離。
+
+    Returns:
+        list: 已分離的分區名稱
+    """
+    retention_months = env_config.PARTITION_RETENTION_MONTHS if retention_months is None else retention_months
+    archive_schema = env_config.PARTITION_ARCHIVE_SCHEMA if archive_schema is None else archive_schema
+    cutoff = _add_months(_current_month(), -retention_months)
+
+    expired_months = [
+        month_start for _, month_start in list_partitions(conn, 'group_orders')
+        if _add_months(month_start, 1) <= cutoff
+    ]
+    if archive_schema and expired_months:
+        conn.execute(db.text(f"CREATE SCHEMA IF NOT EXISTS {archive_schema}"))
+
+    detached = []
+    for month_start in expired_months:
+        group_partition = _partition_name('group_orders', month_start)
+        has_open_groups = conn.execute(db.text(
+            f"SELECT EXISTS (SELECT 1 FROM {group_partition} WHERE status = 'open')"
+        )).scalar()
+        if has_open_groups:
+            continue
+        for table in PARTITIONED_TABLES:
+            partition = _partition_name(table, month_start)
+            detach_pending = conn.execute(db.text("""
+                SELECT pg_inherits.inhdetachpending
+                FROM pg_inherits
+                JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+                JOIN pg_namespace ON pg_namespace.oid = child.relnamespace
+                WHERE child.relname = :name AND pg_namespace.nspname = current_schema()
+            """), {'name': partition}).scalar()
+            if detach_pending is None:
+                # 分區不存在或已分離
+                continue
+            if detach_pending:
+                conn.execute(db.text(f"ALTER TABLE {table} DETACH PARTITION {partition} FINALIZE"))
+            else:
+                conn.execute(db.text(f"ALTER TABLE {table} DETACH PARTITION {partition} CONCURRENTLY"))
+            if archive_schema:
+                conn.execute(db.text(f"ALTER TABLE {partition} SET SCHEMA {archive_schema}"))
+            detached.append(partition)
+    return detached
+
+
+def run_partition_maintenance():
+    """每日維護：預先建立分區並套用保留政策"""
+    try:
+        with app.app_context():
+            with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                created = ensure_future_partitions(conn)
+                detached = apply_retention(conn)
+        if created or detached:
+            print(f"分區維護完成：新建 {created} 個分區，分離 {len(detached)} 個分區 {detached}")
+    except Exception as e:
+        print(f"分區維護時發生錯誤: {e}")
+
+
+def convert_to_partitioned(months_ahead=None):
+    """
+    一次性將既有的 group_orders / user_orders 轉為分區表 (於單一 transaction 中完成)
+
+    原資料表更名為 {資料表}_unpartitioned 保留，確認無誤後可自行刪除。
+    轉換期間會鎖住兩張資料表，需先停止服務；之後設定 PARTITIONING_ENABLED=true。
+    沒有所屬團購的訂單無法決定分區，不會複製到新的資料表。
+    """
+    months_ahead = env_config.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    with app.app_context():
+        with db.engine.connect() as conn:
+            conn.execute(db.text("LOCK TABLE group_orders, user_orders IN ACCESS EXCLUSIVE MODE"))
+            conn.execute(db.text("""
+                UPDATE user_orders AS u
+                SET group_created_at = g.created_at
+                FROM group_orders AS g
+                WHERE u.group_order_id = g.id AND u.group_created_at IS DISTINCT FROM g.created_at
+            """))
+
+            # 原資料表與其索引改名保留，讓出名稱給新的分區表
+            for table in PARTITIONED_TABLES:
+                indexes = conn.execute(db.text(
+                    "SELECT indexname FROM pg_indexes WHERE tablename = :table AND schemaname = current_schema()"
+                ), {'table': table}).scalars().all()
+                for index in indexes:
+                    conn.execute(db.text(f"ALTER INDEX {index} RENAME TO {index}_unpartitioned"))
+                conn.execute(db.text(f"ALTER TABLE {table} RENAME TO {table}_unpartitioned"))
+
+            for table, partition_key in PARTITIONED_TABLES.items():
+                legacy = f"{table}_unpartitioned"
+                conn.execute(db.text(
+                    f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE ({partition_key})"
+                ))
+                conn.execute(db.text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, {partition_key})"))
+                # id 的序列改由新資料表擁有，刪除原資料表時才不會一併刪除
+                conn.execute(db.text(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id"))
+
+                first_month = conn.execute(db.text(
+                    f"SELECT date_trunc('month', MIN({partition_key}))::date FROM {legacy}"
+                )).scalar() or _current_month()
+                month_start = first_month
+                last_month = _add_months(_current_month(), months_ahead)
+                while month_start <= last_month:
+                    _create_month_partition(conn, table, month_start)
+                    month_start = _add_months(month_start, 1)
+
+                conn.execute(db.text(
+                    f"INSERT INTO {table} SELECT * FROM {legacy} WHERE {partition_key} IS NOT NULL"
+                ))
+
+            # 在分區表上建立索引 (會自動建立於每個分區)
+            conn.execute(db.text(
+                "CREATE UNIQUE INDEX uq_user_orders_group_user "
+                "ON user_orders (group_order_id, user_id, group_created_at)"
+            ))
+            conn.execute(db.text(
+                "CREATE INDEX ix_group_orders_open_close_time ON group_orders (close_time) WHERE status = 'open'"
+            ))
+            conn.execute(db.text("CREATE INDEX ix_group_orders_leader_status ON group_orders (leader_id, status)"))
+            conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="group_orders / user_orders 月份分區")
+    parser.add_argument('command', choices=['convert', 'maintain', 'list'])
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        convert_to_partitioned()
+        print("已轉換為分區表，請設定 PARTITIONING_ENABLED=true 後重新啟動服務")
+    elif args.command == 'maintain':
+        run_partition_maintenance()
+    else:
+        with app.app_context():
+            with db.engine.connect() as conn:
+                for table in PARTITIONED_TABLES:
+                    print(f"{table}: {', '.join(name for name, _ in list_partitions(conn, table)) or '(未分區)'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+使用者顯示名稱快取
+
+第一層為行程內的 LRU 快取 (含 TTL)，第二層為所有 worker 共用的 Redis hash。
+Redis 中的資料超過新鮮期限後，在 stale 期間內仍可先回傳舊值，並於背景重新抓取。
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class ProfileCache:
+    """兩層的使用者顯示名稱快取，並提供批次查詢 API"""
+
+    REDIS_KEY = 'user_profile:{}'
+
+    def __init__(self, redis_client, fetch_name, logger, max_entries=1024, local_ttl=600,
+                 redis_ttl=86400, stale_ttl=604800, stale_while_revalidate=True, max_workers=8):
+        self.redis = redis_client
+        self.fetch_name = fetch_name  # 實際向 LINE API 取得顯示名稱的函式
+        self.logger = logger
+        self.max_entries = max_entries
+        self.local_ttl = local_ttl
+        self.redis_ttl = redis_ttl
+        self.stale_ttl = stale_ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self._local = OrderedDict()  # user_id -> (name, fetched_at)
+        self._lock = threading.Lock()
+        self._refreshing = set()  # 正在背景重新抓取的 user_id，避免重複送出請求
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='profile-fetch')
+        self._stats = {'local_hits': 0, 'redis_hits': 0, 'stale_hits': 0, 'misses': 0, 'fetches': 0, 'fetch_errors': 0}
+
+    def get(self, user_id):
+        """取得單一使用者的顯示名稱，無法取得時回傳 None"""
+        return self.get_many([user_id]).get(user_id)
+
+    def get_many(self, user_ids, timeout=None):
+        """
+        批次取得多位使用者的顯示名稱。
+        本地快取未命中者以單一 pipeline 查詢 Redis，仍未命中者同時向 LINE API 抓取。
+
+        Args:
+            user_ids: 使用者 ID 列表
+            timeout: 等待 LINE API 的總秒數上限；逾時者回傳 None，抓取仍會在背景完成並寫入快取
+
+        Returns:
+            dict: {user_id: 顯示名稱或 None}
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        names = {}
+        pending = []
+        now = time.time()
+
+        with self._lock:
+            for user_id in user_ids:
+                cached = self._local.get(user_id)
+                if cached and now - cached[1] < self.local_ttl:
+                    self._local.move_to_end(user_id)
+                    names[user_id] = cached[0]
+                    self._stats['local_hits'] += 1
+                else:
+                    pending.append(user_id)
+
+        if pending:
+            pending = self._read_from_redis(pending, names, now)
+
+        if pending:
+            with self._lock:
+                self._stats['misses'] += len(pending)
+            futures = {user_id: self._executor.submit(self._fetch_and_store, user_id) for user_id in pending}
+            wait(futures.values(), timeout=timeout)
+            for user_id, future in futures.items():
+                names[user_id] = future.result() if future.done() else None
+
+        return names
+
+    def get_stats(self):
+        """回傳快取命中與抓取次數統計"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['local_entries'] = len(self._local)
+        return stats
+
+    def _read_from_redis(self, user_ids, names, now):
+        """從 Redis 讀取名稱並回填本地快取，回傳仍需抓取的 user_id"""
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for user_id in user_ids:
+                pipe.hgetall(self.REDIS_KEY.format(user_id))
+            results = pipe.execute()
+        except Exception as e:
+            self.logger.error(f"讀取 Redis 使用者名稱快取時發生錯誤: {e}")
+            return user_ids
+
+        missing = []
+        for user_id, profile in zip(user_ids, results):
+            if not profile or 'name' not in profile:
+                missing.append(user_id)
+                continue
+            fetched_at = float(profile.get('fetched_at', 0))
+            names[user_id] = profile['name']
+            if now - fetched_at < self.redis_ttl:
+                self._store_local(user_id, profile['name'], fetched_at)
+                with self._lock:
+                    self._stats['redis_hits'] += 1
+            elif self.stale_while_revalidate:
+                with self._lock:
+                    self._stats['stale_hits'] += 1
+                self._refresh_in_background(user_id)
+            else:
+                missing.append(user_id)
+                del names[user_id]
+        return missing
+
+    def _refresh_in_background(self, user_id):
+        with self._lock:
+            if user_id in self._refreshing:
+                return
+            self._refreshing.add(user_id)
+        self._executor.submit(self._fetch_and_store, user_id)
+
+    def _fetch_and_store(self, user_id):
+        """向 LINE API 抓取名稱並寫入兩層快取，失敗時回傳 None"""
+        try:
+            with self._lock:
+                self._stats['fetches'] += 1
+            name = self.fetch_name(user_id)
+        except Exception as e:
+            with self._lock:
+                self._stats['fetch_errors'] += 1
+            self.logger.error(f"無法獲取用戶 {user_id} 的資料: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._refreshing.discard(user_id)
+
+        fetched_at = time.time()
+        self._store_local(user_id, name, fetched_at)
+        try:
+            redis_key = self.REDIS_KEY.format(user_id)
+            pipe = self.redis.pipeline()
+            pipe.hset(redis_key, mapping={'name': name, 'fetched_at': fetched_at})
+            pipe.expire(redis_key, self.redis_ttl + self.stale_ttl)
+            pipe.execute()
+        except Exception as e:
+            self.logger.error(f"寫入 Redis 使用者名稱快取時發生錯誤: {e}")
+        return name
+
+    def _store_local(self, user_id, name, fetched_at):
+        with self._lock:
+            self._local[user_id] = (name, fetched_at)
+            self._local.move_to_end(user_id)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+測試共用設定：以 sqlite 取代 PostgreSQL、fakeredis 取代 Redis
+
+必須在匯入 database 之前替換連線字串，因此在模組載入時設定。
+sqlite 沒有 timezone()，以不轉換的同名函式代替資料庫端的預設時間；
+也沒有陣列型別，id = ANY(:ids) 改以 IN 比對。
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, UTC
+
+import fakeredis
+import pytest
+from sqlalchemy import event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+
+_DB_PATH = os.path.join(tempfile.mkdtemp(prefix='line_bot_tests_'), 'test.db')
+config.Config.SQLALCHEMY_DATABASE_URI = f'sqlite:///{_DB_PATH}'
+
+import database as database_module  # noqa: E402
+from database import app, db, DatabaseManager  # noqa: E402
+
+database_module._match_ids = lambda column, ids: column.in_([int(i) for i in ids])
+
+with app.app_context():
+    @event.listens_for(db.engine, 'connect')
+    def _register_sqlite_functions(dbapi_connection, connection_record):
+        dbapi_connection.create_function('timezone', 2, lambda zone, value: value)
+        dbapi_connection.create_function('now', 0, lambda: datetime.now(UTC).replace(tzinfo=None).isoformat(sep=' '))
+
+
+@pytest.fixture
+def database():
+    """每個測試使用全新的資料表"""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+@pytest.fixture
+def db_manager(database, redis_client):
+    return DatabaseManager(redis_client)
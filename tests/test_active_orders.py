@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from database import app
+
+
+def test_snapshot_reads_cache_and_rebuilds_once_on_miss(db_manager, redis_client):
+    with app.app_context():
+        first = db_manager.create_group_order('R1', 'U1').id
+        second = db_manager.create_group_order('R2', 'U2').id
+
+        # 模擬重新啟動：索引尚未同步時由 PostgreSQL 重建
+        redis_client.flushall()
+        snapshot = db_manager.get_active_orders_snapshot()
+        assert snapshot['source'] == 'database'
+        assert [order['id'] for order in snapshot['orders']] == [str(first), str(second)]
+
+        snapshot = db_manager.get_active_orders_snapshot()
+    assert snapshot['source'] == 'cache'
+    assert [(order['restaurant'], order['leader_id'], order['status']) for order in snapshot['orders']] == [
+        ('R1', 'U1', 'open'), ('R2', 'U2', 'open')
+    ]
+    assert db_manager.get_snapshot_stats() == {'cache': 1, 'database': 1}
+
+
+def test_snapshot_excludes_closed_groups(db_manager):
+    with app.app_context():
+        kept = db_manager.create_group_order('R1', 'U1').id
+        closed = db_manager.create_group_order('R2', 'U2').id
+        db_manager.close_group_orders([closed])
+
+        assert [order['id'] for order in db_manager.get_active_orders()] == [str(kept)]
+
+
+def test_dangling_index_entry_falls_back_to_database(db_manager, redis_client):
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U1').id
+        # 索引指向的團購 hash 被逐出
+        redis_client.delete(f'group_order:{group}')
+
+        snapshot = db_manager.get_active_orders_snapshot()
+    assert snapshot['source'] == 'database'
+    assert [order['id'] for order in snapshot['orders']] == [str(group)]
+    assert redis_client.hget(f'group_order:{group}', 'status') == 'open'
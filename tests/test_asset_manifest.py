@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import os
+
+from asset_manifest import AssetManifest
+
+
+def write_image(static_folder, name, content):
+    image_dir = static_folder / 'store_images'
+    image_dir.mkdir(exist_ok=True)
+    path = image_dir / name
+    path.write_bytes(content)
+    return path
+
+
+def test_manifest_maps_restaurants_to_content_hash(tmp_path):
+    write_image(tmp_path, 'tea.png', b'png')
+    write_image(tmp_path, 'tea.jpg', b'jpg')
+    manifest = AssetManifest(str(tmp_path), {'R1': 'tea', 'R2': 'missing'})
+
+    path, digest = manifest.get('R1')
+    assert path == f'{tmp_path}/store_images/tea.jpg'  # jpg 優先
+    assert len(digest) == 12
+    assert manifest.get('R2') is None
+
+
+def test_reload_if_changed_picks_up_updated_images(tmp_path):
+    image = write_image(tmp_path, 'tea.png', b'old')
+    manifest = AssetManifest(str(tmp_path), {'R1': 'tea'})
+    old_digest, old_version = manifest.get('R1')[1], manifest.version
+
+    assert manifest.reload_if_changed() is False
+
+    image.write_bytes(b'new image')
+    stat = image.stat()
+    os.utime(image, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert manifest.reload_if_changed() is True
+    assert manifest.get('R1')[1] != old_digest
+    assert manifest.version != old_version
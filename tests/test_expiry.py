@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta, UTC
+
+import pytest
+
+from database import app, db, GroupOrder
+
+
+def test_sweep_closes_due_group_missing_from_expiry_queue(db_manager, redis_client):
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U_leader')
+        db_manager.set_group_order_close_time(group.id, datetime.now(UTC) - timedelta(minutes=1))
+        # 模擬到期佇列寫入失敗或遺失
+        redis_client.zrem(db_manager.CLOSE_TIMES_KEY, str(group.id))
+        assert db_manager.get_due_group_ids() == []
+
+        closed = db_manager.check_and_close_expired_orders()
+
+        assert [order['id'] for order in closed] == [group.id]
+        assert db.session.query(GroupOrder.status).filter_by(id=group.id).scalar() == 'closed'
+    assert db_manager.get_open_group(group.id) is None
+
+
+def test_close_due_group_orders_requeues_postponed_deadline(db_manager, redis_client):
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U_leader')
+        redis_client.zadd(db_manager.CLOSE_TIMES_KEY, {str(group.id): 0})
+
+        assert db_manager.close_due_group_orders([str(group.id)]) == []
+    score = redis_client.zscore(db_manager.CLOSE_TIMES_KEY, str(group.id))
+    assert score > datetime.now(UTC).timestamp()
+
+
+def test_close_survives_redis_failure_and_sweep_syncs_status(db_manager, redis_client, monkeypatch):
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U_leader')
+
+        def broken_pipeline(*args, **kwargs):
+            raise ConnectionError('redis down')
+
+        with monkeypatch.context() as patch:
+            patch.setattr(redis_client, 'pipeline', broken_pipeline)
+            closed = db_manager.close_group_orders([group.id])
+
+        # PostgreSQL 已提交，Redis 仍為開啟
+        assert [order['id'] for order in closed] == [group.id]
+        assert db.session.query(GroupOrder.status).filter_by(id=group.id).scalar() == 'closed'
+        assert redis_client.hget(f'group_order:{group.id}', 'status') == 'open'
+        # 重試關閉不會再關閉一次，改由同步補上 Redis 的狀態
+        assert db_manager.close_group_orders([group.id]) == []
+
+        synced = db_manager.sync_closed_groups()
+
+    assert [order['id'] for order in synced] == [group.id]
+    assert redis_client.hget(f'group_order:{group.id}', 'status') == 'closed'
+    assert not redis_client.sismember(db_manager.OPEN_GROUPS_KEY, str(group.id))
+    assert redis_client.sismember(db_manager.CLOSED_GROUPS_KEY, str(group.id))
+    assert db_manager.get_open_group_by_restaurant('R1') is None
+    assert db_manager.sync_closed_groups() == []
+
+
+def test_close_group_orders_requires_a_filter(db_manager):
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U_leader')
+        with pytest.raises(ValueError):
+            db_manager.close_group_orders()
+    assert db_manager.get_open_group(group.id) is not None
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from linebot.v3.messaging import FlexBubble, FlexCarousel, FlexContainer, FlexMessage
+
+import flex_messages
+
+
+def test_order_summary_bubble_is_sdk_model():
+    bubble = flex_messages.build_order_summary_bubble('Cafe', 'https://x/cafe.jpg', '雞排 x 2', 7)
+
+    assert isinstance(bubble, FlexBubble)
+    data = bubble.to_dict()
+    assert data['hero']['url'] == 'https://x/cafe.jpg'
+    assert data['body']['contents'][0]['text'] == '【Cafe】'
+    assert data['body']['contents'][3]['text'] == '雞排 x 2'
+    actions = [button['action'] for button in data['footer']['contents']]
+    assert actions[0]['data'] == 'action=edit_order&group_order_id=7'
+    assert actions[1]['displayText'] == '確定要清空 Cafe 的訂單嗎？'
+
+
+def test_models_match_json_round_trip():
+    bubble = flex_messages.build_order_summary_bubble('Cafe', 'https://x/cafe.jpg', '雞排 x 2', 7)
+    carousel = flex_messages.build_carousel([bubble])
+
+    assert isinstance(carousel, FlexCarousel)
+    assert FlexContainer.from_json(carousel.to_json()).to_dict() == carousel.to_dict()
+    message = FlexMessage(alt_text='我的訂單', contents=carousel)
+    assert message.to_dict()['contents']['contents'][0]['type'] == 'bubble'
+
+
+def test_edit_order_bubble_contains_item_boxes():
+    box = flex_messages.build_edit_item_box('雞排__辣', '雞排 (辣)', '', 2, 7)
+    bubble = flex_messages.build_edit_order_bubble([box], 7)
+
+    data = bubble.to_dict()
+    title, _, items = data['body']['contents']
+    assert title['text'] == '修改訂單'
+    item_box = items['contents'][0]
+    assert item_box['contents'][0]['text'] == '雞排 (辣)'
+    assert item_box['contents'][1]['contents'][1]['text'] == '2'
+    assert item_box['contents'][2]['text'] == '備註：無'
+    assert data['footer']['contents'][0]['action']['data'] == 'action=save_edit&group_order_id=7'
+
+
+def test_shared_components_are_not_mutated():
+    first = flex_messages.build_edit_order_bubble([], 1)
+    second = flex_messages.build_edit_order_bubble([], 2)
+
+    assert first.body.contents[0] == second.body.contents[0]
+    assert flex_messages._EDIT_TITLE.text == '修改訂單'
+    assert flex_messages._EDIT_SEPARATOR.margin == 'xxl'
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import pytest
+from linebot.v3.messaging import FlexBox, FlexButton, FlexText, PostbackAction
+
+from flex_template import FlexTemplate
+
+
+def make_template():
+    return FlexTemplate(FlexBox(
+        layout="vertical",
+        contents=[
+            FlexText(text="{name}", weight="bold"),
+            FlexText(text="固定文字"),
+            FlexButton(action=PostbackAction(label="+", data="action=add&item={item}"))
+        ]
+    ))
+
+
+def test_render_fills_slots():
+    box = make_template().render(name='雞排', item='chicken')
+
+    assert box.contents[0].text == '雞排'
+    assert box.contents[0].weight == 'bold'
+    assert box.contents[2].action.data == 'action=add&item=chicken'
+
+
+def test_render_does_not_modify_skeleton():
+    template = make_template()
+    template.render(name='雞排', item='chicken')
+
+    assert template.skeleton.contents[0].text == '{name}'
+    assert template.skeleton.contents[2].action.data == 'action=add&item={item}'
+
+
+def test_subtrees_without_slots_are_shared():
+    template = make_template()
+    first = template.render(name='a', item='1')
+    second = template.render(name='b', item='2')
+
+    assert first.contents[1] is template.skeleton.contents[1]
+    assert second.contents[1] is template.skeleton.contents[1]
+    assert first.contents[0] is not second.contents[0]
+
+
+def test_template_matches_direct_construction():
+    direct = FlexBox(
+        layout="vertical",
+        contents=[
+            FlexText(text="雞排", weight="bold"),
+            FlexText(text="固定文字"),
+            FlexButton(action=PostbackAction(label="+", data="action=add&item=chicken"))
+        ]
+    )
+
+    assert make_template().render(name='雞排', item='chicken').to_dict() == direct.to_dict()
+
+
+def test_template_without_slots_is_rejected():
+    with pytest.raises(ValueError):
+        FlexTemplate(FlexText(text="沒有佔位符"))
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from database import app
+
+
+def test_closed_orders_survive_redis_flush(db_manager, redis_client):
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U_leader')
+        assert db_manager.close_group_order('R1', 'U_leader')
+
+        # 模擬重新啟動時清空 Redis；活躍團購的重建不載入已關閉團購
+        redis_client.flushall()
+        db_manager.rebuild_active_orders_cache()
+        assert not redis_client.exists(db_manager.CLOSED_GROUPS_KEY, db_manager.CLOSED_GROUPS_SYNCED_KEY)
+
+        closed = db_manager.get_closed_orders()
+
+    assert [order['id'] for order in closed] == [str(group.id)]
+    assert closed[0]['restaurant'] == 'R1'
+    assert closed[0]['status'] == 'closed'
+
+
+def test_closed_index_is_rebuilt_in_chunks(db_manager, redis_client):
+    with app.app_context():
+        group_ids = [db_manager.create_group_order(f'R{i}', 'U_leader').id for i in range(5)]
+        db_manager.close_group_orders(group_ids)
+        redis_client.flushall()
+
+        assert db_manager.rebuild_closed_groups_index(chunk_size=2) == 5
+        assert redis_client.exists(db_manager.CLOSED_GROUPS_SYNCED_KEY)
+        assert [order['id'] for order in db_manager.get_closed_orders()] == [str(i) for i in group_ids]
+
+
+def test_close_group_order_matches_leader_when_restaurant_is_shared(db_manager):
+    with app.app_context():
+        first = db_manager.create_group_order('R1', 'U_first').id
+        second = db_manager.create_group_order('R1', 'U_second').id
+
+        assert db_manager.close_group_order('R1', 'U_second')
+        assert not db_manager.close_group_order('R1', 'U_other')
+
+    assert db_manager.get_open_group(first) is not None
+    assert db_manager.get_open_group(second) is None
+
+
+def test_open_group_lookups_use_indexes(db_manager, redis_client):
+    with app.app_context():
+        first = db_manager.create_group_order('R1', 'U_leader').id
+        second = db_manager.create_group_order('R2', 'U_leader').id
+        other = db_manager.create_group_order('R3', 'U_other').id
+
+    assert db_manager.get_open_group(first)['restaurant'] == 'R1'
+    assert db_manager.get_open_group_by_restaurant('R2')['id'] == str(second)
+    assert db_manager.get_open_group_by_restaurant('R4') is None
+    assert [order['id'] for order in db_manager.get_open_groups_by_leader('U_leader')] == [str(first), str(second)]
+    assert redis_client.smembers(db_manager.LEADER_OPEN_KEY.format('U_other')) == {str(other)}
+
+    with app.app_context():
+        db_manager.close_group_orders([first])
+    assert db_manager.get_open_group(first) is None
+    assert [order['id'] for order in db_manager.get_open_groups_by_leader('U_leader')] == [str(second)]
+    assert not redis_client.sismember(db_manager.RESTAURANT_OPEN_KEY.format('R1'), str(first))
+
+
+def test_open_group_indexes_are_rebuilt_after_flush(db_manager, redis_client):
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U_leader').id
+        redis_client.flushall()
+
+        assert db_manager.get_open_group_by_restaurant('R1')['id'] == str(group)
+    assert redis_client.exists(db_manager.OPEN_GROUPS_SYNCED_KEY)
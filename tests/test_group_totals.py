@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import order_lines
+from database import app
+
+
+def create_group(manager, restaurant='R1'):
+    with app.app_context():
+        return manager.create_group_order(restaurant, 'U_leader').id
+
+
+def test_totals_and_participants_follow_each_change(db_manager):
+    group_id = create_group(db_manager)
+
+    db_manager.add_user_order(group_id, 'U1', order_lines.normalize(['紅茶', '紅茶', '綠茶']))
+    db_manager.adjust_user_order_item(group_id, 'U2', '紅茶', 1)
+    assert db_manager.get_group_totals(group_id) == {'紅茶': 3, '綠茶': 1}
+    assert db_manager.get_participant_counts([group_id]) == {group_id: 2}
+
+    db_manager.add_user_order(group_id, 'U1', order_lines.normalize(['綠茶']))
+    db_manager.adjust_user_order_item(group_id, 'U2', '紅茶', -1)
+    assert db_manager.get_group_totals(group_id) == {'綠茶': 1}
+    assert db_manager.get_participant_counts([group_id]) == {group_id: 1}
+
+    db_manager.delete_user_order(group_id, 'U1')
+    assert db_manager.get_group_totals(group_id) == {}
+    assert db_manager.get_participant_counts([group_id]) == {group_id: 0}
+
+
+def test_totals_for_many_groups(db_manager):
+    first, second = create_group(db_manager, 'R1'), create_group(db_manager, 'R2')
+    db_manager.adjust_user_order_item(first, 'U1', '紅茶', 2)
+    db_manager.adjust_user_order_item(second, 'U1', '雞排', 1)
+    db_manager.adjust_user_order_item(second, 'U2', '雞排', 1)
+
+    assert db_manager.get_group_totals_many([first, second]) == {first: {'紅茶': 2}, second: {'雞排': 2}}
+    assert db_manager.get_participant_counts([first, second]) == {first: 1, second: 2}
+    assert db_manager.get_participant_counts([]) == {}
+
+
+def test_check_group_totals_repairs_drift(db_manager, redis_client):
+    group_id = create_group(db_manager)
+    db_manager.adjust_user_order_item(group_id, 'U1', '紅茶', 2)
+    totals_key = db_manager.TOTALS_KEY.format(group_id)
+    participants_key = db_manager.PARTICIPANTS_KEY.format(group_id)
+    redis_client.hset(totals_key, '紅茶', 5)
+    redis_client.set(participants_key, 3)
+
+    assert db_manager.check_group_totals([group_id], repair=False) == [group_id]
+    assert db_manager.get_group_totals(group_id) == {'紅茶': 5}
+
+    assert db_manager.check_group_totals() == [group_id]
+    assert db_manager.get_group_totals(group_id) == {'紅茶': 2}
+    assert db_manager.get_participant_counts([group_id]) == {group_id: 1}
+    assert db_manager.check_group_totals([group_id]) == []
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from redis.exceptions import ConnectionError
+
+from leader_election import LeaderElection
+
+logger = logging.getLogger('test_leader_election')
+
+
+def make_election(redis_client, events=None, **kwargs):
+    events = events if events is not None else []
+    return LeaderElection(
+        redis_client, 'scheduler', logger,
+        on_elected=lambda: events.append('elected'),
+        on_demoted=lambda: events.append('demoted'),
+        **kwargs
+    )
+
+
+def run_once(election):
+    """執行一次心跳後結束選舉迴圈"""
+    election._stop.wait = lambda timeout: election._stop.set()
+    election._run()
+    election._stop.clear()
+
+
+def test_only_one_process_is_elected(redis_client):
+    events = []
+    first, second = make_election(redis_client, events), make_election(redis_client)
+
+    first._try_acquire()
+    second._try_acquire()
+
+    assert first.is_leader and not second.is_leader
+    assert redis_client.get('leader:scheduler') == first.token
+    assert 0 < redis_client.pttl('leader:scheduler') <= 15000
+    assert events == ['elected']
+
+
+def test_renew_extends_own_lease(redis_client):
+    election = make_election(redis_client, lease_seconds=30)
+    election._try_acquire()
+    redis_client.pexpire('leader:scheduler', 1000)
+
+    election._renew()
+
+    assert election.is_leader
+    assert redis_client.pttl('leader:scheduler') > 1000
+
+
+def test_leader_is_demoted_when_lock_is_taken_over(redis_client):
+    events = []
+    election = make_election(redis_client, events)
+    election._try_acquire()
+    redis_client.set('leader:scheduler', 'other-process')
+
+    election._renew()
+
+    assert not election.is_leader
+    assert events == ['elected', 'demoted']
+    assert redis_client.get('leader:scheduler') == 'other-process'
+
+
+def test_stop_releases_lock_for_next_leader(redis_client):
+    first, second = make_election(redis_client), make_election(redis_client)
+    first._try_acquire()
+
+    first.stop()
+    second._try_acquire()
+
+    assert not first.is_leader
+    assert second.is_leader
+
+
+def test_leader_steps_down_before_lease_expires_when_redis_is_unreachable(redis_client):
+    events = []
+    election = make_election(redis_client, events, lease_seconds=15, heartbeat_interval=5)
+    election._try_acquire()
+
+    def unreachable(*args, **kwargs):
+        raise ConnectionError('redis is down')
+    election._renew_script = unreachable
+
+    run_once(election)  # 租約尚有 15 秒，仍維持 leader
+    assert election.is_leader
+
+    election._lease_expires_at -= 12  # 下一次心跳前租約就會到期
+    run_once(election)
+    assert not election.is_leader
+    assert events == ['elected', 'demoted']
+    assert election.get_metrics()['errors'] == 2
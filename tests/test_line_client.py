@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""以本機的 HTTP server 驗證共用的 LINE API 客戶端會重複使用連線並套用預設逾時"""
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from linebot.v3.messaging import Configuration, ReplyMessageRequest, TextMessage
+
+from line_client import PooledMessagingClient
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests += 1
+        payload = b'{"sentMessages": [{"id": "1", "quoteToken": "q"}]}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def client():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    client = PooledMessagingClient(
+        Configuration(host=f'http://127.0.0.1:{server.server_port}', access_token='test-token'), timeout=3
+    )
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def reply(client):
+    client.api.reply_message(ReplyMessageRequest(reply_token='token', messages=[TextMessage(text='hi')]))
+
+
+def test_requests_reuse_pooled_connection(client):
+    for _ in range(3):
+        reply(client)
+
+    assert client.get_connection_stats() == {'connections_created': 1, 'connections_reused': 2, 'requests': 3}
+
+
+def test_default_timeout_and_keep_alive_are_applied(client, monkeypatch):
+    seen = {}
+    pool_request = client.api_client.rest_client.pool_manager.request
+
+    def record(*args, **kwargs):
+        seen['timeout'] = kwargs.get('timeout')
+        return pool_request(*args, **kwargs)
+
+    monkeypatch.setattr(client.api_client.rest_client.pool_manager, 'request', record)
+    reply(client)
+
+    assert seen['timeout'].total == 3
+    assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in client.api_client.configuration.socket_options
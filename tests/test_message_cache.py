@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from message_cache import RenderedMessageCache
+
+
+class Renderer:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return object()
+
+
+def test_cached_message_is_reused_until_version_changes():
+    version = {'value': 1}
+    cache = RenderedMessageCache(lambda: version['value'])
+    render = Renderer()
+
+    first = cache.get_or_render('menu', 'https://a/', render)
+    assert cache.get_or_render('menu', 'https://a/', render) is first
+    assert render.calls == 1
+
+    version['value'] = 2
+    assert cache.get_or_render('menu', 'https://a/', render) is not first
+    assert render.calls == 2
+
+
+def test_url_root_is_part_of_the_key():
+    cache = RenderedMessageCache(lambda: 1)
+    render = Renderer()
+
+    assert cache.get_or_render('menu', 'https://a/', render) is not cache.get_or_render('menu', 'https://b/', render)
+    assert render.calls == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = RenderedMessageCache(lambda: 1, max_entries=2)
+    render = Renderer()
+
+    cache.get_or_render('a', 'root', render)
+    cache.get_or_render('b', 'root', render)
+    cache.get_or_render('a', 'root', render)  # a 變成最近使用
+    cache.get_or_render('c', 'root', render)  # 淘汰 b
+    assert render.calls == 3
+
+    cache.get_or_render('a', 'root', render)
+    assert render.calls == 3
+    cache.get_or_render('b', 'root', render)
+    assert render.calls == 4
+
+
+def test_invalidate_clears_cache():
+    cache = RenderedMessageCache(lambda: 1)
+    render = Renderer()
+
+    cache.get_or_render('menu', 'root', render)
+    cache.invalidate()
+    cache.get_or_render('menu', 'root', render)
+    assert render.calls == 2
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""以記錄 SQL 的假連線驗證遷移流程 (CONCURRENTLY 與 advisory lock 需要 PostgreSQL，sqlite 無法執行)"""
+from types import SimpleNamespace
+
+import migrations
+from database import db, GroupOrder, UserOrder
+
+
+class FakeResult:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def first(self):
+        return self.rows[0] if self.rows else None
+
+
+class FakeConnection:
+    """模擬 schema_migrations 中已套用的版本與無效 (indisvalid = false) 的索引"""
+
+    def __init__(self, applied=(), invalid_indexes=()):
+        self.applied = set(applied)
+        self.invalid_indexes = set(invalid_indexes)
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        sql = ' '.join(str(statement).split())
+        params = params or {}
+        if sql.startswith('SELECT version FROM schema_migrations'):
+            return FakeResult([(version,) for version in self.applied])
+        if 'NOT pg_index.indisvalid' in sql:
+            return FakeResult([(1,)] if params['name'] in self.invalid_indexes else [])
+        self.statements.append(sql)
+        if sql.startswith('INSERT INTO schema_migrations'):
+            self.applied.add(params['version'])
+        return FakeResult()
+
+    # engine.connect().execution_options(...) 的介面
+    def execution_options(self, **options):
+        self.options = options
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def use_connection(monkeypatch, conn):
+    monkeypatch.setattr(migrations, 'db', SimpleNamespace(text=db.text, engine=SimpleNamespace(connect=lambda: conn)))
+
+
+def test_pending_migrations_are_applied_in_order_under_lock(monkeypatch):
+    conn = FakeConnection()
+    use_connection(monkeypatch, conn)
+
+    assert migrations.run_migrations() == [version for version, _ in migrations.MIGRATIONS]
+    assert conn.options == {'isolation_level': 'AUTOCOMMIT'}
+    lock = next(i for i, sql in enumerate(conn.statements) if 'pg_advisory_lock' in sql)
+    unlock = next(i for i, sql in enumerate(conn.statements) if 'pg_advisory_unlock' in sql)
+    recorded = [i for i, sql in enumerate(conn.statements) if sql.startswith('INSERT INTO schema_migrations')]
+    assert lock < recorded[0] and recorded[-1] < unlock
+
+
+def test_applied_migrations_are_skipped(monkeypatch):
+    conn = FakeConnection(applied=[version for version, _ in migrations.MIGRATIONS])
+    use_connection(monkeypatch, conn)
+
+    assert migrations.run_migrations() == []
+    assert not any('INDEX' in sql or 'ALTER' in sql or 'INSERT' in sql for sql in conn.statements)
+
+
+def test_duplicates_are_merged_before_unique_index():
+    conn = FakeConnection()
+    migrations._0001_user_orders_unique(conn)
+
+    assert conn.statements[0].startswith('DELETE FROM user_orders AS older')
+    assert conn.statements[-1] == ' '.join(migrations.INDEXES['uq_user_orders_group_user'].split())
+
+
+def test_invalid_index_is_dropped_before_rebuild():
+    conn = FakeConnection(invalid_indexes=['ix_group_orders_leader_status'])
+    migrations.create_index_concurrently(conn, 'ix_group_orders_leader_status')
+
+    assert conn.statements == [
+        'DROP INDEX CONCURRENTLY IF EXISTS ix_group_orders_leader_status',
+        migrations.INDEXES['ix_group_orders_leader_status'],
+    ]
+
+
+def test_models_declare_the_migrated_indexes():
+    declared = {index.name for index in GroupOrder.__table__.indexes}
+    declared |= {index.name for index in UserOrder.__table__.indexes}
+    declared |= {constraint.name for constraint in UserOrder.__table__.constraints}
+
+    assert set(migrations.INDEXES) <= declared
+    assert all('CONCURRENTLY IF NOT EXISTS' in sql for sql in migrations.INDEXES.values())
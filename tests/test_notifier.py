@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""以本機的 LINE API 替身 (HTTP server) 驗證 MulticastNotifier 的分批、重試與錯誤處理"""
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from linebot.v3.messaging import Configuration, MulticastRequest, TextMessage
+
+from line_client import PooledMessagingClient
+from notifier import MulticastNotifier
+
+
+class FakeLineServer(ThreadingHTTPServer):
+    """記錄收到的 multicast，並依序回應預先排定的狀態碼 (未排定時回應 200)"""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeLineHandler)
+        self.requests = []
+        self.responses = []
+        self.lock = threading.Lock()
+
+    def next_response(self, request):
+        with self.lock:
+            self.requests.append(request)
+            return self.responses.pop(0) if self.responses else (200, {})
+
+
+class FakeLineHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        status, headers = self.server.next_response({
+            'path': self.path,
+            'retry_key': self.headers.get('X-Line-Retry-Key'),
+            'to': body['to']
+        })
+        if status is None:
+            # 模擬連線中斷：不回應直接關閉連線
+            self.close_connection = True
+            return
+        payload = b'{}' if status < 400 else json.dumps({'message': f'status {status}'}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def line_server():
+    server = FakeLineServer()
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_notifier(line_server):
+    client = PooledMessagingClient(
+        Configuration(host=f'http://127.0.0.1:{line_server.server_port}', access_token='test-token'), timeout=5
+    )
+
+    def send_multicast(to, messages, retry_key):
+        client.api.multicast(MulticastRequest(to=to, messages=messages), x_line_retry_key=retry_key)
+
+    def factory(**kwargs):
+        notifier = MulticastNotifier(send_multicast, logging.getLogger('test-notifier'), rate_per_second=1000.0,
+                                     backoff_seconds=0.01, **kwargs)
+        # 記錄每次重試的等待秒數，實際不等待
+        notifier.delays = []
+        retry_delay = notifier._retry_delay
+
+        def record_delay(error, attempt):
+            notifier.delays.append(retry_delay(error, attempt))
+            return 0
+
+        notifier._retry_delay = record_delay
+        return notifier
+
+    yield factory
+    client.close()
+
+
+def send(notifier, recipients):
+    return [future.result(timeout=10) for future in notifier.notify(recipients, [TextMessage(text='閉團通知')])]
+
+
+def test_recipients_are_batched_by_500(line_server, make_notifier):
+    notifier = make_notifier(max_workers=1)
+    recipients = [f'U{i:04d}' for i in range(1201)]
+
+    assert send(notifier, recipients + recipients[:10]) == [True, True, True]
+
+    assert [request['path'] for request in line_server.requests] == ['/v2/bot/message/multicast'] * 3
+    assert [len(request['to']) for request in line_server.requests] == [500, 500, 201]
+    assert [user_id for request in line_server.requests for user_id in request['to']] == recipients
+    assert len({request['retry_key'] for request in line_server.requests}) == 3
+    assert notifier.get_metrics()['recipients'] == 1201
+
+
+def test_429_waits_for_retry_after(line_server, make_notifier):
+    line_server.responses = [(429, {'Retry-After': '7'})]
+    notifier = make_notifier()
+
+    assert send(notifier, ['U1']) == [True]
+    assert notifier.delays == [7.0]
+    assert len(line_server.requests) == 2
+
+
+@pytest.mark.parametrize('failure', [503, None], ids=['5xx', 'connection-error'])
+def test_transient_failure_is_retried_with_same_retry_key(line_server, make_notifier, failure):
+    line_server.responses = [(failure, {}), (failure, {})]
+    notifier = make_notifier(max_retries=3)
+
+    assert send(notifier, ['U1', 'U2']) == [True]
+
+    assert len(line_server.requests) == 3
+    retry_keys = {request['retry_key'] for request in line_server.requests}
+    assert len(retry_keys) == 1 and None not in retry_keys
+    assert len(notifier.delays) == 2
+    metrics = notifier.get_metrics()
+    assert metrics['retries'] == 2
+    assert metrics['recipients'] == 2
+    assert metrics['failed_requests'] == 0
+
+
+def test_400_is_not_retried(line_server, make_notifier):
+    line_server.responses = [(400, {})]
+    notifier = make_notifier()
+
+    assert send(notifier, ['U1']) == [False]
+
+    assert len(line_server.requests) == 1
+    metrics = notifier.get_metrics()
+    assert metrics['retries'] == 0
+    assert metrics['failed_requests'] == 1
+    assert metrics['failed_recipients'] == 1
+
+
+def test_gives_up_after_max_retries(line_server, make_notifier):
+    line_server.responses = [(500, {})] * 3
+    notifier = make_notifier(max_retries=2)
+
+    assert send(notifier, ['U1']) == [False]
+    assert len(line_server.requests) == 3
+    assert notifier.get_metrics()['failed_requests'] == 1
+
+
+def test_409_counts_as_sent(line_server, make_notifier):
+    # 前一次請求逾時但 LINE 已受理，重試時以相同 retry key 收到 409
+    line_server.responses = [(500, {}), (409, {})]
+    notifier = make_notifier()
+
+    assert send(notifier, ['U1', 'U2', 'U3']) == [True]
+
+    assert len({request['retry_key'] for request in line_server.requests}) == 1
+    metrics = notifier.get_metrics()
+    assert metrics['recipients'] == 3
+    assert metrics['failed_requests'] == 0
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import order_lines
+
+
+def test_normalize_converts_legacy_list():
+    lines = order_lines.normalize(["珍奶(半糖)", "雞排", "珍奶(半糖)"])
+
+    assert lines == {
+        "珍奶(半糖)": {"item": "珍奶", "note": "半糖", "qty": 2, "seq": 1},
+        "雞排": {"item": "雞排", "note": "", "qty": 1, "seq": 2},
+    }
+
+
+def test_normalize_orders_dict_by_seq():
+    lines = order_lines.normalize({
+        "b": {"item": "b", "note": "", "qty": 1, "seq": 2},
+        "a": {"item": "a", "note": "", "qty": 1, "seq": 1},
+    })
+
+    assert list(lines) == ["a", "b"]
+    assert order_lines.normalize(None) == {}
+
+
+def test_add_item_accumulates_quantity():
+    lines = {}
+    key = order_lines.add_item(lines, " 珍奶 ", " 半糖 ")
+    order_lines.add_item(lines, "珍奶", "半糖", qty=2)
+    order_lines.add_item(lines, "雞排")
+
+    assert key == "珍奶(半糖)"
+    assert lines["珍奶(半糖)"]["qty"] == 3
+    assert lines["雞排"]["seq"] == 2
+
+
+def test_decrement_removes_line_at_zero():
+    lines = {}
+    order_lines.add_item(lines, "雞排", qty=2)
+
+    assert order_lines.decrement(lines, "雞排")
+    assert lines["雞排"]["qty"] == 1
+    assert order_lines.decrement(lines, "雞排")
+    assert "雞排" not in lines
+    assert not order_lines.decrement(lines, "雞排")
+
+
+def test_update_note_moves_one_portion():
+    lines = {}
+    order_lines.add_item(lines, "珍奶", "半糖", qty=2)
+
+    new_key = order_lines.update_note(lines, "珍奶(半糖)", "無糖")
+
+    assert new_key == "珍奶(無糖)"
+    assert order_lines.quantities(lines) == {"珍奶(半糖)": 1, "珍奶(無糖)": 1}
+    assert order_lines.update_note(lines, "不存在", "x") is None
+
+
+def test_split_key_round_trips_make_key():
+    assert order_lines.split_key(order_lines.make_key("珍奶", "半糖")) == ("珍奶", "半糖")
+    assert order_lines.split_key("雞排") == ("雞排", "")
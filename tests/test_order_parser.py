@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from order_parser import MAX_QUANTITY, parse_order_message
+
+
+@pytest.mark.parametrize('msg, item, note, quantity', [
+    ('我要點 珍奶(半糖)', '珍奶', '半糖', 1),
+    ('我要點 珍奶 半糖去冰', '珍奶', '半糖去冰', 1),
+    ('我要點 珍奶(半糖)*2', '珍奶', '半糖', 2),
+    ('我要點 Latte x3', 'Latte', '', 3),
+    ('我要點 珍奶 2杯', '珍奶', '', 2),
+    ('我要點 珍奶*099', '珍奶', '', 99),
+    (f'我要點 珍奶*{MAX_QUANTITY}', '珍奶', '', MAX_QUANTITY),
+    # 數量為 0 或只剩前綴時視為商品名稱
+    ('我要點 珍奶*0', '珍奶*0', '', 1),
+    ('我要點 7', '7', '', 1),
+])
+def test_parse_order_message(msg, item, note, quantity):
+    parsed = parse_order_message(msg)
+    assert (parsed['item'], parsed['note'], parsed['quantity']) == (item, note, quantity)
+
+
+@pytest.mark.parametrize('msg', [
+    f'我要點 珍奶*{MAX_QUANTITY + 1}',
+    '我要點 珍奶*99999999999',
+    '我要點 珍奶 100杯',
+    '我要點 Latte x' + '9' * 5000,
+])
+def test_quantity_above_limit_is_rejected(msg):
+    with pytest.raises(ValueError):
+        parse_order_message(msg)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""以記錄 SQL 的假連線驗證分區維護 (分區語法需要 PostgreSQL，sqlite 無法執行)"""
+from datetime import date
+
+from sqlalchemy.dialects import postgresql
+
+import database
+import partitioning
+
+
+class FakeResult:
+    def __init__(self, rows=(), scalar=None):
+        self.rows = list(rows)
+        self._scalar = scalar
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def scalar(self):
+        return self._scalar
+
+
+class FakeConnection:
+    """模擬 pg_inherits 中的分區 {名稱: detach pending} 與各月份是否有進行中團購"""
+
+    def __init__(self, partitions, open_group_partitions=()):
+        self.partitions = dict(partitions)
+        self.open_group_partitions = set(open_group_partitions)
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        sql = ' '.join(str(statement).split())
+        params = params or {}
+        if 'SELECT child.relname' in sql:
+            return FakeResult([(name,) for name in self.partitions if name.startswith(params['table'] + '_p')])
+        if 'inhdetachpending' in sql:
+            return FakeResult(scalar=self.partitions.get(params['name']))
+        if sql.startswith('SELECT EXISTS'):
+            return FakeResult(scalar=any(name in sql for name in self.open_group_partitions))
+        self.statements.append(sql)
+        if 'DETACH PARTITION' in sql:
+            del self.partitions[sql.split()[5]]
+        return FakeResult()
+
+
+def test_add_months_crosses_years():
+    assert partitioning._add_months(date(2025, 11, 1), 3) == date(2026, 2, 1)
+    assert partitioning._add_months(date(2026, 1, 1), -1) == date(2025, 12, 1)
+
+
+def test_ensure_future_partitions_creates_missing_months(monkeypatch):
+    monkeypatch.setattr(partitioning, '_current_month', lambda: date(2026, 10, 1))
+    conn = FakeConnection({'group_orders_p202610': False, 'user_orders_p202610': False})
+
+    assert partitioning.ensure_future_partitions(conn, months_ahead=1) == 2
+    assert conn.statements == [
+        "CREATE TABLE IF NOT EXISTS group_orders_p202611 PARTITION OF group_orders "
+        "FOR VALUES FROM ('2026-11-01') TO ('2026-12-01')",
+        "CREATE TABLE IF NOT EXISTS user_orders_p202611 PARTITION OF user_orders "
+        "FOR VALUES FROM ('2026-11-01') TO ('2026-12-01')",
+    ]
+
+
+def test_retention_detaches_concurrently_and_keeps_months_with_open_groups(monkeypatch):
+    monkeypatch.setattr(partitioning, '_current_month', lambda: date(2026, 10, 1))
+    conn = FakeConnection(
+        {
+            'group_orders_p202601': False, 'user_orders_p202601': True,  # 先前中斷的分離
+            'group_orders_p202602': False, 'user_orders_p202602': False,
+            'group_orders_p202610': False, 'user_orders_p202610': False,
+        },
+        open_group_partitions={'group_orders_p202602'}
+    )
+
+    detached = partitioning.apply_retention(conn, retention_months=6, archive_schema='archive')
+
+    assert detached == ['group_orders_p202601', 'user_orders_p202601']
+    assert conn.statements == [
+        "CREATE SCHEMA IF NOT EXISTS archive",
+        "ALTER TABLE group_orders DETACH PARTITION group_orders_p202601 CONCURRENTLY",
+        "ALTER TABLE group_orders_p202601 SET SCHEMA archive",
+        "ALTER TABLE user_orders DETACH PARTITION user_orders_p202601 FINALIZE",
+        "ALTER TABLE user_orders_p202601 SET SCHEMA archive",
+    ]
+
+
+def test_upsert_conflict_target_includes_partition_key(monkeypatch):
+    """分區表的唯一索引必須包含分區鍵 group_created_at"""
+    monkeypatch.setattr(database.env_config, 'PARTITIONING_ENABLED', True)
+    stmt = database.DatabaseManager.build_user_order_upsert([{'group_order_id': 1, 'user_id': 'U1', 'items': {}}])
+
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert 'ON CONFLICT (group_order_id, user_id, group_created_at)' in sql
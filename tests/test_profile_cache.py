@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+
+from profile_cache import ProfileCache
+
+
+class FakeProfiles:
+    """記錄呼叫次數的 LINE API 替身"""
+
+    def __init__(self, delay=0):
+        self.calls = []
+        self.delay = delay
+
+    def __call__(self, user_id):
+        self.calls.append(user_id)
+        time.sleep(self.delay)
+        return f'name-{user_id}'
+
+
+def make_cache(redis_client, fetch, **kwargs):
+    return ProfileCache(redis_client, fetch, logging.getLogger(__name__), **kwargs)
+
+
+def test_local_cache_is_bounded_lru(redis_client):
+    fetch = FakeProfiles()
+    cache = make_cache(redis_client, fetch, max_entries=2)
+    for user_id in ['U1', 'U2', 'U1', 'U3']:
+        assert cache.get(user_id) == f'name-{user_id}'
+
+    stats = cache.get_stats()
+    assert stats['local_entries'] == 2
+    assert stats['local_hits'] == 1
+    assert fetch.calls == ['U1', 'U2', 'U3']
+
+
+def test_redis_tier_is_shared_between_processes(redis_client):
+    fetch = FakeProfiles()
+    make_cache(redis_client, fetch).get('U1')
+
+    other_process = make_cache(redis_client, fetch)
+    assert other_process.get('U1') == 'name-U1'
+    assert other_process.get_stats()['redis_hits'] == 1
+    assert fetch.calls == ['U1']
+    assert redis_client.ttl(ProfileCache.REDIS_KEY.format('U1')) > 0
+
+
+def test_expired_local_entry_is_read_again_from_redis(redis_client):
+    fetch = FakeProfiles()
+    cache = make_cache(redis_client, fetch, local_ttl=0)
+    cache.get('U1')
+
+    assert cache.get('U1') == 'name-U1'
+    assert cache.get_stats()['redis_hits'] == 1
+    assert fetch.calls == ['U1']
+
+
+def test_stale_name_is_returned_while_refreshing(redis_client):
+    redis_client.hset(ProfileCache.REDIS_KEY.format('U1'), mapping={'name': 'old', 'fetched_at': 0})
+    fetch = FakeProfiles()
+    cache = make_cache(redis_client, fetch, redis_ttl=60)
+
+    assert cache.get('U1') == 'old'
+    cache._executor.shutdown(wait=True)
+    assert fetch.calls == ['U1']
+    assert redis_client.hget(ProfileCache.REDIS_KEY.format('U1'), 'name') == 'name-U1'
+    assert cache.get_stats()['stale_hits'] == 1
+
+
+def test_failed_fetch_returns_none(redis_client):
+    def fetch(user_id):
+        raise ConnectionError('LINE API down')
+
+    cache = make_cache(redis_client, fetch)
+    assert cache.get('U1') is None
+    assert cache.get_stats()['fetch_errors'] == 1
+
+
+def test_get_many_fetches_misses_concurrently(redis_client):
+    fetch = FakeProfiles(delay=0.2)
+    cache = make_cache(redis_client, fetch, max_workers=8)
+    cache.get('U0')
+
+    begin = time.monotonic()
+    names = cache.get_many(['U0', 'U1', 'U2', 'U3', 'U4', 'U1'])
+    elapsed = time.monotonic() - begin
+
+    assert names == {f'U{i}': f'name-U{i}' for i in range(5)}
+    assert sorted(fetch.calls) == ['U0', 'U1', 'U2', 'U3', 'U4']  # 重複與已快取的使用者不再抓取
+    assert elapsed < 0.6  # 四次 0.2 秒的抓取同時進行
+
+
+def test_get_many_returns_none_after_deadline_and_caches_late_result(redis_client):
+    fetch = FakeProfiles(delay=0.3)
+    cache = make_cache(redis_client, fetch)
+
+    begin = time.monotonic()
+    assert cache.get_many(['U1'], timeout=0.05) == {'U1': None}
+    assert time.monotonic() - begin < 0.25
+
+    cache._executor.shutdown(wait=True)
+    assert cache.get('U1') == 'name-U1'
+    assert fetch.calls == ['U1']
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import time
+from types import SimpleNamespace
+
+import migrations
+import order_lines
+from database import app, db, GroupOrder, UserOrder
+
+
+def test_timestamps_are_filled_per_row_by_the_database(db_manager):
+    """每筆資料的時間由資料庫於寫入時填入 (sqlite 的 CURRENT_TIMESTAMP 精確到秒，因此間隔超過一秒)"""
+    with app.app_context():
+        first_id = db_manager.create_group_order('R1', 'U_leader').id
+    db_manager.add_user_order(first_id, 'U1', order_lines.normalize(['紅茶']))
+
+    time.sleep(1.1)
+    with app.app_context():
+        second_id = db_manager.create_group_order('R2', 'U_leader').id
+    db_manager.add_user_order(first_id, 'U1', order_lines.normalize(['紅茶', '綠茶']))
+
+    with app.app_context():
+        first, second = db.session.get(GroupOrder, first_id), db.session.get(GroupOrder, second_id)
+        assert second.created_at > first.created_at
+        order = UserOrder.query.filter_by(group_order_id=first_id, user_id='U1').one()
+        assert order.updated_at > order.created_at
+
+
+class RecordingConnection:
+    """記錄 backfill 執行的 SQL，每個 UPDATE 回報一筆"""
+
+    def __init__(self):
+        self.statements = []
+        self.committed = self.rolled_back = False
+
+    def execute(self, statement, params=None):
+        self.statements.append(' '.join(str(statement).split()))
+        return SimpleNamespace(rowcount=1)
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def test_backfill_dry_run_rolls_back(monkeypatch):
+    conn = RecordingConnection()
+    monkeypatch.setattr(migrations, 'db', SimpleNamespace(text=db.text, engine=SimpleNamespace(connect=lambda: conn)))
+
+    counts = migrations.backfill_timestamps(dry_run=True)
+
+    assert set(counts) == {
+        'group_orders.created_at', 'user_orders.created_at',
+        'user_orders.updated_at', 'user_orders.group_created_at'
+    }
+    assert conn.rolled_back and not conn.committed
+
+
+def test_backfill_only_estimates_default_close_times(monkeypatch):
+    """自訂的閉團時間為整分鐘，無法由 close_time 推估建立時間"""
+    conn = RecordingConnection()
+    monkeypatch.setattr(migrations, 'db', SimpleNamespace(text=db.text, engine=SimpleNamespace(connect=lambda: conn)))
+
+    migrations.backfill_timestamps()
+
+    group_update = conn.statements[0]
+    assert "close_time <> date_trunc('minute', close_time)" in group_update
+    assert 'estimated.created_at > estimated.lower_bound' in group_update
+    assert conn.committed
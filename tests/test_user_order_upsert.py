@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import pytest
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+
+import order_lines
+from database import app, db, DatabaseManager, UserOrder
+
+
+def user_order_rows(group_order_id):
+    with app.app_context():
+        return [(row.user_id, row.items) for row in UserOrder.query.filter_by(group_order_id=group_order_id)]
+
+
+def test_repeated_changes_keep_one_row_per_user(db_manager):
+    with app.app_context():
+        group_id = db_manager.create_group_order('R1', 'U_leader').id
+
+    db_manager.add_user_order(group_id, 'U1', order_lines.normalize(['紅茶']))
+    db_manager.add_user_order(group_id, 'U1', order_lines.normalize(['紅茶', '紅茶']))
+    db_manager.adjust_user_order_item(group_id, 'U1', '紅茶', 1)
+    db_manager.add_user_order(group_id, 'U2', order_lines.normalize(['綠茶']))
+
+    rows = dict(user_order_rows(group_id))
+    assert set(rows) == {'U1', 'U2'}
+    assert rows['U1']['紅茶']['qty'] == 3
+
+
+def test_delete_removes_the_single_row(db_manager):
+    with app.app_context():
+        group_id = db_manager.create_group_order('R1', 'U_leader').id
+    db_manager.add_user_order(group_id, 'U1', order_lines.normalize(['紅茶']))
+    db_manager.add_user_order(group_id, 'U1', order_lines.normalize(['綠茶']))
+
+    assert db_manager.delete_user_order(group_id, 'U1') is True
+    assert user_order_rows(group_id) == []
+
+
+def test_unique_constraint_rejects_duplicate_rows(db_manager):
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U_leader')
+        db.session.add(UserOrder(group_order_id=group.id, user_id='U1', items={}))
+        db.session.commit()
+        db.session.add(UserOrder(group_order_id=group.id, user_id='U1', items={}))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+
+def test_upsert_statement_targets_group_and_user():
+    stmt = DatabaseManager.build_user_order_upsert([
+        {'group_order_id': 1, 'user_id': 'U1', 'items': {}},
+        {'group_order_id': 1, 'user_id': 'U2', 'items': {}},
+    ])
+
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert 'ON CONFLICT (group_order_id, user_id' in sql
+    assert 'DO UPDATE SET items = excluded.items' in sql
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+
+import pytest
+from redis.exceptions import ResponseError
+
+import order_lines
+from database import app, DatabaseManager, UserOrder
+from write_behind import UserOrderWriteBehind
+
+
+def stored_items(group_order_id, user_id):
+    with app.app_context():
+        row = UserOrder.query.filter_by(group_order_id=group_order_id, user_id=user_id).first()
+        return row.items if row else None
+
+
+def test_adjust_is_persisted_before_returning(db_manager):
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U_leader')
+    db_manager.adjust_user_order_item(group.id, 'U1', '珍奶(半糖)', 2, '珍奶', '半糖')
+    db_manager.adjust_user_order_item(group.id, 'U1', '珍奶(半糖)', -1)
+
+    assert stored_items(group.id, 'U1')['珍奶(半糖)']['qty'] == 1
+
+
+def test_delete_right_after_add_removes_redis_and_database(db_manager):
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U_leader')
+    db_manager.adjust_user_order_item(group.id, 'U1', '紅茶', 1)
+
+    assert db_manager.delete_user_order(group.id, 'U1') is True
+    assert db_manager.get_user_order(group.id, 'U1') is None
+    assert stored_items(group.id, 'U1') is None
+    assert db_manager.delete_user_order(group.id, 'U1') is False
+
+
+def test_persist_reads_latest_redis_state(db_manager):
+    """寫回一律以 Redis 當下的內容為準：較早的寫回不會把已刪除的訂單寫回資料庫"""
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U_leader')
+    db_manager.add_user_order(group.id, 'U1', order_lines.normalize(['綠茶']))
+    db_manager.delete_user_order(group.id, 'U1')
+
+    # 模擬在刪除之前排入、之後才執行的寫回
+    db_manager._persist_user_order(group.id, 'U1')
+    assert stored_items(group.id, 'U1') is None
+
+
+def order_state(manager, redis_client, group_order_id):
+    """訂單、品項總數、點餐人數與 write-behind stream 的內容"""
+    return (
+        redis_client.hgetall(f'group_order:{group_order_id}:orders'),
+        redis_client.hgetall(manager.TOTALS_KEY.format(group_order_id)),
+        redis_client.get(manager.PARTICIPANTS_KEY.format(group_order_id)),
+        redis_client.xlen(UserOrderWriteBehind.STREAM_KEY)
+    )
+
+
+@pytest.mark.parametrize('change', [
+    lambda manager, gid: manager.adjust_user_order_item(gid, 'U1', '珍奶', 10 ** 20),
+    lambda manager, gid: manager.adjust_user_order_item(gid, 'U1', '珍奶', 0.5),
+    lambda manager, gid: manager.adjust_user_order_item(gid, 'U1', '珍奶', 9999),
+    lambda manager, gid: manager._replace_order(gid, 'U1', '{"珍奶": {"item": "珍奶"'),
+    lambda manager, gid: manager._replace_order(gid, 'U1', '{"珍奶": {"item": "珍奶", "qty": 1e20}}'),
+], ids=['huge-delta', 'fractional-delta', 'line-over-limit', 'invalid-json', 'huge-qty'])
+def test_rejected_change_writes_nothing(database, redis_client, change):
+    """腳本在第一次寫入前驗證所有輸入，失敗時訂單、總數與 stream 都不會只更新一部分"""
+    write_behind = UserOrderWriteBehind(redis_client, logging.getLogger(__name__), flush_interval=3600)
+    manager = DatabaseManager(redis_client, write_behind=write_behind)
+    with app.app_context():
+        group = manager.create_group_order('R1', 'U_leader')
+    manager.adjust_user_order_item(group.id, 'U1', '珍奶', 2)
+    before = order_state(manager, redis_client, group.id)
+
+    with pytest.raises(ResponseError):
+        change(manager, group.id)
+
+    assert order_state(manager, redis_client, group.id) == before
+    assert manager.check_group_totals([group.id]) == []
+
+
+def test_adjust_converts_legacy_list_order(db_manager, redis_client):
+    """遷移前寫入的舊格式 (重複字串的清單) 在 Lua 腳本中先轉成品項格式再調整"""
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U_leader')
+    redis_client.hset(f'group_order:{group.id}:orders', 'U1', json.dumps(['紅茶(少冰)', '綠茶', '紅茶(少冰)']))
+    db_manager.check_group_totals([group.id])
+
+    order = db_manager.adjust_user_order_item(group.id, 'U1', '奶茶', 1)
+
+    assert order == {
+        '紅茶(少冰)': {'item': '紅茶', 'note': '少冰', 'qty': 2, 'seq': 1},
+        '綠茶': {'item': '綠茶', 'note': '', 'qty': 1, 'seq': 2},
+        '奶茶': {'item': '奶茶', 'note': '', 'qty': 1, 'seq': 3},
+    }
+    assert db_manager.get_user_order(group.id, 'U1') == order
+    assert stored_items(group.id, 'U1') == order
+    assert db_manager.get_group_totals(group.id) == {'紅茶(少冰)': 2, '綠茶': 1, '奶茶': 1}
+    assert db_manager.check_group_totals([group.id]) == []
+
+
+def fail_persist(*args, **kwargs):
+    raise ConnectionError('database down')
+
+
+def test_failed_persist_reverts_redis_so_retry_does_not_double_count(db_manager, redis_client, monkeypatch):
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U_leader')
+    db_manager.adjust_user_order_item(group.id, 'U1', '紅茶', 1)
+    before = order_state(db_manager, redis_client, group.id)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(db_manager, '_persist_user_order', fail_persist)
+        with pytest.raises(ConnectionError):
+            db_manager.adjust_user_order_item(group.id, 'U1', '紅茶', 1)
+        with pytest.raises(ConnectionError):
+            db_manager.add_user_order(group.id, 'U1', order_lines.normalize(['綠茶']))
+    assert order_state(db_manager, redis_client, group.id) == before
+
+    # 使用者重試後只加點一次
+    db_manager.adjust_user_order_item(group.id, 'U1', '紅茶', 1)
+    assert db_manager.get_user_order(group.id, 'U1')['紅茶']['qty'] == 2
+    assert stored_items(group.id, 'U1')['紅茶']['qty'] == 2
+
+
+def test_failed_delete_keeps_order_and_raises(db_manager, redis_client, monkeypatch):
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U_leader')
+    db_manager.adjust_user_order_item(group.id, 'U1', '紅茶', 2)
+    before = order_state(db_manager, redis_client, group.id)
+
+    monkeypatch.setattr(db_manager, '_persist_user_order', fail_persist)
+    with pytest.raises(ConnectionError):
+        db_manager.delete_user_order(group.id, 'U1')
+
+    assert order_state(db_manager, redis_client, group.id) == before
+
+
+def test_revert_does_not_overwrite_a_later_change(db_manager, redis_client, monkeypatch):
+    """寫回失敗前已有其他請求變更訂單時，不以變更前的內容覆寫"""
+    with app.app_context():
+        group = db_manager.create_group_order('R1', 'U_leader')
+
+    def concurrent_change_then_fail(group_order_id, user_id):
+        redis_client.hset(f'group_order:{group_order_id}:orders', user_id,
+                          json.dumps(order_lines.normalize(['綠茶'])))
+        raise ConnectionError('database down')
+
+    monkeypatch.setattr(db_manager, '_persist_user_order', concurrent_change_then_fail)
+    with pytest.raises(ConnectionError):
+        db_manager.adjust_user_order_item(group.id, 'U1', '紅茶', 1)
+
+    assert db_manager.get_user_order(group.id, 'U1') == order_lines.normalize(['綠茶'])
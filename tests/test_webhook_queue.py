@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+from linebot.v3.webhooks import FollowEvent, MessageEvent, TextMessageContent, UnfollowEvent
+
+import config
+from webhook_queue import WebhookEventDispatcher, WebhookEventQueue, WebhookQueueFullError
+
+
+def sign(body, secret='test-secret'):
+    return base64.b64encode(hmac.new(secret.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()).decode()
+
+
+class FakeEvent:
+    def __init__(self, user_id, webhook_event_id=None):
+        self.source = SimpleNamespace(user_id=user_id)
+        self.webhook_event_id = webhook_event_id
+
+
+class FakeHandler:
+    """只提供 WebhookEventQueue 用到的部分：parser.parse 與 dispatch"""
+
+    def __init__(self, func):
+        self.parser = SimpleNamespace(parse=lambda body, signature: [FakeEvent(body)])
+        self.dispatch = func
+
+
+def test_full_lane_raises_after_timeout_instead_of_blocking():
+    release = threading.Event()
+    started = threading.Event()
+
+    def handle(event):
+        started.set()
+        release.wait(5)
+
+    webhook_queue = WebhookEventQueue(FakeHandler(handle), Flask(__name__), num_workers=1, maxsize=1,
+                                      enqueue_timeout=0.05)
+    try:
+        webhook_queue.enqueue('U1', 'signature', 'http://localhost/')  # 由 worker 處理中
+        assert started.wait(5)
+        webhook_queue.enqueue('U1', 'signature', 'http://localhost/')  # 佔滿通道
+
+        begin = time.monotonic()
+        with pytest.raises(WebhookQueueFullError):
+            webhook_queue.enqueue('U1', 'signature', 'http://localhost/')  # 通道已滿
+        assert time.monotonic() - begin < 1
+
+        metrics = webhook_queue.get_metrics()
+        assert metrics['dropped'] == 1
+        assert metrics['overflow'] == 1
+        assert metrics['enqueued'] == 2
+    finally:
+        release.set()
+
+
+def test_redelivered_event_is_not_enqueued_twice():
+    handled = []
+    webhook_queue = WebhookEventQueue(FakeHandler(handled.append), Flask(__name__), num_workers=1)
+    webhook_queue.handler.parser.parse = lambda body, signature: [FakeEvent('U1', 'E1'), FakeEvent('U1', 'E2')]
+
+    webhook_queue.enqueue('body', 'signature', 'http://localhost/')
+    webhook_queue.enqueue('body', 'signature', 'http://localhost/')  # 重送
+    webhook_queue._lanes[0].join()
+
+    assert [event.webhook_event_id for event in handled] == ['E1', 'E2']
+    assert webhook_queue.get_metrics()['duplicate'] == 2
+
+
+@pytest.fixture
+def bot_app(monkeypatch, database):
+    """匯入主程式 (需要 channel secret)，停用請求中啟動的背景工作，並視為資料庫遷移已完成"""
+    monkeypatch.setattr(config.Config, 'CHANNEL_SECRET', 'test-secret')
+    monkeypatch.setattr(config.Config, 'CHANNEL_ACCESS_TOKEN', 'test-token')
+    import app_test_official_copy_postgresql as bot
+    monkeypatch.setattr(bot, 'start_background_services', lambda: None)
+    monkeypatch.setattr(bot, '_database_migrated', True)
+    return bot
+
+
+def follow_body():
+    return json.dumps({
+        'destination': 'Ubot',
+        'events': [{
+            'type': 'follow',
+            'mode': 'active',
+            'timestamp': 1700000000000,
+            'source': {'type': 'user', 'userId': 'U1'},
+            'webhookEventId': 'E1',
+            'deliveryContext': {'isRedelivery': False},
+            'replyToken': 'token'
+        }]
+    })
+
+
+def test_callback_returns_503_when_lane_is_full(bot_app, monkeypatch):
+    body = follow_body()
+    webhook_queue = WebhookEventQueue(bot_app.line_handler, bot_app.app, num_workers=1, maxsize=1,
+                                      enqueue_timeout=0.05)
+    monkeypatch.setattr(webhook_queue, 'start', lambda: None)  # 不啟動 worker，通道維持已滿
+    webhook_queue._lanes[0].put_nowait((None, 'http://localhost/', time.monotonic()))
+    monkeypatch.setattr(bot_app, 'webhook_queue', webhook_queue)
+
+    response = bot_app.app.test_client().post('/callback', data=body, headers={'X-Line-Signature': sign(body)})
+
+    assert response.status_code == 503
+    assert webhook_queue.get_metrics()['dropped'] == 1
+
+
+def test_callback_returns_503_until_migrations_finish(bot_app, monkeypatch):
+    handled = []
+    monkeypatch.setattr(bot_app, '_database_migrated', False)
+    monkeypatch.setattr(bot_app.env_config, 'AUTO_MIGRATE', True)
+    monkeypatch.setattr(bot_app, 'webhook_queue', None)
+    monkeypatch.setitem(bot_app.line_handler._handlers, 'FollowEvent', handled.append)
+    body = follow_body()
+    client = bot_app.app.test_client()
+
+    response = client.post('/callback', data=body, headers={'X-Line-Signature': sign(body)})
+    assert response.status_code == 503
+    assert handled == []
+
+    monkeypatch.setattr(bot_app, '_database_migrated', True)
+    response = client.post('/callback', data=body, headers={'X-Line-Signature': sign(body)})
+    assert response.status_code == 200
+    assert len(handled) == 1
+
+
+def test_dispatcher_routes_by_event_and_message_type():
+    dispatcher = WebhookEventDispatcher('test-secret')
+    handled = []
+    dispatcher.add(MessageEvent, message=TextMessageContent)(lambda event: handled.append('text'))
+    dispatcher.add(FollowEvent)(lambda event: handled.append('follow'))
+    dispatcher.default()(lambda event: handled.append('default'))
+
+    body = json.dumps({'destination': 'Ubot', 'events': [
+        {'type': 'message', 'mode': 'active', 'timestamp': 1, 'source': {'type': 'user', 'userId': 'U1'},
+         'webhookEventId': 'E1', 'deliveryContext': {'isRedelivery': False}, 'replyToken': 'token',
+         'message': {'type': 'text', 'id': 'M1', 'text': '紅茶', 'quoteToken': 'q'}},
+        {'type': 'follow', 'mode': 'active', 'timestamp': 1, 'source': {'type': 'user', 'userId': 'U1'},
+         'webhookEventId': 'E2', 'deliveryContext': {'isRedelivery': False}, 'replyToken': 'token'},
+        {'type': 'unfollow', 'mode': 'active', 'timestamp': 1, 'source': {'type': 'user', 'userId': 'U1'},
+         'webhookEventId': 'E3', 'deliveryContext': {'isRedelivery': False}},
+    ]})
+    events = dispatcher.parser.parse(body, sign(body))
+    assert isinstance(events[2], UnfollowEvent)
+
+    for event in events:
+        dispatcher.dispatch(event)
+
+    assert handled == ['text', 'follow', 'default']
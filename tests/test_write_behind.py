@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import order_lines
+from database import app, DatabaseManager, UserOrder
+from write_behind import UserOrderWriteBehind
+
+
+def make_write_behind(redis_client, **kwargs):
+    # 不讓背景執行緒在測試期間寫回，由測試直接呼叫 _poll
+    return UserOrderWriteBehind(redis_client, logging.getLogger(__name__), flush_interval=3600, **kwargs)
+
+
+def test_entries_of_crashed_consumer_are_claimed_and_flushed(database, redis_client):
+    write_behind = make_write_behind(redis_client, claim_idle_seconds=0)
+    manager = DatabaseManager(redis_client, write_behind=write_behind)
+    with app.app_context():
+        group = manager.create_group_order('R1', 'U_leader')
+        manager.add_user_order(group.id, 'U1', order_lines.normalize(['珍奶', '珍奶']))
+
+    # 已中斷的行程讀取後未確認，紀錄留在它的待處理清單
+    redis_client.xreadgroup(
+        write_behind.GROUP_NAME, 'crashed-consumer', {write_behind.STREAM_KEY: '>'}, count=10
+    )
+    assert redis_client.xpending(write_behind.STREAM_KEY, write_behind.GROUP_NAME)['pending'] == 1
+
+    # 一般輪次 (只讀新紀錄) 也必須寫回接手的紀錄
+    assert write_behind._poll(retry_pending=False) is False
+
+    with app.app_context():
+        rows = UserOrder.query.filter_by(group_order_id=group.id, user_id='U1').all()
+        assert [row.items['珍奶']['qty'] for row in rows] == [2]
+    assert redis_client.xpending(write_behind.STREAM_KEY, write_behind.GROUP_NAME)['pending'] == 0
+    assert redis_client.xlen(write_behind.STREAM_KEY) == 0
+    assert write_behind.get_metrics()['claimed_entries'] == 1
+
+
+def test_replay_flushes_deletes(database, redis_client):
+    write_behind = make_write_behind(redis_client)
+    manager = DatabaseManager(redis_client, write_behind=write_behind)
+    with app.app_context():
+        group = manager.create_group_order('R1', 'U_leader')
+        manager.add_user_order(group.id, 'U1', order_lines.normalize(['紅茶']))
+        write_behind.replay()
+        assert UserOrder.query.filter_by(group_order_id=group.id).count() == 1
+
+        assert manager.delete_user_order(group.id, 'U1') is True
+        write_behind.replay()
+        assert UserOrder.query.filter_by(group_order_id=group.id).count() == 0
+
+
+def test_rebuild_after_eviction_keeps_unflushed_orders(database, redis_client):
+    write_behind = make_write_behind(redis_client)
+    manager = DatabaseManager(redis_client, write_behind=write_behind)
+    with app.app_context():
+        group = manager.create_group_order('R1', 'U_leader')
+        manager.add_user_order(group.id, 'U1', order_lines.normalize(['紅茶']))
+        write_behind.replay()
+        manager.add_user_order(group.id, 'U1', order_lines.normalize(['紅茶', '紅茶', '綠茶']))
+
+        # 尚未寫回時團購的訂單被逐出 (maxmemory)，活躍團購索引也需重建
+        redis_client.delete(f'group_order:{group.id}:orders', manager.OPEN_GROUPS_SYNCED_KEY)
+        manager.rebuild_active_orders_cache()
+
+        items = UserOrder.query.filter_by(group_order_id=group.id, user_id='U1').one().items
+        assert {item: line['qty'] for item, line in items.items()} == {'紅茶': 2, '綠茶': 1}
+    assert manager.get_user_order(group.id, 'U1') == order_lines.normalize(['紅茶', '紅茶', '綠茶'])
+
+
+def test_rebuild_does_not_overwrite_orders_written_during_rebuild(database, redis_client, monkeypatch):
+    write_behind = make_write_behind(redis_client)
+    manager = DatabaseManager(redis_client, write_behind=write_behind)
+    with app.app_context():
+        group = manager.create_group_order('R1', 'U_leader')
+        manager.add_user_order(group.id, 'U1', order_lines.normalize(['紅茶']))
+        write_behind.replay()
+        # 模擬重建讀取 PostgreSQL 之後才寫入的變更
+        monkeypatch.setattr(write_behind, 'replay', lambda: 0)
+        manager.add_user_order(group.id, 'U1', order_lines.normalize(['綠茶']))
+
+        manager.rebuild_active_orders_cache()
+
+    assert manager.get_user_order(group.id, 'U1') == order_lines.normalize(['綠茶'])
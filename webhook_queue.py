@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Webhook 非同步處理佇列
+
+/callback 只負責驗證簽名並將事件放入有界佇列，隨即回覆 LINE Platform；
+實際的資料庫、Redis 與 LINE API 操作交由背景 worker 執行緒處理。
+
+事件依來源 (使用者 / 群組 / 聊天室) 分配到固定的 worker 通道：
+同一使用者的事件依序處理，不同使用者之間平行處理。
+佇列位於行程記憶體中，依序處理只在同一個行程內成立；多個 worker 行程時，
+同一使用者的事件可能由不同行程接收而平行處理。
+
+通道已滿時最多等待 enqueue_timeout 秒，仍無空位則拋出 WebhookQueueFullError (記錄於 dropped 統計)，
+/callback 回覆 503 讓 LINE Platform 稍後重送 (需在 LINE Developers 開啟 Webhook redelivery)。
+重送的內容包含同一請求中已排入佇列的事件，依 webhook_event_id 略過，避免同一訂單變更處理兩次。
+"""
+import logging
+import queue
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from linebot.v3 import WebhookParser
+from linebot.v3.webhooks import MessageEvent
+
+
+class WebhookEventDispatcher:
+    """
+    與 WebhookHandler 相同的 add / default / handle 介面，另提供逐一事件的 dispatch()
+
+    事件處理函式登記在本類別自己的對應表，佇列的 worker 不需存取 SDK 的私有屬性。
+    處理函式一律以 func(event) 呼叫。
+    """
+
+    def __init__(self, channel_secret):
+        self.parser = WebhookParser(channel_secret)
+        self._handlers = {}
+        self._default = None
+
+    def add(self, event, message=None):
+        """登記事件處理函式的 decorator；MessageEvent 可再依訊息類型 (可為 list / tuple) 區分"""
+        def decorator(func):
+            messages = message if isinstance(message, (list, tuple)) else [message]
+            for message_class in messages:
+                self._handlers[self._handler_key(event, message_class)] = func
+            return func
+        return decorator
+
+    def default(self):
+        """登記沒有對應處理函式時使用的 decorator"""
+        def decorator(func):
+            self._default = func
+            return func
+        return decorator
+
+    def handle(self, body, signature):
+        """驗證簽名後依序處理請求中的所有事件 (同步模式)"""
+        for event in self.parser.parse(body, signature):
+            self.dispatch(event)
+
+    def dispatch(self, event):
+        """依照 WebhookHandler.handle 的規則找出對應的處理函式並執行"""
+        func = None
+        if isinstance(event, MessageEvent):
+            func = self._handlers.get(self._handler_key(event.__class__, event.message.__class__))
+        if func is None:
+            func = self._handlers.get(self._handler_key(event.__class__))
+        if func is None:
+            func = self._default
+        if func is None:
+            logging.getLogger(__name__).info(f"沒有 {event.__class__.__name__} 的處理函式")
+            return
+        func(event)
+
+    @staticmethod
+    def _handler_key(event, message=None):
+        return event.__name__ if message is None else f'{event.__name__}_{message.__name__}'
+
+
+class WebhookQueueFullError(Exception):
+    """事件所屬的通道在 enqueue_timeout 內仍無空位，呼叫端應回覆 503 讓 LINE Platform 重送"""
+
+
+class WebhookEventQueue:
+    """有界的 Webhook 事件佇列，每個 worker 執行緒擁有一條依來源分片的通道"""
+
+    def __init__(self, handler, app, num_workers=4, maxsize=1000, enqueue_timeout=1.0, recent_event_ids=10000):
+        self.handler = handler  # WebhookEventDispatcher，用於驗證簽名與分派事件
+        self.app = app
+        self.num_workers = num_workers
+        self.enqueue_timeout = enqueue_timeout  # 通道已滿時等待空位的最長秒數
+        # 每條通道由單一 worker 依序消化，總容量平均分配給各通道
+        lane_size = max(1, maxsize // num_workers)
+        self._lanes = [queue.Queue(maxsize=lane_size) for _ in range(num_workers)]
+        self._workers = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'enqueued': 0, 'processed': 0, 'failed': 0, 'overflow': 0, 'dropped': 0, 'duplicate': 0}
+        # 最近排入佇列的 webhook_event_id，重送時略過已排入的事件
+        self._recent_event_ids = OrderedDict()
+        self._recent_event_ids_max = recent_event_ids
+
+    def start(self):
+        """啟動 worker 執行緒 (重複呼叫不會重複啟動)"""
+        with self._start_lock:
+            if self._workers:
+                return
+            for index, lane in enumerate(self._lanes):
+                worker = threading.Thread(target=self._worker, args=(lane,), name=f'webhook-worker-{index}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def enqueue(self, body, signature, url_root):
+        """
+        驗證簽名並將事件放入佇列。
+
+        簽名錯誤時拋出 InvalidSignatureError；通道已滿時最多等待 enqueue_timeout 秒 (記錄於 overflow 統計)，
+        仍無空位時拋出 WebhookQueueFullError (記錄於 dropped 統計)，該事件與其後的事件皆未排入佇列。
+        """
+        events = self.handler.parser.parse(body, signature)
+        self.start()
+        for event in events:
+            event_id = getattr(event, 'webhook_event_id', None)
+            if event_id is not None and self._seen(event_id):
+                self._count('duplicate')
+                continue
+            lane = self._lanes[self._lane_index(event)]
+            item = (event, url_root, time.monotonic())
+            try:
+                lane.put_nowait(item)
+            except queue.Full:
+                self._count('overflow')
+                try:
+                    lane.put(item, timeout=self.enqueue_timeout)
+                except queue.Full:
+                    self._count('dropped')
+                    raise WebhookQueueFullError(
+                        f"Webhook 通道已滿，無法排入 {event.__class__.__name__} 事件 (通道 {self._lane_index(event)})"
+                    )
+            if event_id is not None:
+                self._remember(event_id)
+            self._count('enqueued')
+
+    def _seen(self, event_id):
+        with self._stats_lock:
+            return event_id in self._recent_event_ids
+
+    def _remember(self, event_id):
+        with self._stats_lock:
+            self._recent_event_ids[event_id] = None
+            if len(self._recent_event_ids) > self._recent_event_ids_max:
+                self._recent_event_ids.popitem(last=False)
+
+    def _lane_index(self, event):
+        """依事件來源計算通道編號，同一來源永遠落在同一條通道"""
+        source = getattr(event, 'source', None)
+        shard_key = (
+            getattr(source, 'user_id', None)
+            or getattr(source, 'group_id', None)
+            or getattr(source, 'room_id', None)
+            or ''
+        )
+        return zlib.crc32(shard_key.encode('utf-8')) % len(self._lanes)
+
+    def get_metrics(self):
+        """回傳佇列深度 (總計與各通道)、最舊事件等待秒數與處理統計"""
+        lane_depths = []
+        oldest = None
+        for lane in self._lanes:
+            with lane.mutex:
+                lane_depths.append(len(lane.queue))
+                if lane.queue and (oldest is None or lane.queue[0][2] < oldest):
+                    oldest = lane.queue[0][2]
+        with self._stats_lock:
+            metrics = dict(self._stats)
+        metrics['queue_depth'] = sum(lane_depths)
+        metrics['lane_depths'] = lane_depths
+        metrics['oldest_event_age_seconds'] = round(time.monotonic() - oldest, 3) if oldest is not None else 0
+        metrics['workers'] = len(self._workers)
+        return metrics
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _worker(self, lane):
+        while True:
+            item = lane.get()
+            try:
+                self._process(item)
+            finally:
+                lane.task_done()
+
+    def _process(self, item):
+        """在帶有原始 url_root 的 request context 中執行事件處理函式"""
+        event, url_root, _ = item
+        try:
+            with self.app.test_request_context(base_url=url_root):
+                self.handler.dispatch(event)
+            self._count('processed')
+        except Exception as e:
+            self._count('failed')
+            self.app.logger.error(f"處理 Webhook 事件時發生錯誤: {e}")
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+用戶訂單的 write-behind 寫回佇列
+
+啟用後，訂單變更只寫入 Redis：訂單內容與一筆變更紀錄 (Redis stream) 在同一個原子操作中寫入，
+不需等待 PostgreSQL commit 即可回覆使用者。背景執行緒每隔 flush_interval 秒從 stream 讀取變更，
+依 (group_order_id, user_id) 合併後以單一 transaction 批次寫回 PostgreSQL，成功後才確認 (XACK) 並刪除紀錄。
+
+寫回時一律以 Redis 中當下的訂單內容為準，因此多個行程同時寫回或順序交錯時，PostgreSQL 仍會收斂到最新狀態；
+stream 中的內容僅在 Redis 的訂單已不存在時使用。
+行程中斷時未確認的紀錄仍保留在 stream 中：啟動時以 replay() 全部寫回，其他行程也會接手閒置過久的紀錄。
+由 PostgreSQL 重建 Redis 快取前同樣先 replay()，且不覆寫仍在 stream 中的訂單，避免以舊資料取代尚未寫回的變更。
+"""
+import json
+import os
+import socket
+import threading
+import time
+
+from redis.exceptions import ResponseError
+from sqlalchemy import delete, tuple_
+
+import order_lines
+from database import app, db, DatabaseManager, UserOrder
+
+
+class UserOrderWriteBehind:
+    """以 Redis stream 記錄訂單變更，並在背景批次寫回 PostgreSQL"""
+
+    STREAM_KEY = 'user_orders:write_behind'
+    GROUP_NAME = 'user_order_flusher'
+
+    def __init__(self, redis_client, logger, flush_interval=1.0, batch_size=500, claim_idle_seconds=60):
+        self.redis = redis_client
+        self.logger = logger
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # 其他行程讀取後超過此秒數仍未確認的紀錄，視為該行程已中斷並由本行程接手
+        self.claim_idle_ms = int(claim_idle_seconds * 1000)
+        self.consumer = f'{socket.gethostname()}-{os.getpid()}'
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'flushed_entries': 0, 'upserted_rows': 0, 'deleted_rows': 0,
+            'replayed_entries': 0, 'claimed_entries': 0, 'failed_flushes': 0
+        }
+        self._last_flush_at = None
+
+    def start(self):
+        """啟動背景寫回執行緒 (重複呼叫不會重複啟動)"""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._ensure_group()
+            self._thread = threading.Thread(target=self._run, name='user-order-write-behind', daemon=True)
+            self._thread.start()
+
+    def replay(self):
+        """
+        將 stream 中所有尚未寫回的紀錄 (包含其他已中斷行程讀取過的) 寫回 PostgreSQL
+
+        啟動時、清除 Redis 之前呼叫。
+
+        Returns:
+            int: 寫回的紀錄筆數
+        """
+        self._ensure_group()
+        replayed = 0
+        while True:
+            entries = self.redis.xrange(self.STREAM_KEY, min='-', max='+', count=self.batch_size)
+            if not entries:
+                break
+            self._flush(entries)
+            replayed += len(entries)
+        self._count('replayed_entries', replayed)
+        return replayed
+
+    def pending_keys(self):
+        """
+        回傳 stream 中尚未寫回的 (group_order_id, user_id)
+
+        這些訂單在 PostgreSQL 中可能仍是舊資料，由 PostgreSQL 重建 Redis 時不可覆寫。
+        """
+        keys = set()
+        start = '-'
+        while True:
+            entries = self.redis.xrange(self.STREAM_KEY, min=start, max='+', count=self.batch_size)
+            for _, fields in entries:
+                if fields:
+                    keys.add((fields['group_order_id'], fields['user_id']))
+            if len(entries) < self.batch_size:
+                return keys
+            start = '(' + entries[-1][0]
+
+    def get_metrics(self):
+        """回傳 stream 長度、待確認筆數與寫回統計"""
+        with self._stats_lock:
+            metrics = dict(self._stats)
+        try:
+            metrics['stream_length'] = self.redis.xlen(self.STREAM_KEY)
+            metrics['pending'] = self.redis.xpending(self.STREAM_KEY, self.GROUP_NAME)['pending']
+        except ResponseError:
+            metrics['stream_length'] = 0
+            metrics['pending'] = 0
+        metrics['last_flush_age_seconds'] = (
+            round(time.monotonic() - self._last_flush_at, 3) if self._last_flush_at is not None else None
+        )
+        metrics['running'] = self._thread is not None
+        return metrics
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def _ensure_group(self):
+        """建立 stream 與 consumer group (已存在時略過)"""
+        try:
+            self.redis.xgroup_create(self.STREAM_KEY, self.GROUP_NAME, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def _run(self):
+        # 啟動時先處理本 consumer 名下尚未確認的紀錄
+        retry_pending = True
+        while True:
+            time.sleep(self.flush_interval)
+            retry_pending = self._poll(retry_pending)
+
+    def _poll(self, retry_pending):
+        """
+        接手閒置的紀錄並寫回一輪
+
+        Returns:
+            bool: 下一輪是否需要重新處理待處理清單
+        """
+        try:
+            # 接手的紀錄位於本 consumer 的待處理清單，'>' 讀不到，本輪需從待處理清單讀取
+            if self._claim_idle():
+                retry_pending = True
+            return not self._drain(retry_pending)
+        except ResponseError as e:
+            # Redis 被清空時 consumer group 會一併消失，重新建立後下一輪再處理
+            if 'NOGROUP' in str(e):
+                self._ensure_group()
+            else:
+                self.logger.error(f"讀取訂單寫回紀錄時發生錯誤: {e}")
+        except Exception as e:
+            self.logger.error(f"讀取訂單寫回紀錄時發生錯誤: {e}")
+        return retry_pending
+
+    def _claim_idle(self):
+        """
+        接手其他行程讀取後長時間未確認的紀錄，放入本 consumer 的待處理清單
+
+        Returns:
+            int: 接手的紀錄筆數
+        """
+        # justid=True 時 redis-py 只回傳接手的紀錄 id 清單
+        claimed = self.redis.xautoclaim(
+            self.STREAM_KEY, self.GROUP_NAME, self.consumer,
+            min_idle_time=self.claim_idle_ms, start_id='0-0', count=self.batch_size, justid=True
+        )
+        if claimed:
+            self._count('claimed_entries', len(claimed))
+        return len(claimed)
+
+    def _drain(self, retry_pending):
+        """
+        讀取並寫回紀錄直到 stream 中沒有新紀錄
+
+        Returns:
+            bool: 全部寫回成功時回傳 True；失敗的紀錄留在待處理清單，下一輪重試
+        """
+        read_id = '0' if retry_pending else '>'
+        while True:
+            response = self.redis.xreadgroup(
+                self.GROUP_NAME, self.consumer, {self.STREAM_KEY: read_id}, count=self.batch_size
+            )
+            entries = response[0][1] if response else []
+            if not entries:
+                if read_id == '0':
+                    # 待處理清單已清空，改讀新的紀錄
+                    read_id = '>'
+                    continue
+                return True
+            try:
+                self._flush(entries)
+            except Exception as e:
+                self._count('failed_flushes')
+                self.logger.error(f"批次寫回訂單時發生錯誤，將於下一輪重試: {e}")
+                return False
+            if len(entries) < self.batch_size and read_id == '>':
+                return True
+
+    def _flush(self, entries):
+        """合併同一用戶的紀錄，以單一 transaction 寫回 PostgreSQL，成功後確認並刪除紀錄"""
+        latest = {}
+        for _, fields in entries:
+            # 已被刪除的紀錄在待處理清單中只剩下 id
+            if fields:
+                latest[(fields['group_order_id'], fields['user_id'])] = fields
+
+        if latest:
+            keys = list(latest)
+            pipe = self.redis.pipeline(transaction=False)
+            for group_order_id, user_id in keys:
+                pipe.hget(f'group_order:{group_order_id}:orders', user_id)
+            current_orders = pipe.execute()
+
+            upserts = []
+            deletes = []
+            for (group_order_id, user_id), encoded in zip(keys, current_orders):
+                fields = latest[(group_order_id, user_id)]
+                if encoded is None:
+                    if fields['op'] == 'delete':
+                        deletes.append((int(group_order_id), user_id))
+                        continue
+                    encoded = fields['items']
+                upserts.append({
+                    'group_order_id': int(group_order_id),
+                    'user_id': user_id,
+                    'items': order_lines.normalize(json.loads(encoded))
+                })
+
+            with app.app_context():
+                try:
+                    if upserts:
+                        db.session.execute(DatabaseManager.build_user_order_upsert(upserts))
+                    if deletes:
+                        db.session.execute(delete(UserOrder).where(
+                            tuple_(UserOrder.group_order_id, UserOrder.user_id).in_(deletes)
+                        ))
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+            self._count('upserted_rows', len(upserts))
+            self._count('deleted_rows', len(deletes))
+
+        entry_ids = [entry_id for entry_id, _ in entries]
+        pipe = self.redis.pipeline()
+        pipe.xack(self.STREAM_KEY, self.GROUP_NAME, *entry_ids)
+        pipe.xdel(self.STREAM_KEY, *entry_ids)
+        pipe.execute()
+        self._count('flushed_entries', len(entries))
+        self._last_flush_at = time.monotonic()